@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import sys
+import argparse
+import time
+import tracemalloc
+
+import uds
+
+from pyds.extuds import ExtendedUDS
+from pyds.types import Normal
+
+from benchmarks.bench_types import F106
+
+
+class Channel(object):
+    """
+    UDS channel always answering with the same reply
+    """
+
+    def __init__(self, did, payload):
+        self.reply = uds.UDSMessage(bytearray([uds.UDS_SERVICES_RDBI | uds.UDS_REPLY_MASK]) +
+                                    ExtendedUDS.int16tobytes(did) + payload)
+
+    def send(self, message, timeout):
+        return self.reply
+
+
+def poll(channel, did, number, copy):
+    peak = 0
+    retained = 0
+    start = time.time()
+    for i in range(number):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        data = Normal(channel.send_rdbi(did, 2000, copy=copy), copy=copy)
+        data.get_value(0, 65535)
+        current, maximum = tracemalloc.get_traced_memory()
+        peak += maximum - before
+        retained += current - before
+        del data
+    return peak / number, retained / number, (time.time() - start) * 1000000 / number
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="DID polling allocation benchmark")
+    parser.add_argument('-n', '--number', type=int, default=100000, help="number of reads")
+    parser.add_argument('-s', '--size', type=int, help="size of a synthetic payload instead of F106")
+    args = parser.parse_args(argv[1:])
+
+    did = 0xf106
+    payload = F106 if args.size is None else bytearray(args.size)
+    channel = ExtendedUDS(Channel(did, payload), False)
+
+    tracemalloc.start()
+    # Peak counts every temporary buffer of a read, retained what is still held by the decoded object
+    print("%-10s %16s %16s %16s" % ("Mode", "peak bytes/read", "held bytes/read", "us/read"))
+    for mode, copy in (("copy", True), ("view", False)):
+        print("%-10s %16.1f %16.1f %16.2f" % ((mode,) + poll(channel, did, args.number, copy)))
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
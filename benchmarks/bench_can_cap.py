@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import os
+import random
+import re
+import shutil
+import sys
+import argparse
+import tempfile
+import time
+
+import can_cap
+
+CALL = """On %(date)s, %(action)s O: 1
+    ChannelID: %(channel)d
+    pMsg[0]:
+        ProtocolID: CAN
+        RxStatus: No Flags Set
+        TxFlags: 0x00000000
+        Data [%(length)d]: %(data)s
+
+    pNumMsgs: 1
+
+
+"""
+
+
+def generate_log(path, frames, seed=0):
+    """
+    Writes a log of frames CAN messages on two channels
+    """
+    rand = random.Random(seed)
+    start = 1451606400
+    with open(path, 'w') as f:
+        for i in range(frames):
+            timestamp = start + i * 0.0005
+            date = time.strftime('%m/%d/%Y at %H:%M:%S', time.gmtime(timestamp)) + '.%06d' % (
+                int(round(timestamp * 1000000)) % 1000000)
+            data = [0x00, 0x00, 0x07, rand.choice([0xe0, 0xe8])] + [rand.randint(0, 255) for x in range(8)]
+            f.write(CALL % dict(date=date, action=rand.choice(['PassThruReadMsgs', 'PassThruWriteMsgs']),
+                                channel=1 + i % 2, length=len(data), data=" ".join(['%02x' % x for x in data])))
+
+
+def struct_write_pcap(ostream, path):
+    with open(path, 'rb') as istream:
+        return can_cap.write_pcap(ostream, can_cap.get_packets(can_cap.parse_log(istream)), '1')['1']
+
+
+# Conversion of can_cap.py before the streaming parser
+BASELINE_REGEX = re.compile(
+    r"On ([^,]+), (\w+?) O:.*" + r"\s*ChannelID:\s*(\d+)\s*\n" + ".*" + r"\s*RxStatus:\s*([^\n]*)\s*\n" + ".*" +
+    r"\s*Data \[\w+\]:\s*(.*)\s*\n\n" + ".*",
+    re.DOTALL | re.MULTILINE)
+
+
+def baseline_write_pcap(ostream, path):
+    """
+    The conversion of the first can_cap.py: the whole log split in groups matched with a regular expression,
+    strptime and int(x, 16) for each record, the packets built with construct once the log is parsed
+    """
+    with open(path, 'rb') as f:
+        data = b''.join(f.readlines()).decode('latin-1')
+    data = data.replace('\r\n', '\n')
+    packets = []
+    for group in data.split('\n\n\n'):
+        for date, action, channel, rxstatus, line in BASELINE_REGEX.findall(group):
+            if channel != '1':
+                continue
+            if action == 'PassThruWriteMsgs' or (action == 'PassThruReadMsgs' and rxstatus == 'No Flags Set'):
+                entries = [int(x, 16) for x in line.split()]
+                packet = can_cap.can_packet.build(dict(
+                    id=(entries[0] << 24) + (entries[1] << 16) + (entries[2] << 8) + entries[3],
+                    dlc=len(entries) - 4, data=bytes(bytearray(entries[4:]))))
+                packets.append(dict(time=can_cap.parse_can_date(date), inc_length=len(packet),
+                                    orig_length=len(packet), data=packet))
+    ostream.write(can_cap.cap_header.build(dict(thiszone=0, sigfigs=0, snaplen=can_cap.PCAP_SNAPLEN)))
+    for packet in packets:
+        ostream.write(can_cap.cap_packet.build(packet))
+    return len(packets)
+
+
+def run(path, output, write):
+    """
+    Returns the number of frames written and the duration of the conversion
+    """
+    start = time.time()
+    with open(output, 'wb') as ostream:
+        frames = write(ostream, path)
+    return frames, time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="J2534 log to pcap conversion benchmark")
+    parser.add_argument('-n', '--number', type=int, default=1000000, help="frames of the synthetic log")
+    parser.add_argument('-r', '--reference', type=int, default=100000,
+                        help="frames converted as the first can_cap.py did, 0 to skip")
+    parser.add_argument('-j', '--jobs', type=int, default=0, help="processes of the parallel conversion")
+    args = parser.parse_args(argv[1:])
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'log.txt')
+        output = os.path.join(directory, 'log.pcap')
+        generate_log(path, args.number)
+        print("%d frames, %.1f MB" % (args.number, os.path.getsize(path) / 1000000.0))
+
+        # Only the frames of the channel 1 are written
+        frames, elapsed = run(path, output, struct_write_pcap)
+        print("%-10s %12.0f frames/s (%d frames written)" % ("struct", frames / elapsed, frames))
+
+        if args.jobs > 1:
+            start = time.time()
+            can_cap.main(['can_cap', '-c', '1', '-j', str(args.jobs), path])
+            print("%-10s %12.0f frames/s" % ("%d jobs" % (args.jobs), frames / (time.time() - start)))
+
+        if args.reference > 0 and hasattr(can_cap, 'cap_packet'):
+            reference_path = os.path.join(directory, 'reference.txt')
+            reference_output = os.path.join(directory, 'reference.pcap')
+            generate_log(reference_path, args.reference)
+            frames, elapsed = run(reference_path, reference_output, baseline_write_pcap)
+            print("%-10s %12.0f frames/s (%d frames written)" % ("baseline", frames / elapsed, frames))
+            # Both conversions must write the same file
+            run(reference_path, output, struct_write_pcap)
+            with open(output, 'rb') as f:
+                with open(reference_output, 'rb') as reference:
+                    if f.read() != reference.read():
+                        raise Exception("The baseline and struct conversions differ")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
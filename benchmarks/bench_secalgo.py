@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import sys
+import argparse
+import random
+import time
+
+from pyds.structs import Algorithm
+from pyds.secalgo import security_algorithms
+
+try:
+    from pyds.secbatch import compute_keys
+except ImportError:
+    compute_keys = None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="Security algorithm benchmark")
+    parser.add_argument('-n', '--number', type=int, default=100000, help="number of keys")
+    args = parser.parse_args(argv[1:])
+
+    rand = random.Random(0)
+    seeds = [bytearray([rand.randint(0, 255) for x in range(3)]) for i in range(args.number)]
+    vehicle_seed = [75, 48, 50, 49, 54, 0]
+
+    print("%-10s %16s" % ("Engine", "keys/s"))
+    for engine, cls in sorted(security_algorithms[Algorithm.Ford].items()):
+        algo = cls(vehicle_seed)
+        start = time.time()
+        for seed in seeds:
+            algo.compute(seed)
+        print("%-10s %16.0f" % (engine, args.number / (time.time() - start)))
+
+    if compute_keys is not None:
+        import numpy
+        array = numpy.array([list(seed) for seed in seeds], dtype=numpy.uint8)
+        start = time.time()
+        compute_keys(array, vehicle_seed)
+        print("%-10s %16.0f" % ("numpy", args.number / (time.time() - start)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import sys
+import argparse
+import timeit
+
+from pyds.types import Normal, MCP_BCE_2
+
+DE00 = bytearray([0x45, 0x50, 0x00, 0x06, 0xA1, 0xA5, 0x0C, 0x43, 0x00, 0x08, 0x00, 0x38, 0x92, 0x10])
+
+DE01 = bytearray([0x00, 0x38, 0x10, 0xa0, 0x70])
+
+F106 = bytearray([0x19, 0x96, 0x00, 0x80, 0xff, 0xff, 0xff, 0xff, 0xc1, 0x00, 0x33, 0x4d, 0x5a, 0x42, 0x4d,
+                  0x36, 0xc1, 0x01, 0x34, 0x36, 0x36, 0x31, 0x4d, 0x31, 0xc1, 0x02, 0x32, 0x36, 0x36, 0x31,
+                  0x33, 0x00, 0xc1, 0x03, 0x38, 0x00, 0x1b, 0x09, 0x92, 0x00, 0xc1, 0x04, 0x00, 0x00, 0x07,
+                  0xbd, 0x00, 0x00, 0xbf, 0x01, 0x31, 0x00, 0x00, 0x00, 0x00, 0x00, 0xbf, 0x02, 0x20, 0x00,
+                  0x00, 0x00, 0x00, 0x13, 0xbf, 0x03, 0x20, 0x00, 0x01, 0x00, 0x00, 0x00, 0xbf, 0x04, 0x30,
+                  0x80, 0x00, 0x2c, 0x00, 0x00, 0xbf, 0x05, 0x10, 0x00, 0x00, 0x00, 0x00, 0x00, 0xbf, 0x06,
+                  0x10, 0x00, 0x00, 0x20, 0x00, 0x00, 0xbf, 0x07, 0x00, 0x00, 0x00, 0x10, 0x00, 0x00, 0xbf,
+                  0x08, 0x21, 0x20, 0x01, 0x00, 0x00, 0x00, 0xbf, 0x09, 0x40, 0x00, 0x00, 0x20, 0x00, 0x00,
+                  0xbf, 0x10, 0x10, 0x00, 0x00, 0x20, 0x00, 0x00, 0xbf, 0x11, 0x20, 0x03, 0x80, 0x00, 0x00,
+                  0x00])
+
+# (name, type, payload, [(offset, mask)]) using the fields of pyds.actions
+PAYLOADS = [
+    ('DE00', Normal, DE00, [(0xB * 8 + 4, 1), (0x1 * 8 + 7, 1), (0x9 * 8 + 3, 1), (0x9 * 8 + 4, 7)]),
+    ('DE01', MCP_BCE_2, DE01, [(16, 7), (0, 15), (19, 3), (26, 7)]),
+    ('F106', Normal, F106, [(0, 65535), (((16 - 1) * 5 + 2) * 8 + 6, 1), (((16 - 1) * 5 + 2) * 8 + 5, 1)]),
+]
+
+
+class BitList(object):
+    """
+    The bit list implementation, driven through the reference helpers
+    """
+
+    def __init__(self, type, bytes):
+        self.type = type
+        self.bits = type._bytearraytobitarray(bytes)
+
+    def to_bytearray(self):
+        return self.type._bitarraytobytearray(self.bits)
+
+    def get_value(self, offset, mask):
+        return self.type._get_value(self.bits, offset, mask)
+
+    def set_value(self, offset, mask, value):
+        self.type._set_value(self.bits, offset, mask, value)
+
+
+def run(name, factory, payload, fields, number):
+    obj = factory(payload)
+
+    def construct():
+        factory(payload).to_bytearray()
+
+    def get():
+        for offset, mask in fields:
+            obj.get_value(offset, mask)
+
+    def set():
+        for offset, mask in fields:
+            obj.set_value(offset, mask, obj.get_value(offset, mask))
+
+    return [min(timeit.repeat(f, number=number, repeat=3)) * 1000000 / number for f in (construct, get, set)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="Bit field engine benchmark")
+    parser.add_argument('-n', '--number', type=int, default=10000, help="iterations per measure")
+    args = parser.parse_args(argv[1:])
+
+    print("%-6s %-10s %12s %12s %12s" % ("DID", "Engine", "build (us)", "get (us)", "set (us)"))
+    for name, type, payload, fields in PAYLOADS:
+        results = {}
+        for engine, factory in (('bit list', lambda x: BitList(type, x)), ('bytearray', type)):
+            results[engine] = run(name, factory, payload, fields, args.number)
+            print("%-6s %-10s %12.2f %12.2f %12.2f" % ((name, engine) + tuple(results[engine])))
+        print("%-6s %-10s %11.1fx %11.1fx %11.1fx" % ((name, 'speedup') + tuple(
+            [a / b for a, b in zip(results['bit list'], results['bytearray'])])))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
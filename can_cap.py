@@ -6,54 +6,151 @@ from __future__ import print_function
 J2534 log to pcap file
 """
 
+import gzip
+import io
+import multiprocessing
 import os
+import shutil
+import struct
 import sys
 import argparse
+import bisect
+import mmap
 import re
+import tempfile
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
-from construct import *
 from calendar import timegm
 from datetime import datetime
 
-class MicrosecAdapter(Adapter):
-    def _decode(self, obj, context):
-        return datetime.utcfromtimestamp(obj[0] + (obj[1] / 1000000.0))
-
-    def _encode(self, obj, context):
-        sec = timegm(obj.utctimetuple())
-        usec = obj.microsecond
-        return (sec, usec)
-
-
-can_packet = Struct(
-    "id" / Int32ub,
-    "dlc" / Int8ul,
-    Padding(3),
-    "data" / Bytes(lambda ctx: ctx.dlc),
-)
-
-cap_packet = Struct(
-    MicrosecAdapter(
-        "time" / Sequence(
-            "sec" / Int32ul,
-            "usec" / Int32ul,
-        )
-    ),
-    "inc_length" / Int32ul,
-    "orig_length" / Int32ul,
-    "data" / Bytes(lambda ctx: ctx.inc_length),
-)
-
-cap_file = Struct(
-    "magic_number" / Const(0xa1b2c3d4, Int32ul),
-    "version_major" / Const(0x2, Int16ul),
-    "version_minor" / Const(0x4, Int16ul),
-    "thiszone" / Int32sl,
-    "sigfigs" / Int32ul,
-    "snaplen" / Int32ul,
-    "network" / Const(0xe3, Int32ul),
-    "packets" / GreedyRange(cap_packet),
-)
+# construct is only needed to validate the files
+try:
+    from construct import *
+except ImportError:
+    Adapter = None
+
+if Adapter is not None:
+    class MicrosecAdapter(Adapter):
+        def _decode(self, obj, context, path=None):
+            return datetime.utcfromtimestamp(obj[0] + (obj[1] / 1000000.0))
+
+        def _encode(self, obj, context, path=None):
+            sec = timegm(obj.utctimetuple())
+            usec = obj.microsecond
+            return (sec, usec)
+
+    can_packet = Struct(
+        "id" / Int32ub,
+        "dlc" / Int8ul,
+        Padding(3),
+        "data" / Bytes(lambda ctx: ctx.dlc),
+    )
+
+    cap_packet = Struct(
+        "time" / MicrosecAdapter(
+            Sequence(
+                "sec" / Int32ul,
+                "usec" / Int32ul,
+            )
+        ),
+        "inc_length" / Int32ul,
+        "orig_length" / Int32ul,
+        "data" / Bytes(lambda ctx: ctx.inc_length),
+    )
+
+    cap_header = Struct(
+        "magic_number" / Const(0xa1b2c3d4, Int32ul),
+        "version_major" / Const(0x2, Int16ul),
+        "version_minor" / Const(0x4, Int16ul),
+        "thiszone" / Int32sl,
+        "sigfigs" / Int32ul,
+        "snaplen" / Int32ul,
+        "network" / Const(0xe3, Int32ul),
+    )
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_NSEC_MAGIC = 0xa1b23c4d
+PCAP_SNAPLEN = 0xfffff
+LINKTYPE_CAN_SOCKETCAN = 0xe3
+
+# magic_number, version_major, version_minor, thiszone, sigfigs, snaplen, network
+pcap_header = struct.Struct("<IHHiIII")
+# ts_sec, ts_usec, incl_len, orig_len
+pcap_record_header = struct.Struct("<IIII")
+# The record header then the SocketCAN header: id, dlc and padding
+pcap_can_record = struct.Struct("<IIII4sB3x")
+
+PCAPNG_SECTION_HEADER_BLOCK = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION_BLOCK = 0x00000001
+PCAPNG_ENHANCED_PACKET_BLOCK = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IF_NAME = 2
+PCAPNG_IF_DESCRIPTION = 3
+PCAPNG_IF_SPEED = 8
+PCAPNG_IF_TSRESOL = 9
+
+# block type, block length, byte-order magic, major version, minor version, section length
+pcapng_section_header = struct.Struct("<IIIHHq")
+# block type, block length, link type, reserved, snaplen
+pcapng_interface_description = struct.Struct("<IIHHI")
+# block type, block length, interface, timestamp high and low, captured and original lengths, SocketCAN header
+pcapng_can_packet = struct.Struct("<IIIIIII4sB3x")
+pcapng_option = struct.Struct("<HH")
+pcapng_length = struct.Struct("<I")
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+header_regex = re.compile(r"On ([^,]+), (\w+) O:")
+channel_regex = re.compile(r"p?ChannelID:\s*(\d+)")
+protocol_regex = re.compile(r"ProtocolID:\s*(\S+)")
+baudrate_regex = re.compile(r"BaudRate:\s*(\d+)")
+rxstatus_regex = re.compile(r"RxStatus:\s*(.*)")
+data_regex = re.compile(r"Data \[\w+\]:\s*(.*)")
+
+
+class LogMessage(object):
+    """
+    Message of a J2534 log
+    """
+
+    __slots__ = ('date', 'action', 'channel', 'rxstatus', 'data', 'protocol', 'baudrate')
+
+    def __init__(self, date, action, channel, rxstatus, data, protocol=None, baudrate=None):
+        self.date = date
+        self.action = action
+        self.channel = channel
+        self.rxstatus = rxstatus
+        self.data = data
+        self.protocol = protocol
+        self.baudrate = baudrate
+
+
+class DateParser(object):
+    """
+    Parser of the "%m/%d/%Y at %H:%M:%S.%f" dates of the logs into UTC (sec, nsec)
+
+    The day is only parsed when it changes.
+    """
+
+    def __init__(self):
+        self._day = None
+        self._day_seconds = None
+
+    def parse(self, date):
+        day, sep, time = date.rpartition(' ')
+        if day != self._day:
+            self._day_seconds = timegm(datetime.strptime(day, '%m/%d/%Y at').utctimetuple())
+            self._day = day
+        hms, sep, fraction = time.partition('.')
+        hours, minutes, seconds = hms.split(':')
+        nsec = int((fraction + '000000000')[:9]) if fraction else 0
+        return self._day_seconds + int(hours) * 3600 + int(minutes) * 60 + int(seconds), nsec
 
 
 def parse_can_date(date):
@@ -61,90 +158,964 @@ def parse_can_date(date):
 
 
 def parse_can_data(line):
-    entries = [int(x, 16) for x in line.split()]
-    assert len(entries) >= 4
-    id = (entries[0] << 24) + (entries[1] << 16) + (entries[2] << 8) + (entries[3])
-    return can_packet.build(Container(
-        id=id,
-        dlc=len(entries) - 4,
-        data=bytearray(entries[4:]),
-    ))
+    """
+    Returns the bytes of the hexadecimal data of a message, the CAN identifier followed by the payload
+    """
+    data = bytearray.fromhex(line)
+    if len(data) < 4:
+        raise Exception("Invalid CAN data: %s" % (line))
+    return data
+
+
+class BufferedWriter(object):
+    """
+    Packs the blocks of a file in a buffer written by large blocks
+    """
+
+    def __init__(self, stream, buffer_size=0x10000):
+        self._stream = stream
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._position = 0
+        self._written = 0
+
+    def tell(self):
+        """
+        Returns the offset of the next block in the stream, from the creation of the writer
+        """
+        return self._written + self._position
+
+    def _reserve(self, size):
+        """
+        Returns the position of size bytes in the buffer
+        """
+        if self._position + size > len(self._buffer):
+            self.flush()
+            if size > len(self._buffer):
+                self._buffer = bytearray(size)
+                self._view = memoryview(self._buffer)
+        position = self._position
+        self._position += size
+        return position
+
+    def flush(self):
+        if self._position:
+            self._stream.write(self._view[:self._position])
+            self._written += self._position
+            self._position = 0
+
+
+class PcapWriter(BufferedWriter):
+    """
+    Writer of SocketCAN pcap records
+
+    Without header only the records are written, to be appended to a file.
+    """
+
+    def __init__(self, stream, header=True, buffer_size=0x10000):
+        super(PcapWriter, self).__init__(stream, buffer_size)
+        if header:
+            stream.write(pcap_header.pack(PCAP_MAGIC, 2, 4, 0, 0, PCAP_SNAPLEN, LINKTYPE_CAN_SOCKETCAN))
+
+    def write(self, sec, usec, data):
+        dlc = len(data) - 4
+        position = self._reserve(pcap_can_record.size + dlc)
+        length = pcap_can_record.size + dlc - 16
+        pcap_can_record.pack_into(self._buffer, position, sec, usec, length, length, bytes(data[:4]), dlc)
+        position += pcap_can_record.size
+        self._buffer[position:position + dlc] = data[4:]
+
+
+class PcapngWriter(BufferedWriter):
+    """
+    Writer of a pcapng section with a SocketCAN interface by channel and nanosecond timestamps
+
+    Without header only the blocks are written, to be appended to a section.
+    """
+
+    def __init__(self, stream, header=True, buffer_size=0x10000):
+        super(PcapngWriter, self).__init__(stream, buffer_size)
+        self._interfaces = 0
+        if not header:
+            return
+        length = pcapng_section_header.size + 4
+        position = self._reserve(length)
+        pcapng_section_header.pack_into(self._buffer, position, PCAPNG_SECTION_HEADER_BLOCK, length,
+                                        PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1)
+        pcapng_length.pack_into(self._buffer, position + length - 4, length)
+
+    @staticmethod
+    def _option(code, value):
+        padding = (4 - len(value) % 4) % 4
+        return pcapng_option.pack(code, len(value)) + value + b'\x00' * padding
+
+    def add_interface(self, name, description=None, speed=None):
+        """
+        Returns the identifier of a new interface, speed is in bit/s
+        """
+        options = self._option(PCAPNG_IF_NAME, name.encode('utf-8'))
+        if description is not None:
+            options += self._option(PCAPNG_IF_DESCRIPTION, description.encode('utf-8'))
+        if speed is not None:
+            options += self._option(PCAPNG_IF_SPEED, struct.pack("<Q", speed))
+        options += self._option(PCAPNG_IF_TSRESOL, struct.pack("<B", 9))
+        options += pcapng_option.pack(0, 0)
+        length = pcapng_interface_description.size + len(options) + 4
+        position = self._reserve(length)
+        pcapng_interface_description.pack_into(self._buffer, position, PCAPNG_INTERFACE_DESCRIPTION_BLOCK, length,
+                                               LINKTYPE_CAN_SOCKETCAN, 0, PCAP_SNAPLEN)
+        position += pcapng_interface_description.size
+        self._buffer[position:position + len(options)] = options
+        pcapng_length.pack_into(self._buffer, position + len(options), length)
+        self._interfaces += 1
+        return self._interfaces - 1
+
+    def write(self, interface, timestamp, data):
+        """
+        Writes a frame of the interface, timestamp is in ns
+        """
+        dlc = len(data) - 4
+        padding = (4 - dlc % 4) % 4
+        length = pcapng_can_packet.size + dlc + padding + 4
+        position = self._reserve(length)
+        pcapng_can_packet.pack_into(self._buffer, position, PCAPNG_ENHANCED_PACKET_BLOCK, length, interface,
+                                    timestamp >> 32, timestamp & 0xFFFFFFFF, dlc + 8, dlc + 8, bytes(data[:4]), dlc)
+        position += pcapng_can_packet.size
+        self._buffer[position:position + dlc] = data[4:]
+        position += dlc
+        self._buffer[position:position + padding] = b'\x00' * padding
+        pcapng_length.pack_into(self._buffer, position + padding, length)
+
+
+def validate_pcap(path):
+    """
+    Checks the records of a pcap file with the construct definitions, returns their number
+    """
+    if Adapter is None:
+        raise Exception("construct is needed to validate the files")
+    count = 0
+    with open(path, 'rb') as f:
+        cap_header.parse_stream(f)
+        while f.read(1):
+            f.seek(-1, os.SEEK_CUR)
+            packet = cap_packet.parse_stream(f)
+            if packet.inc_length != packet.orig_length or len(packet.data) != packet.inc_length:
+                raise Exception("Invalid record %d" % (count))
+            can = can_packet.parse(packet.data)
+            if len(can.data) + 8 != packet.inc_length:
+                raise Exception("Invalid CAN frame in record %d" % (count))
+            count += 1
+    return count
+
+
+def get_compression(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(XZ_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(XZ_MAGIC):
+        return 'xz'
+    return None
+
+
+def open_log(path):
+    """
+    Opens a log, compressed with gzip or xz or not, as a binary stream
+    """
+    compression = get_compression(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'xz':
+        if lzma is None:
+            raise Exception("xz compressed logs need the lzma module")
+        return lzma.open(path, 'rb')
+    return io.open(path, 'rb')
+
+
+def parse_log(lines):
+    """
+    Yields the messages of the lines of a J2534 log
+
+    The lines are read one by one: a call starts with an "On <date>, <function> O:" line, each message of the
+    call ends with the blank line following its data, which can be on several lines.
+    A PassThruConnect call is yielded without data, with the protocol and the baud rate of the channel.
+    """
+    date = action = channel = rxstatus = data = protocol = baudrate = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('latin-1')
+        line = line.strip()
+        if data is not None:
+            if line:
+                data.append(line)
+                continue
+            if channel is not None:
+                yield LogMessage(date, action, channel, rxstatus, " ".join(data), protocol)
+            rxstatus = data = None
+            continue
+        # Only the lines starting with the expected letters are matched
+        first = line[:1]
+        if first == 'O':
+            m = header_regex.match(line)
+            if m is not None:
+                if action == 'PassThruConnect' and channel is not None:
+                    yield LogMessage(date, action, channel, None, None, protocol, baudrate)
+                date, action = m.groups()
+                channel = rxstatus = protocol = baudrate = None
+        elif date is None:
+            continue
+        elif first == 'C' or first == 'p':
+            m = channel_regex.match(line)
+            if m is not None:
+                channel = m.group(1)
+        elif first == 'R':
+            m = rxstatus_regex.match(line)
+            if m is not None:
+                rxstatus = m.group(1)
+        elif first == 'D':
+            m = data_regex.match(line)
+            if m is not None:
+                data = [m.group(1)]
+        elif first == 'P':
+            m = protocol_regex.match(line)
+            if m is not None:
+                protocol = m.group(1)
+        elif first == 'B':
+            m = baudrate_regex.match(line)
+            if m is not None:
+                baudrate = int(m.group(1))
+    if data is not None and channel is not None:
+        yield LogMessage(date, action, channel, rxstatus, " ".join(data), protocol)
+    elif action == 'PassThruConnect' and channel is not None:
+        yield LogMessage(date, action, channel, None, None, protocol, baudrate)
+
+
+def get_packets(messages, connections=None):
+    """
+    Yields the (channel, sec, nsec, data) of the CAN frames sent and received without error
+
+    connections: dict filled with the (protocol, baudrate) of the channels, from their PassThruConnect calls
+    or their first message
+    """
+    dates = DateParser()
+    for message in messages:
+        if message.action == 'PassThruReadMsgs':
+            if message.rxstatus != 'No Flags Set':
+                continue
+        elif message.action != 'PassThruWriteMsgs':
+            if message.action == 'PassThruConnect' and connections is not None:
+                connections[message.channel] = (message.protocol, message.baudrate)
+            continue
+        if connections is not None and message.channel not in connections:
+            connections[message.channel] = (message.protocol, None)
+        sec, nsec = dates.parse(message.date)
+        yield message.channel, sec, nsec, parse_can_data(message.data)
+
+
+def build_pcap_header():
+    return pcap_header.pack(PCAP_MAGIC, 2, 4, 0, 0, PCAP_SNAPLEN, LINKTYPE_CAN_SOCKETCAN)
+
+
+def write_pcap(ostream, packets, selectedChannel=None):
+    """
+    Writes the packets of a channel in ostream as they come, returns the number of packets of each channel
+
+    Without selected channel, the first one is written.
+    """
+    writer = PcapWriter(ostream)
+    counts = {}
+    try:
+        for channel, sec, nsec, data in packets:
+            if channel not in counts:
+                counts[channel] = 0
+                print("%s" % (channel), file=sys.stderr)
+                if selectedChannel is None:
+                    selectedChannel = channel
+            counts[channel] += 1
+            if channel == selectedChannel:
+                writer.write(sec, nsec // 1000, data)
+    finally:
+        writer.flush()
+    return counts
+
+
+def write_pcapng(ostream, packets, connections, selectedChannel=None):
+    """
+    Writes the packets of every channel, or of the selected one, in ostream as they come
+
+    Each channel has its interface, described with the protocol and the baud rate of its connection, taken in
+    connections when its first packet is written (see get_packets).
+    Returns the number of packets of each channel.
+    """
+    writer = PcapngWriter(ostream)
+    interfaces = {}
+    counts = {}
+    try:
+        for channel, sec, nsec, data in packets:
+            if channel not in counts:
+                counts[channel] = 0
+                print("%s" % (channel), file=sys.stderr)
+            counts[channel] += 1
+            if selectedChannel is not None and channel != selectedChannel:
+                continue
+            interface = interfaces.get(channel)
+            if interface is None:
+                protocol, baudrate = connections.get(channel, (None, None))
+                interface = interfaces[channel] = writer.add_interface("channel %s" % (channel), protocol, baudrate)
+            writer.write(interface, sec * 1000000000 + nsec, data)
+    finally:
+        writer.flush()
+    return counts
+
+
+def find_chunks(path, count):
+    """
+    Returns count (start, end) ranges of a log at most, cut at the calls which follow a group separator
+
+    A call starting a group resets the state of the parser, so the chunks can be parsed separately.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, count):
+            offset = max(size * i // count, bounds[-1])
+            f.seek(offset)
+            if offset > 0:
+                # Partial line
+                offset += len(f.readline())
+            blanks = 0
+            while True:
+                line = f.readline()
+                if not line:
+                    offset = size
+                    break
+                if not line.strip():
+                    blanks += 1
+                elif blanks >= 2 and header_regex.match(line.decode('latin-1').strip()):
+                    break
+                else:
+                    blanks = 0
+                offset += len(line)
+            if offset > bounds[-1] and offset < size:
+                bounds.append(offset)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_range(f, start, end):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        line = f.readline()
+        if not line:
+            break
+        remaining -= len(line)
+        yield line
+
+
+def convert_packets(packets, directory, suffix):
+    """
+    Writes the pcap records of each channel in the directory/<channel><suffix> files
+
+    Returns the (channel, count) in the order of the first packets.
+    """
+    channels = []
+    counts = {}
+    files = {}
+    writers = {}
+    try:
+        for channel, sec, nsec, data in packets:
+            if channel not in writers:
+                files[channel] = open(os.path.join(directory, channel + suffix), 'wb')
+                writers[channel] = PcapWriter(files[channel], False)
+                channels.append(channel)
+                counts[channel] = 0
+            writers[channel].write(sec, nsec // 1000, data)
+            counts[channel] += 1
+    finally:
+        for channel in channels:
+            writers[channel].flush()
+            files[channel].close()
+    return [(channel, counts[channel]) for channel in channels]
+
+
+def convert_chunk(args):
+    path, start, end, directory, index = args
+    with open(path, 'rb') as f:
+        return convert_packets(get_packets(parse_log(read_range(f, start, end))), directory, '.%d' % (index))
+
+
+def convert(istream, path, directory, jobs):
+    """
+    Converts the log into pcap records by channel, with jobs processes for a file which isn't compressed
+
+    Returns the per-chunk records files of each channel, in the order of the log, and the packet counts.
+    """
+    if path is not None and jobs > 1 and get_compression(path) is None:
+        chunks = find_chunks(path, jobs)
+        pool = multiprocessing.Pool(min(jobs, len(chunks)))
+        try:
+            results = pool.map(convert_chunk, [(path, start, end, directory, index)
+                                               for index, (start, end) in enumerate(chunks)])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [convert_packets(get_packets(parse_log(istream)), directory, '.0')]
+
+    files = {}
+    counts = {}
+    channels = []
+    for index, result in enumerate(results):
+        for channel, count in result:
+            if channel not in counts:
+                counts[channel] = 0
+                files[channel] = []
+                channels.append(channel)
+                print("%s" % (channel), file=sys.stderr)
+            counts[channel] += count
+            files[channel].append(os.path.join(directory, "%s.%d" % (channel, index)))
+    return channels, files, counts
+
+
+def merge_pcap(ostream, files):
+    ostream.write(build_pcap_header())
+    for path in files:
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, ostream, 1024 * 1024)
+
+
+def convert_chunk_pcapng(args):
+    """
+    Writes the enhanced packet blocks of a part of a log in directory/<index>.pcapng, without the interfaces
+
+    The interfaces are numbered in the order of the first packets of the chunk.
+    Returns the (channel, count) in the order of the first packets, the (channel, offset, connection,
+    connected) of the first block of each written channel, connected telling if the connection comes from a
+    PassThruConnect call of the chunk, and the connections of these calls at the end of the chunk.
+    """
+    path, start, end, directory, index, selectedChannel = args
+    connections = {}
+    connects = {}
+    channels = []
+    counts = {}
+    interfaces = {}
+    firsts = []
+
+    def messages(lines):
+        for message in parse_log(lines):
+            if message.action == 'PassThruConnect':
+                connects[message.channel] = (message.protocol, message.baudrate)
+            yield message
+
+    with open(path, 'rb') as f:
+        with open(os.path.join(directory, '%d.pcapng' % (index)), 'wb') as ostream:
+            writer = PcapngWriter(ostream, False)
+            try:
+                for channel, sec, nsec, data in get_packets(messages(read_range(f, start, end)), connections):
+                    if channel not in counts:
+                        counts[channel] = 0
+                        channels.append(channel)
+                    counts[channel] += 1
+                    if selectedChannel is not None and channel != selectedChannel:
+                        continue
+                    interface = interfaces.get(channel)
+                    if interface is None:
+                        interface = interfaces[channel] = len(interfaces)
+                        firsts.append((channel, writer.tell(), connections[channel], channel in connects))
+                    writer.write(interface, sec * 1000000000 + nsec, data)
+            finally:
+                writer.flush()
+    return [(channel, counts[channel]) for channel in channels], firsts, connects
+
+
+def copy_range(istream, ostream, length):
+    while length > 0:
+        data = istream.read(min(length, 1024 * 1024))
+        if not data:
+            break
+        ostream.write(data)
+        length -= len(data)
+
+
+def merge_pcapng(ostream, directory, results):
+    """
+    Writes the blocks of the chunks converted by convert_chunk_pcapng as a single pcapng section
+
+    The interface of a channel is described before its first block, with the connection it has there, and the
+    interfaces of the blocks are renumbered in the order of the log: the file is the one of a serial conversion.
+    """
+    writer = PcapngWriter(ostream)
+    interfaces = {}
+    connections = {}
+    for index, (channels, firsts, connects) in enumerate(results):
+        mapping = []
+        inserts = []
+        for channel, offset, connection, connected in firsts:
+            if channel not in interfaces:
+                if not connected and channel in connections:
+                    # Connected in a previous chunk
+                    connection = connections[channel]
+                interfaces[channel] = len(interfaces)
+                inserts.append((offset, channel, connection))
+            mapping.append(interfaces[channel])
+        connections.update(connects)
+
+        def add_interfaces(position):
+            while inserts and inserts[0][0] == position:
+                offset, channel, (protocol, baudrate) = inserts.pop(0)
+                writer.add_interface("channel %s" % (channel), protocol, baudrate)
+            writer.flush()
+
+        path = os.path.join(directory, '%d.pcapng' % (index))
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            if mapping == list(range(len(mapping))):
+                position = 0
+                while inserts:
+                    offset = inserts[0][0]
+                    copy_range(f, ostream, offset - position)
+                    position = offset
+                    add_interfaces(position)
+                copy_range(f, ostream, size - position)
+            elif size > 0:
+                # The interfaces of the blocks are patched
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    position = 0
+                    while position < size:
+                        add_interfaces(position)
+                        type, length, interface = struct.unpack_from("<III", buffer, position)
+                        ostream.write(struct.pack("<III", type, length, mapping[interface]))
+                        ostream.write(buffer[position + 12:position + length])
+                        position += length
+                finally:
+                    buffer.close()
+    writer.flush()
+
+
+def convert_pcapng(path, ostream, directory, jobs, selectedChannel=None):
+    """
+    Converts a log which isn't compressed into a pcapng file with jobs processes
+
+    Returns the number of packets of each channel.
+    """
+    chunks = find_chunks(path, jobs)
+    pool = multiprocessing.Pool(min(jobs, len(chunks)))
+    try:
+        results = pool.map(convert_chunk_pcapng, [(path, start, end, directory, index, selectedChannel)
+                                                  for index, (start, end) in enumerate(chunks)])
+    finally:
+        pool.close()
+        pool.join()
+    counts = {}
+    for channels, firsts, connects in results:
+        for channel, count in channels:
+            if channel not in counts:
+                counts[channel] = 0
+                print("%s" % (channel), file=sys.stderr)
+            counts[channel] += count
+    merge_pcapng(ostream, directory, results)
+    return counts
+
+
+class LineReader(object):
+    """
+    Iterates over the lines of a buffer from offset
+
+    call is the offset of the last call header which follows a blank line, where the parser can start.
+    """
+
+    def __init__(self, buffer, offset=0):
+        self._buffer = buffer
+        self._offset = offset
+        self.call = None
+
+    def __iter__(self):
+        buffer = self._buffer
+        size = len(buffer)
+        offset = self._offset
+        blank = True
+        while offset < size:
+            end = buffer.find(b'\n', offset)
+            end = size if end < 0 else end + 1
+            line = buffer[offset:end]
+            stripped = line.strip()
+            if blank and stripped.startswith(b'On '):
+                self.call = offset
+            blank = not stripped
+            yield line
+            offset = end
+
+
+def read_pcap_records(buffer, offset=pcap_header.size):
+    """
+    Yields the (offset, timestamp in ns, length) of the records of a pcap file from offset
+    """
+    magic = pcap_header.unpack_from(buffer, 0)[0]
+    if magic != PCAP_MAGIC:
+        raise Exception("Not a pcap file")
+    size = len(buffer)
+    record = pcap_record_header.size
+    while offset + record <= size:
+        sec, usec, inc_length, orig_length = pcap_record_header.unpack_from(buffer, offset)
+        yield offset, sec * 1000000000 + usec * 1000, record + inc_length
+        offset += record + inc_length
+
+
+class Index(object):
+    """
+    Sidecar index of a J2534 log or a pcap file, in <file>.idx
+
+    For each channel, the offset where the parsing can start is recorded with the timestamp in ns of the
+    following packet at most every interval s. The channel of the pcap files is "-".
+    The connections of the channels are kept for the extracts starting after them, and the signature of the
+    file (see get_signature) to detect an index out of date.
+    """
+
+    VERSION = 2
+
+    # Files which can't be indexed: pcapng, nanosecond and big-endian pcap
+    UNSUPPORTED_MAGICS = [struct.pack("<I", PCAPNG_SECTION_HEADER_BLOCK), struct.pack("<I", PCAP_NSEC_MAGIC),
+                          struct.pack(">I", PCAP_MAGIC), struct.pack(">I", PCAP_NSEC_MAGIC)]
+
+    def __init__(self, kind, signature, entries, connections):
+        self._kind = kind
+        self._signature = signature
+        self._entries = entries
+        self._connections = connections
+        self._timestamps = {}
+        for timestamp, channel, offset in entries:
+            self._timestamps.setdefault(None, []).append(timestamp)
+            self._timestamps.setdefault(channel, []).append(timestamp)
+        self._offsets = {}
+        for timestamp, channel, offset in entries:
+            self._offsets.setdefault(None, []).append(offset)
+            self._offsets.setdefault(channel, []).append(offset)
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def entries(self):
+        return self._entries
+
+    @property
+    def connections(self):
+        return self._connections
+
+    @property
+    def signature(self):
+        return self._signature
+
+    @staticmethod
+    def get_path(path):
+        return path + '.idx'
+
+    @staticmethod
+    def get_signature(path, block_size=0x1000):
+        """
+        Returns the size, the modification time in us and the CRC-32 of the first and last blocks of a file
+
+        The index of a file rewritten with the same size is detected as out of date.
+        """
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            crc = zlib.crc32(f.read(block_size))
+            if stat.st_size > block_size:
+                f.seek(max(block_size, stat.st_size - block_size))
+                crc = zlib.crc32(f.read(block_size), crc)
+        return stat.st_size, int(round(stat.st_mtime * 1000000)), crc & 0xFFFFFFFF
+
+    @classmethod
+    def build(cls, path, interval=1.0):
+        """
+        Indexes a file in a single pass
+        """
+        if get_compression(path) is not None:
+            raise Exception("The compressed files can't be indexed")
+        signature = cls.get_signature(path)
+        size = signature[0]
+        interval = int(interval * 1000000000)
+        entries = []
+        connections = {}
+        last = {}
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+            try:
+                if buffer[:4] in cls.UNSUPPORTED_MAGICS:
+                    raise Exception("Only the J2534 logs and the little-endian microsecond pcap files can be indexed")
+                if buffer[:4] == struct.pack("<I", PCAP_MAGIC):
+                    kind = 'pcap'
+                    for offset, timestamp, length in read_pcap_records(buffer):
+                        if '-' not in last or timestamp - last['-'] >= interval:
+                            entries.append((timestamp, '-', offset))
+                            last['-'] = timestamp
+                else:
+                    if b'\x00' in buffer[:0x1000]:
+                        raise Exception("%s is not a J2534 log" % (path))
+                    kind = 'log'
+                    lines = LineReader(buffer)
+                    for channel, sec, nsec, data in get_packets(parse_log(lines), connections):
+                        timestamp = sec * 1000000000 + nsec
+                        if channel not in last or timestamp - last[channel] >= interval:
+                            entries.append((timestamp, channel, lines.call if lines.call is not None else 0))
+                            last[channel] = timestamp
+            finally:
+                if size > 0:
+                    buffer.close()
+        return cls(kind, signature, entries, connections)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the index of a file, None if it is missing or out of date
+        """
+        try:
+            with open(cls.get_path(path), 'r') as f:
+                fields = f.readline().split()
+                signature = cls.get_signature(path)
+                if len(fields) != 7 or fields[:3] != ['can_cap', 'index', str(cls.VERSION)] or \
+                        tuple([int(x) for x in fields[4:]]) != signature:
+                    return None
+                kind = fields[3]
+                entries = []
+                connections = {}
+                for line in f:
+                    fields = line.split()
+                    if fields[0] == 'connect':
+                        connections[fields[1]] = (None if fields[2] == '-' else fields[2],
+                                                  None if fields[3] == '-' else int(fields[3]))
+                    else:
+                        entries.append((int(fields[0]), fields[1], int(fields[2])))
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+        return cls(kind, signature, entries, connections)
+
+    def save(self, path):
+        tmp_path = self.get_path(path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write("can_cap index %d %s %d %d %d\n" % ((self.VERSION, self._kind) + tuple(self._signature)))
+            for channel in sorted(self._connections):
+                protocol, baudrate = self._connections[channel]
+                f.write("connect %s %s %s\n" % (channel, protocol if protocol is not None else '-',
+                                                 baudrate if baudrate is not None else '-'))
+            for timestamp, channel, offset in self._entries:
+                f.write("%d %s %d\n" % (timestamp, channel, offset))
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, self.get_path(path))
+        else:
+            if os.path.exists(self.get_path(path)):
+                os.remove(self.get_path(path))
+            os.rename(tmp_path, self.get_path(path))
+
+    def find(self, start, channel=None):
+        """
+        Returns the offset from where the packets of the channel, or of all the channels, after start are found
+        """
+        if self._kind == 'pcap':
+            channel = None
+        timestamps = self._timestamps.get(channel, [])
+        # The packets before an entry are older than its timestamp in a log written in time order
+        index = bisect.bisect_left(timestamps, start) - 1 if start is not None else -1
+        if index < 0:
+            return 0 if self._kind == 'log' else pcap_header.size
+        return self._offsets[channel][index]
+
+
+def get_index(path, interval=1.0):
+    """
+    Returns the index of a file, built and saved when it is missing or out of date
+    """
+    index = Index.load(path)
+    if index is None:
+        index = Index.build(path, interval)
+        index.save(path)
+    return index
+
+
+def parse_time(value):
+    """
+    Returns the timestamp in ns of a number of seconds since the epoch or of a date of the logs
+    """
+    try:
+        return int(round(float(value) * 1000000000))
+    except ValueError:
+        sec, nsec = DateParser().parse(value)
+        return sec * 1000000000 + nsec
+
+
+def extract_log(path, index, ostream, start=None, end=None, selectedChannel=None, format='pcap'):
+    """
+    Converts the packets of a log between start and end, in ns, from the offset given by its index
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            connections = dict(index.connections)
+
+            def packets():
+                for packet in get_packets(parse_log(LineReader(buffer, index.find(start, selectedChannel))),
+                                          connections):
+                    timestamp = packet[1] * 1000000000 + packet[2]
+                    if end is not None and timestamp > end:
+                        break
+                    if start is None or timestamp >= start:
+                        yield packet
+
+            if format == 'pcapng':
+                return write_pcapng(ostream, packets(), connections, selectedChannel)
+            return write_pcap(ostream, packets(), selectedChannel)
+        finally:
+            buffer.close()
+
+
+def extract_pcap(path, index, ostream, start=None, end=None):
+    """
+    Copies the records of a pcap file between start and end, in ns, from the offset given by its index
+    """
+    count = 0
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # Python 2 can't make a memoryview of a mmap, the records are written from slices
+            ostream.write(buffer[:pcap_header.size])
+            for offset, timestamp, length in read_pcap_records(buffer, index.find(start)):
+                if end is not None and timestamp > end:
+                    break
+                if start is None or timestamp >= start:
+                    ostream.write(buffer[offset:offset + length])
+                    count += 1
+        finally:
+            buffer.close()
+    return count
 
 
 def main(argv):
     parser = argparse.ArgumentParser(description="J2534 logs parser")
     parser.add_argument('-c', '--channel', help="channel to select")
-    parser.add_argument('file', nargs='?', help="file to read")
+    parser.add_argument('-a', '--all', action='store_true', help="write each channel in <file>.<channel>.pcap")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="processes parsing the parts of a file which isn't compressed")
+    parser.add_argument('-f', '--format', choices=['pcap', 'pcapng'], default='pcap',
+                        help="pcapng writes all the channels in a single file")
+    parser.add_argument('--validate', action='store_true', help="check the written pcap files with construct")
+    parser.add_argument('--index', action='store_true', help="write the <file>.idx index of a log or a pcap file")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between the entries of the index")
+    parser.add_argument('--start', help="start of the extract, in seconds since the epoch or as in the logs")
+    parser.add_argument('--end', help="end of the extract, in seconds since the epoch or as in the logs")
+    parser.add_argument('-o', '--output', help="file of the extract")
+    parser.add_argument('file', nargs='?', help="file to read, it can be compressed with gzip or xz")
     args = parser.parse_args(argv[1:])
     selectedChannel = args.channel
-    allpackets = {}
+
+    if args.index or args.start is not None or args.end is not None:
+        if not args.file:
+            raise Exception("A file is needed to use an index")
+        if args.index:
+            index = Index.build(args.file, args.interval)
+            index.save(args.file)
+            print("%d entries" % (len(index.entries)), file=sys.stderr)
+            return
+        index = get_index(args.file, args.interval)
+        start = parse_time(args.start) if args.start is not None else None
+        end = parse_time(args.end) if args.end is not None else None
+        base = os.path.splitext(args.file)[0]
+        if index.kind == 'pcap':
+            with open(args.output or base + '.extract.pcap', 'wb') as ostream:
+                count = extract_pcap(args.file, index, ostream, start, end)
+        else:
+            with open(args.output or base + '.extract.' + args.format, 'wb') as ostream:
+                counts = extract_log(args.file, index, ostream, start, end, selectedChannel, args.format)
+            count = sum(counts.values())
+        print("%d packets" % (count), file=sys.stderr)
+        return
+    if args.validate and (not args.file or args.format != 'pcap'):
+        raise Exception("Only the pcap files written in a file can be validated")
+    if args.format == 'pcapng' and args.all:
+        raise Exception("A pcapng file holds all the channels")
+    outputs = []
 
     if args.file:
-        with open(args.file, 'rb') as f:
-            data = ''.join(f.readlines())
-        ostream = open(os.path.splitext(args.file)[0] + '.pcap', 'wb')
+        istream = open_log(args.file)
+        name = args.file
+        for extension in ('.gz', '.xz'):
+            if name.endswith(extension):
+                name = name[:-len(extension)]
+        base = os.path.splitext(name)[0]
     else:
-        data = ""
-        for line in sys.stdin:
-            data += line
-        ostream = sys.stdout
-
-    data = data.replace('\r\n', '\n')
-
-    groups = data.split('\n\n\n')
-
-    regex = re.compile(
-        "On ([^,]+), (\w+?) O:.*" + "\s*ChannelID:\s*(\d+)\s*\n" + ".*" + "\s*RxStatus:\s*([^\n]*)\s*\n" + ".*" + "\s*Data \[\w+\]:\s*(.*)\s*\n\n" + ".*",
-        re.DOTALL | re.MULTILINE)
-
-    def add(channelId, date, data):
-        data = parse_can_data(data)
-        date = parse_can_date(date)
-        if channelId not in allpackets:
-            allpackets[channelId] = []
-            print("%s" % (channelId), file=sys.stderr)
-        allpackets[channelId].append(Container(
-            time=date,
-            inc_length=len(data),
-            orig_length=len(data),
-            data=data,
-        ))
-
-    for g in groups:
-        for r in regex.findall(g):
-            date = r[0]
-            act = r[1]
-            channel = r[2]
-            rxflags = r[3]
-            data = r[4]
-            if act == 'PassThruReadMsgs':
-                if rxflags == 'No Flags Set':
-                    add(channel, date, data)
-            if act == 'PassThruWriteMsgs':
-                add(channel, date, data)
+        if args.all:
+            raise Exception("A file is needed to write all the channels")
+        istream = getattr(sys.stdin, 'buffer', sys.stdin)
+        base = None
 
-    if selectedChannel is None:
-        if len(allpackets) != 1:
-            raise Exception("Not only one channel available: %s" % (
-                ", ".join(["%s[%d]" % (k, len(allpackets[k])) for k in allpackets])))
-        packets = allpackets.itervalues().next()
-    else:
-        if selectedChannel not in allpackets:
+    if args.format == 'pcapng':
+        ostream = open(base + '.pcapng', 'wb') if base is not None else getattr(sys.stdout, 'buffer', sys.stdout)
+        try:
+            if args.file and args.jobs > 1 and get_compression(args.file) is None:
+                directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(base)))
+                try:
+                    counts = convert_pcapng(args.file, ostream, directory, args.jobs, selectedChannel)
+                finally:
+                    shutil.rmtree(directory)
+            else:
+                connections = {}
+                counts = write_pcapng(ostream, get_packets(parse_log(istream), connections), connections,
+                                      selectedChannel)
+        finally:
+            if args.file:
+                istream.close()
+                ostream.close()
+        if selectedChannel is not None and selectedChannel not in counts:
             raise Exception("Invalid channel %s: %s" % (
-                selectedChannel, ", ".join(["%s[%d]" % (k, len(allpackets[k])) for k in allpackets])))
-        packets = allpackets[selectedChannel]
-
-    data = Container(
-        magic_number=0xa1b2c3d4,
-        version_major=0x2,
-        version_minor=0x4,
-        network=0xe3,
-        thiszone=0,
-        sigfigs=0,
-        snaplen=0xfffff,
-        packets=packets
-    )
-    cap_file.build_stream(data, ostream)
+                selectedChannel, ", ".join(["%s[%d]" % (k, counts[k]) for k in sorted(counts)])))
+        return
+    elif not args.all and args.jobs <= 1:
+        ostream = open(base + '.pcap', 'wb') if base is not None else getattr(sys.stdout, 'buffer', sys.stdout)
+        outputs.append(base + '.pcap' if base is not None else None)
+        try:
+            counts = write_pcap(ostream, get_packets(parse_log(istream)), selectedChannel)
+        finally:
+            if args.file:
+                istream.close()
+                ostream.close()
+    else:
+        directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(base)) if base is not None else None)
+        try:
+            try:
+                channels, files, counts = convert(istream, args.file, directory, args.jobs)
+            finally:
+                if args.file:
+                    istream.close()
+            if args.all:
+                for channel in channels:
+                    outputs.append("%s.%s.pcap" % (base, channel))
+                    with open(outputs[-1], 'wb') as ostream:
+                        merge_pcap(ostream, files[channel])
+            else:
+                written = selectedChannel if selectedChannel is not None else (channels[0] if channels else None)
+                if base is not None:
+                    outputs.append(base + '.pcap')
+                    with open(outputs[-1], 'wb') as ostream:
+                        merge_pcap(ostream, files.get(written, []))
+                else:
+                    merge_pcap(getattr(sys.stdout, 'buffer', sys.stdout), files.get(written, []))
+        finally:
+            shutil.rmtree(directory)
+
+    if args.validate:
+        for output in outputs:
+            print("%s: %d valid records" % (output, validate_pcap(output)), file=sys.stderr)
+    if args.all:
+        return
+
+    channels = ", ".join(["%s[%d]" % (k, counts[k]) for k in sorted(counts)])
+    if selectedChannel is None:
+        if len(counts) != 1:
+            raise Exception("Not only one channel available, the first one has been written: %s" % (channels))
+    elif selectedChannel not in counts:
+        raise Exception("Invalid channel %s: %s" % (selectedChannel, channels))
 
 
 if __name__ == "__main__":
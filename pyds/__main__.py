@@ -133,6 +133,7 @@ def _main(argv):
     if sys.platform == 'win32':
         parser.add_argument('-d', '--device', help="Device to use")
     parser.add_argument('-m', '--mode', type=lambda m: Modes[m], choices=list(Modes), help="Library mode")
+    parser.add_argument('-t', '--tables', help="Directory of the precomputed security key tables")
     parser.add_argument('commands', nargs='*',
                         help='list of commands to execute')
 
@@ -167,7 +168,7 @@ def _main(argv):
     print("\n\n")
 
     # Create shell
-    app = PydsApp(device, mode)
+    app = PydsApp(device, mode, args.tables)
     return cmdloop(app, args.commands + unknown_args)
 
 
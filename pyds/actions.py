@@ -23,70 +23,75 @@ __author__ = "Yann Diorcet"
 __license__ = "GPL"
 __version__ = "0.0.1"
 
-import copy
 import logging
 
+from pyds.data import rbcm_dids, ic_dids
+
 logger = logging.getLogger(__name__)
 
 
 def unlock_headlightofftimer(data):
-    locked = False
+    de00 = rbcm_dids[0xde00]
+    de01 = rbcm_dids[0xde01]
 
-    assert len(data[0xde00]) == (14 * 8)
-    assert len(data[0xde01]) == (5 * 8)
+    assert len(data[0xde00]) == (de00.length * 8)
+    assert len(data[0xde01]) == (de01.length * 8)
 
-    if data[0xde00].get_value(0xB * 8 + 4, 1) != 0x0:
-        locked = True
-        data[0xde00].set_value(0xB * 8 + 4, 1, 0x0)
+    de00_values = de00.decode(data[0xde00])
+    de00_changes = {}
+    if de00_values['head_light_off_timer_disable'] != 0x0:
+        de00_changes['head_light_off_timer_disable'] = 0x0
+    de00.update(data[0xde00], de00_changes)
 
-    if locked:
+    if de00_changes:
         logger.info("Unlock \"head light off timer\"")
-        if data[0xde01].get_value(16, 7) == 0:
+        if de01.decode(data[0xde01])['head_light_off_timer'] == 0:
             logger.info("Set \"head light off timer\" default value (30s)")
             # 30s
-            data[0xde01].set_value(16, 7, 0x2)
+            de01.update(data[0xde01], {'head_light_off_timer': 0x2})
     else:
         logger.info("\"head light off timer\" seems already unlocked")
 
 
 def unlock_autodoorlock(data):
-    locked = False
-
-    assert len(data[0xde00]) == (14 * 8)
-    assert len(data[0xde01]) == (5 * 8)
-
-    if data[0xde00].get_value(0x1 * 8 + 7, 1) != 0x1:
-        locked = True
-        data[0xde00].set_value(0x1 * 8 + 7, 1, 0x1)
-
-    if data[0xde00].get_value(0x9 * 8 + 3, 1) != 0x0:
-        locked = True
-        data[0xde00].set_value(0x9 * 8 + 3, 1, 0x0)
-
-    if data[0xde00].get_value(0x9 * 8 + 4, 7) != 0x2:
-        locked = True
-        data[0xde00].set_value(0x9 * 8 + 4, 7, 0x2)
-
-    if locked:
+    de00 = rbcm_dids[0xde00]
+    de01 = rbcm_dids[0xde01]
+
+    assert len(data[0xde00]) == (de00.length * 8)
+    assert len(data[0xde01]) == (de01.length * 8)
+
+    expected = {
+        'auto_door_lock_enable': 0x1,
+        'auto_door_lock_disable': 0x0,
+        'auto_door_lock_type': 0x2,
+    }
+    de00_values = de00.decode(data[0xde00])
+    de00_changes = dict([(k, v) for k, v in expected.items() if de00_values[k] != v])
+    de00.update(data[0xde00], de00_changes)
+
+    if de00_changes:
         logger.info("Unlock \"auto door lock\"")
-        if data[0xde01].get_value(0, 15) == 0:
+        if de01.decode(data[0xde01])['auto_door_lock'] == 0:
             logger.info("Set \"auto door lock\" default value (Disabled)")
             # Disable
-            data[0xde01].set_value(0, 15, 0x1)
+            de01.update(data[0xde01], {'auto_door_lock': 0x1})
     else:
         logger.info("\"auto door lock\" seems already unlocked")
 
 
+def fork(data):
+    return dict([(did, diddata.fork()) for did, diddata in data.items()])
+
+
 def unlock_rbcm_features(data):
-    data = copy.deepcopy(data)
+    data = fork(data)
     unlock_autodoorlock(data)
     # unlock_headlightofftimer(data) # Not working, something missing
     return data
 
 
 def enable_scbs_r(data):
-    def get_address(line, column):
-        return (((line - 1) * 5) + column) * 8
+    f106 = ic_dids[0xf106]
 
     def compute_checksum(data):
         checksum = sum(data)
@@ -94,26 +99,24 @@ def enable_scbs_r(data):
         high = (checksum >> 8) & 0xff
         return (low << 8) + high
 
-    disabled = False
-    a_16_b2 = get_address(16, 2)
-    if data[0xf106].get_value(a_16_b2 + 6, 1) != 0x1:
-        disabled = True
-        data[0xf106].set_value(a_16_b2 + 6, 1, 0x1)
-
-    if data[0xf106].get_value(a_16_b2 + 5, 1) != 0x0:
-        disabled = True
-        data[0xf106].set_value(a_16_b2 + 5, 1, 0x0)
+    expected = {
+        'scbs_r_enable': 0x1,
+        'scbs_r_disable': 0x0,
+    }
+    f106_values = f106.decode(data[0xf106])
+    f106_changes = dict([(k, v) for k, v in expected.items() if f106_values[k] != v])
+    f106.update(data[0xf106], f106_changes)
 
     # Compute the checksum
-    data[0xf106].set_value(0, 65535, compute_checksum(data[0xf106].to_bytearray()[2:]))
+    f106.update(data[0xf106], {'checksum': compute_checksum(data[0xf106].to_bytearray()[2:])})
 
-    if disabled:
+    if f106_changes:
         logger.info("Enable \"SCBS-R\"")
     else:
         logger.info("\"SCBS-R\" seems already enabled")
 
 
 def unlock_ic_features(data):
-    data = copy.deepcopy(data)
+    data = fork(data)
     enable_scbs_r(data)
-    return data
\ No newline at end of file
+    return data
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+#
+# asyncio front end of ExtendedUDS (Python 3.5+)
+#
+# The native transports are blocking, so each call runs in an executor. The executors have a single worker
+# and are shared by the channels of a same physical bus: the requests of a bus are serialized while the
+# buses and the event loop run concurrently.
+#
+# A cancelled or timed out call is dropped if it has not started yet. A call already sent to the native
+# transport can't be interrupted: it ends in the background within its UDS timeout before the next one starts.
+#
+
+import asyncio
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pyds.pyds
+from pyds.data import vehicles_data
+
+
+class ChannelExecutors(object):
+    """
+    Single worker executors indexed by physical channel
+    """
+
+    def __init__(self):
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            executor = self._executors.get(key)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1)
+                self._executors[key] = executor
+            return executor
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait)
+
+
+class AsyncExtendedUDS(object):
+    def __init__(self, channel, executor=None, deadline=None):
+        """
+        channel: the blocking ExtendedUDS
+        executor: the single worker executor of the physical channel, a private one if None
+        deadline: maximum time in seconds of a call, including its wait in the executor queue
+        """
+        if channel.step_by_step:
+            raise Exception("Step by step mode can't be used asynchronously")
+        self._channel = channel
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self._deadline = deadline
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def executor(self):
+        return self._executor
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    def close(self):
+        if self._own_executor:
+            self._executor.shutdown(False)
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Run a blocking function in the executor of the channel
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        if self._deadline is None:
+            return await future
+        return await asyncio.wait_for(future, self._deadline)
+
+    async def send(self, sid, data, timeout=None, reply_length=None):
+        return await self.call(self._channel.send, sid, data, timeout, reply_length)
+
+    async def send_dsc(self, type, timeout=None):
+        return await self.call(self._channel.send_dsc, type, timeout)
+
+    async def send_sa(self, type, data, timeout=None):
+        return await self.call(self._channel.send_sa, type, data, timeout)
+
+    async def send_rdbi(self, did, timeout=None, copy=True, length=None):
+        return await self.call(self._channel.send_rdbi, did, timeout, copy, length)
+
+    async def send_rdbi_multi(self, dids, lengths=None, timeout=None, copy=True):
+        return await self.call(self._channel.send_rdbi_multi, dids, lengths, timeout, copy)
+
+    async def send_rmba(self, addr_tuple, size_tuple, timeout=None):
+        return await self.call(self._channel.send_rmba, addr_tuple, size_tuple, timeout)
+
+    async def send_rdtci(self, type, data, timeout=None):
+        return await self.call(self._channel.send_rdtci, type, data, timeout)
+
+    async def send_wdbi(self, did, data, timeout=None):
+        return await self.call(self._channel.send_wdbi, did, data, timeout)
+
+    async def send_wmba(self, addr_tuple, size_tuple, data, timeout=None):
+        return await self.call(self._channel.send_wmba, addr_tuple, size_tuple, data, timeout)
+
+    async def send_iocbi(self, did, parameter, state, timeout=None):
+        return await self.call(self._channel.send_iocbi, did, parameter, state, timeout)
+
+    async def send_rc(self, type, rid, data=bytearray(), timeout=None):
+        return await self.call(self._channel.send_rc, type, rid, data, timeout)
+
+    async def send_cdtcs(self, func, timeout=None):
+        return await self.call(self._channel.send_cdtcs, func, timeout)
+
+    async def send_cc(self, func, type, timeout=None):
+        return await self.call(self._channel.send_cc, func, type, timeout)
+
+    async def reset(self, resetType, timeout=None):
+        return await self.call(self._channel.reset, resetType, timeout)
+
+    async def change_diagnostic_session(self, sessionType, timeout=None):
+        return await self.call(self._channel.change_diagnostic_session, sessionType, timeout)
+
+    async def grant_security_access(self, algo, timeout=None):
+        return await self.call(self._channel.grant_security_access, algo, timeout)
+
+    async def upload(self, addr_tuple, size_tuple, output=None, progress=None, checkpoint=None, timeout=None):
+        return await self.call(self._channel.upload, addr_tuple, size_tuple, output, progress, checkpoint, timeout)
+
+    async def download(self, addr_tuple, size_tuple, image, progress=None, verify=None, max_repeats=2, timeout=None):
+        return await self.call(self._channel.download, addr_tuple, size_tuple, image, progress, verify, max_repeats,
+                               timeout)
+
+
+####################
+# Module channels
+####################
+
+async def get_module_channel(executors, pool, mode, vehicle, module, deadline=None):
+    """
+    Borrow a module channel from pool (see pyds.pyds.ChannelPool) in the executor of its bus
+    """
+    executor = executors.get(vehicles_data[vehicle].modules[module].bus)
+    loop = asyncio.get_event_loop()
+    channel = await loop.run_in_executor(executor, pool.get_module_channel, mode, vehicle, module)
+    return AsyncExtendedUDS(channel, executor, deadline)
+
+
+async def change_session(channel, conf=None, tables=None):
+    await channel.call(pyds.pyds.change_session, channel.channel, conf, tables)
+    return channel
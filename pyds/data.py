@@ -27,6 +27,7 @@ import uds
 
 from enum import Enum
 from pyds.structs import *
+from pyds.types import Schema
 
 
 class Mazda3_2015(Enum):
@@ -46,6 +47,71 @@ class Vehicles(Enum):
     Mazda3_2015 = 0
 
 
+#
+# DIDs
+#
+
+rbcm_dids = {
+    0xde00: Schema('Normal', [
+        Field('auto_door_lock_enable', 0x1 * 8 + 7, 1, "Auto door lock available"),
+        Field('auto_door_lock_disable', 0x9 * 8 + 3, 1, "Auto door lock not available"),
+        Field('auto_door_lock_type', 0x9 * 8 + 4, 7, "Auto door lock type"),
+        Field('head_light_off_timer_disable', 0xB * 8 + 4, 1, "Head light off timer not available"),
+    ], 14),
+    0xde01: Schema('MCP_BCE_2', [
+        Field('auto_door_lock', 0, 15, "Auto door lock"),
+        Field('interior_light_door_close', 8, 7, "Interior light door close"),
+        Field('interior_light_door_open', 11, 3, "Interior light door open"),
+        Field('head_light_off_timer', 16, 7, "Head light off timer"),
+        Field('three_flashes_turn', 19, 3, "3 flashes turn"),
+        Field('rain_wiper', 24, 3, "Rain wiper"),
+        Field('head_light', 26, 7, "Head light"),
+        Field('coming_home_light', 32, 7, "Coming home light"),
+        Field('leaving_home_light', 35, 3, "Leaving home light"),
+    ], 5),
+}
+
+ic_dids = {
+    # Lines of 5 bytes, the first two bytes are the checksum of the others
+    0xf106: Schema('Normal', [
+        Field('checksum', 0, 65535, "Checksum"),
+        Field('scbs_r_disable', ((16 - 1) * 5 + 2) * 8 + 5, 1, "SCBS-R not available"),
+        Field('scbs_r_enable', ((16 - 1) * 5 + 2) * 8 + 6, 1, "SCBS-R available"),
+    ], 136),
+}
+
+psm_dids = {
+    0xda70: Schema('Normal', [
+        Field('rear_scbs_prohibited_dtc', 0, 1, "Rear SCBS Control is Prohibited by DTC"),
+        Field('rear_scbs_prohibited_towbar', 2, 1, "Rear SCBS Control is Prohibited by Towbar Connection"),
+        Field('rear_scbs_prohibited_trailer', 3, 1, "Rear SCBS Control is Prohibited by Trailer Connection"),
+        Field('rear_scbs_prohibited_factory_mode', 4, 1, "Rear SCBS Control is Prohibited by Factory Mode"),
+        Field('rear_scbs_prohibited_switch_off', 5, 1, "Rear SCBS Control is Prohibited by SCBS Switch OFF"),
+        Field('rear_scbs_prohibited_pcm_fault', 6, 1, "Rear SCBS Control is Prohibited by PCM fault"),
+        Field('rear_scbs_prohibited_scbs_fault', 7, 1, "Rear SCBS Control is Prohibited by SCBS fault"),
+        Field('rear_scbs_prohibited_battery', 12, 1, "Rear SCBS Control is Prohibited by Battery Voltage"),
+        Field('rear_scbs_prohibited_steering', 13, 1, "Rear SCBS Control is Prohibited by Steering Angle"),
+        Field('rear_scbs_prohibited_slope', 14, 1, "Rear SCBS Control is Prohibited by Slope"),
+        Field('rear_scbs_prohibited_temperature', 15, 1,
+              "Rear SCBS Control is Prohibited by Ambient Air Temperature"),
+    ], 2),
+    0xda72: Schema('Normal', [Field('rear_left_corner_sensor', 0, 255, "Rear Left Corner Sensor")], 1),
+    0xda73: Schema('Normal', [Field('rear_right_corner_sensor', 0, 255, "Rear Right Corner Sensor")], 1),
+    0xda74: Schema('Normal', [Field('rear_left_sensor', 0, 255, "Rear Left Sensor")], 1),
+    0xda75: Schema('Normal', [Field('rear_right_sensor', 0, 255, "Rear Right Sensor")], 1),
+    0xda76: Schema('Normal', [Field('front_left_corner_sensor', 0, 255, "Front Left Corner Sensor")], 1),
+    0xda77: Schema('Normal', [Field('front_right_corner_sensor', 0, 255, "Front Right Corner Sensor")], 1),
+    0xda78: Schema('Normal', [Field('front_left_sensor', 0, 255, "Front Left Sensor")], 1),
+    0xda79: Schema('Normal', [Field('front_right_sensor', 0, 255, "Front Right Sensor")], 1),
+    0xda7d: Schema('Normal', [Field('reverse_lamp', 7, 1, "Reverse Lamp")], 1),
+    0xda84: Schema('Normal', [
+        Field('rear_buzzer', 0, 7, "Rear Buzzer Output status"),
+        Field('front_buzzer', 3, 7, "Front Buzzer Output status"),
+        Field('psm_off_switch', 7, 1, "PSM Off Switch"),
+    ], 1),
+}
+
+
 vehicles_data = {
     Vehicles.Mazda3_2015: Vehicle(
         {
@@ -69,7 +135,7 @@ vehicles_data = {
                     uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION,
                     [75, 48, 50, 49, 54, 0]
                 ),
-            })),
+            }), rbcm_dids),
             Mazda3_2015.PSM: Module(CanBus.MS, Security(Algorithm.Ford, {
                 SecurityType.SelfTest: SecurityData(
                     0,
@@ -86,7 +152,7 @@ vehicles_data = {
                     uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION,
                     [0, 0, 0, 0, 0, 0]
                 ),
-            })),
+            }), psm_dids),
             Mazda3_2015.EATC: Module(CanBus.MS, Security(Algorithm.Ford, {
                 SecurityType.SelfTest: SecurityData(
                     0,
@@ -189,7 +255,7 @@ vehicles_data = {
                     uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION,
                     [78, 83, 89, 78, 83, 0]
                 ),
-            })),
+            }), ic_dids),
             Mazda3_2015.PCM: Module(CanBus.HS, Security(Algorithm.Ford, {
                 SecurityType.Reprog: SecurityData(
                     uds.UDS_SA_TYPES_SEED,
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+#
+# ReadMemoryByAddress dump engine
+#
+# The block size starts from a guess and doubles after each successful read until the ECU refuses a block,
+# then it is bisected between the largest accepted and the smallest refused sizes. The refused blocks are
+# read again with a smaller size, down to min_block_size where the block is recorded as unreadable and
+# left as a hole in the sparse output.
+#
+
+import logging
+import time
+
+import pyds.transfer
+from pyds.extuds import NegativeResponseException, SESSION_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class BlockSize(object):
+    """
+    Adaptive size of the requests, a multiple of minimum
+
+    A refused size is forgotten after probe_interval successful reads so that the size can grow again.
+    A block refused with a size already accepted is read again in smaller parts without changing the learned size.
+    """
+
+    def __init__(self, initial, minimum, maximum, probe_interval=256):
+        self._minimum = minimum
+        self._maximum = maximum
+        self._probe_interval = probe_interval
+        self._size = self._round(min(initial, maximum))
+        self._shrink = None
+        self._good = None
+        self._bad = None
+        self._successes = 0
+
+    def _round(self, size):
+        return max(self._minimum, size - size % self._minimum)
+
+    @property
+    def size(self):
+        return self._shrink if self._shrink is not None else self._size
+
+    @property
+    def minimum(self):
+        return self._minimum
+
+    @property
+    def good(self):
+        return self._good
+
+    def success(self, length):
+        if self._shrink is not None:
+            self._shrink = None
+            return
+        if length < self._size:
+            # Shortened block
+            return
+        self._good = max(self._good or 0, self._size)
+        self._successes += 1
+        if self._bad is not None and self._successes >= self._probe_interval:
+            self._bad = None
+        if self._bad is None:
+            self._size = self._round(min(self._size * 2, self._maximum))
+        else:
+            self._size = self._round((self._good + self._bad) // 2)
+
+    def failure(self, length):
+        if self._shrink is not None or length < self._size or \
+                (self._good is not None and self._size <= self._good):
+            # The content of the area is refused
+            self._shrink = self._round(length // 2)
+            return
+        self._bad = self._size
+        self._successes = 0
+        if self._good is not None:
+            self._size = self._round((self._good + self._bad) // 2)
+        else:
+            self._size = self._round(self._size // 2)
+
+
+class MemoryDump(object):
+    """
+    Dump of size bytes at address with ReadMemoryByAddress
+
+    output: None for a new bytearray, the path of a file or a writable buffer (see OutputBuffer)
+    journal: path of the resume journal, the ranges recorded in it are not read again, so it requires an output
+    progress: callable(done, size, rate) called at most twice a second, rate is in bytes/s
+    max_timeouts: consecutive failures without reply before giving up
+    """
+
+    def __init__(self, channel, address, size, output=None, journal=None, addr_size=4, size_size=2,
+                 block_size=0x100, min_block_size=0x10, max_block_size=0xFFE, max_timeouts=4, progress=None,
+                 timeout=None):
+        if journal is not None and output is None:
+            raise ValueError("A journal requires an output file or buffer")
+        self._channel = channel
+        self._address = address
+        self._size = size
+        self._output = output
+        self._journal = pyds.transfer.Journal(journal, address, size) if journal is not None else None
+        self._addr_size = addr_size
+        self._size_size = size_size
+        self._block_size = BlockSize(block_size, min_block_size, max_block_size)
+        self._max_timeouts = max_timeouts
+        self._progress = progress
+        self._timeout = timeout
+        self._stats = {'read': 0, 'bad': 0, 'requests': 0, 'refused': 0, 'timeouts': 0, 'elapsed': 0.0}
+
+    @property
+    def block_size(self):
+        return self._block_size
+
+    @property
+    def stats(self):
+        stats = dict(self._stats)
+        stats['rate'] = stats['read'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+        return stats
+
+    def run(self):
+        """
+        Returns the output, or the new bytearray
+        """
+        buffer = pyds.transfer.OutputBuffer(self._output, self._size)
+        entries = []
+        if self._journal is not None:
+            entries = self._journal.load()
+            if not entries:
+                self._journal.reset()
+        done = sum([length for offset, length, ok in entries])
+        progress = pyds.transfer.Progress(self._progress, self._size)
+        progress.update(done, True)
+        pending = []
+        last_commit = [time.time()]
+        start = time.time()
+
+        def commit():
+            buffer.flush()
+            if self._journal is not None:
+                self._journal.append(pending)
+            del pending[:]
+            last_commit[0] = time.time()
+
+        try:
+            for begin, end in pyds.transfer.get_missing_ranges(entries, self._size):
+                offset = begin
+                timeouts = 0
+                while offset < end:
+                    length = min(self._block_size.size, end - offset)
+                    # Keep the blocks aligned so that an unreadable area does not swallow its neighbours
+                    aligned = offset + length - (self._address + offset + length) % self._block_size.minimum
+                    if aligned > offset:
+                        length = aligned - offset
+                    self._stats['requests'] += 1
+                    try:
+                        data = self._channel.send_rmba((self._address + offset, self._addr_size),
+                                                       (length, self._size_size), self._timeout)
+                        refused = len(data) != length
+                    except NegativeResponseException as e:
+                        if e.getReply().getErrorCode() in SESSION_ERRORS:
+                            raise
+                        refused = True
+                    except Exception as e:
+                        self._stats['timeouts'] += 1
+                        timeouts += 1
+                        logger.debug("No reply for %d bytes at %x: %s" % (length, self._address + offset, e))
+                        if timeouts >= self._max_timeouts:
+                            raise
+                        # A single timeout can be a lost frame, a repeated one can come from a too large block
+                        if timeouts > 1 and length > self._block_size.minimum:
+                            self._block_size.failure(length)
+                        continue
+                    timeouts = 0
+                    if refused:
+                        self._stats['refused'] += 1
+                        if length <= self._block_size.minimum:
+                            logger.info("Can't read %d bytes at %x" % (length, self._address + offset))
+                            pending.append((offset, length, False))
+                            self._stats['bad'] += length
+                            offset += length
+                            done += length
+                        else:
+                            self._block_size.failure(length)
+                        continue
+                    buffer.write(offset, data)
+                    pending.append((offset, length, True))
+                    self._stats['read'] += length
+                    self._block_size.success(length)
+                    offset += length
+                    done += length
+                    progress.update(done)
+                    if len(pending) >= 64 or time.time() - last_commit[0] >= 1.0:
+                        commit()
+            commit()
+            progress.update(done, True)
+            if self._journal is not None:
+                self._journal.remove()
+            return buffer.data
+        finally:
+            self._stats['elapsed'] += time.time() - start
+            if pending:
+                commit()
+            buffer.close()
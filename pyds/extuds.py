@@ -23,10 +23,17 @@ __author__ = "Yann Diorcet"
 __license__ = "GPL"
 __version__ = "0.0.1"
 
+import collections
+import random
 import struct
+import threading
+import time
+import zlib
 import uds
 import logging
 
+import pyds.transfer
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -34,6 +41,348 @@ try:
 except NameError:
     input = input
 
+# Negative responses of a multi-DID RDBI which mean that the request holds too many identifiers:
+# incorrectMessageLengthOrInvalidFormat and responseTooLong
+RDBI_BATCH_ERRORS = (0x13, 0x14)
+
+# requestOutOfRange: for a multi-DID RDBI, one of the identifiers isn't supported
+RDBI_OUT_OF_RANGE = 0x31
+
+
+# suppressPosRspMsgIndicationBit of the sub-functions
+SUPPRESS_POSITIVE_RESPONSE = 0x80
+
+# S3 server timeout of ISO 14229-2 in ms: without request the ECU goes back to the default session
+S3_SERVER_TIMEOUT = 5000
+
+# Time in ms before the timeout within which a failed receive is still considered as timed out, for the
+# resolution of the timers
+TIMER_RESOLUTION = 20
+
+# Negative responses which mean that the session or the security access isn't the expected one:
+# securityAccessDenied, subFunctionNotSupportedInActiveSession and serviceNotSupportedInActiveSession
+SESSION_ERRORS = (0x33, 0x7E, 0x7F)
+
+# startRoutine sub-function of RoutineControl
+RC_START_ROUTINE = 0x01
+
+
+class SessionState(object):
+    """
+    Last known diagnostic session and unlocked security level (seed type) of an ECU
+
+    None means unknown. The state is updated by the replies of the ECU and expires with the S3 server timeout:
+    during the last margin ms of the timeout the session is unknown, after it the ECU is in the default
+    session with the security locked.
+    """
+
+    def __init__(self, s3_timeout=S3_SERVER_TIMEOUT, margin=500):
+        self._s3_timeout = s3_timeout
+        self._margin = margin
+        self._session = None
+        self._level = None
+        self._last_activity = None
+
+    def _check(self):
+        if self._last_activity is None or self._session == uds.UDS_DSC_TYPES_DEFAULT_SESSION:
+            return
+        elapsed = (time.time() - self._last_activity) * 1000
+        if elapsed > self._s3_timeout:
+            self._session = uds.UDS_DSC_TYPES_DEFAULT_SESSION
+            self._level = None
+        elif elapsed > self._s3_timeout - self._margin:
+            self._session = None
+            self._level = None
+
+    @property
+    def session(self):
+        self._check()
+        return self._session
+
+    @property
+    def level(self):
+        self._check()
+        return self._level
+
+    @property
+    def last_activity(self):
+        return self._last_activity
+
+    def touch(self):
+        self._check()
+        self._last_activity = time.time()
+
+    def set_session(self, session):
+        self._session = session
+        self._level = None
+        self._last_activity = time.time()
+
+    def set_level(self, level):
+        self._level = level
+        self._last_activity = time.time()
+
+    def reset(self):
+        self.set_session(uds.UDS_DSC_TYPES_DEFAULT_SESSION)
+
+    def invalidate(self):
+        self._session = None
+        self._level = None
+
+
+# Default P2server_max and P2*server_max of ISO 14229-2 in ms
+DEFAULT_P2 = 50
+DEFAULT_P2_STAR = 5000
+
+# Time in ms added to the server timings for the transport (J2534 device, ISO-TP frames)
+NETWORK_MARGIN = 250
+
+# Time in ms allowed for each consecutive frame of a multi-frame ISO-TP reply: the ECU doesn't send
+# response pending during the transport, which can last longer than P2 for the large replies
+ISOTP_FRAME_TIME = 10
+ISOTP_SINGLE_FRAME = 7
+ISOTP_FIRST_FRAME = 6
+ISOTP_CONSECUTIVE_FRAME = 7
+
+
+class Timing(object):
+    """
+    Timeouts of an ECU
+
+    The timeout of a request is P2server_max plus a network margin, raised to 1.5 times the 99th percentile
+    of the last observed latencies. A pending response (NRC 0x78) waits for P2*server_max plus the margin.
+    P2 and P2* come from the parameter record of the DSC replies.
+    When the length of the reply is known, the time of its ISO-TP consecutive frames is added, and removed
+    from the observed latency.
+    """
+
+    def __init__(self, p2=DEFAULT_P2, p2_star=DEFAULT_P2_STAR, margin=NETWORK_MARGIN, window=64, min_samples=8):
+        self._p2 = p2
+        self._p2_star = p2_star
+        self._margin = margin
+        self._samples = collections.deque(maxlen=window)
+        self._min_samples = min_samples
+
+    @property
+    def p2(self):
+        return self._p2
+
+    @property
+    def p2_star(self):
+        return self._p2_star
+
+    def set_parameters(self, record):
+        if len(record) < 4:
+            return
+        self._p2 = struct.unpack(">H", bytes(record[0:2]))[0]
+        self._p2_star = struct.unpack(">H", bytes(record[2:4]))[0] * 10
+
+    @staticmethod
+    def transport_time(reply_length):
+        """
+        Returns the time in ms allowed for the consecutive frames of a reply of reply_length bytes
+        """
+        if reply_length is None or reply_length <= ISOTP_SINGLE_FRAME:
+            return 0
+        frames = (reply_length - ISOTP_FIRST_FRAME + ISOTP_CONSECUTIVE_FRAME - 1) // ISOTP_CONSECUTIVE_FRAME
+        return frames * ISOTP_FRAME_TIME
+
+    def record(self, latency, reply_length=None):
+        self._samples.append(max(0, latency - self.transport_time(reply_length)))
+
+    def percentile(self, p):
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def histogram(self):
+        """
+        Returns the (upper bound in ms, count) of the power of 2 buckets of the observed latencies
+        """
+        buckets = collections.defaultdict(int)
+        for latency in self._samples:
+            bound = 1
+            while bound < latency:
+                bound <<= 1
+            buckets[bound] += 1
+        return sorted(buckets.items())
+
+    @property
+    def timeout(self):
+        timeout = self._p2 + self._margin
+        if len(self._samples) >= self._min_samples:
+            timeout = max(timeout, min(self.percentile(0.99) * 1.5, self.pending_timeout))
+        return int(timeout)
+
+    @property
+    def pending_timeout(self):
+        return int(self._p2_star + self._margin)
+
+    def get_timeout(self, reply_length=None):
+        return self.timeout + self.transport_time(reply_length)
+
+    def get_pending_timeout(self, reply_length=None):
+        return self.pending_timeout + self.transport_time(reply_length)
+
+
+def is_seed_request(request):
+    return len(request) > 1 and request[1] % 2 == 1
+
+
+class RetryRule(object):
+    """
+    Retry of a negative response
+
+    Waits delay * factor ^ retry seconds, bounded by max_delay and reduced by up to jitter of its value, for
+    at most attempts retries. The rule only applies to the requests accepted by filter when it is set.
+    """
+
+    def __init__(self, attempts, delay, factor=2.0, max_delay=10.0, jitter=0.5, filter=None):
+        self._attempts = attempts
+        self._delay = delay
+        self._factor = factor
+        self._max_delay = max_delay
+        self._jitter = jitter
+        self._filter = filter
+
+    @property
+    def attempts(self):
+        return self._attempts
+
+    def accept(self, request):
+        return self._filter is None or self._filter(request)
+
+    def get_delay(self, retry, rand):
+        delay = min(self._delay * (self._factor ** retry), self._max_delay)
+        return delay * (1.0 - rand.uniform(0, self._jitter))
+
+
+# SA delay timer: the ECU refuses the seed requests after too many invalid keys. Waiting for it doesn't
+# consume security access attempts.
+SA_DELAY = 10.0
+
+DEFAULT_RETRY_RULES = {
+    # busyRepeatRequest
+    (None, 0x21): RetryRule(5, 0.05),
+    # conditionsNotCorrect
+    (None, 0x22): RetryRule(3, 0.2),
+    # exceededNumberOfAttempts and requiredTimeDelayNotExpired on a seed request
+    (uds.UDS_SERVICES_SA, 0x36): RetryRule(1, SA_DELAY, max_delay=SA_DELAY, jitter=0, filter=is_seed_request),
+    (uds.UDS_SERVICES_SA, 0x37): RetryRule(2, SA_DELAY, max_delay=SA_DELAY, jitter=0, filter=is_seed_request),
+}
+
+
+class RetryPolicy(object):
+    """
+    Retries of the negative responses, keyed by (service, NRC) or (None, NRC) for all the services
+
+    budget bounds the total wait of a request in seconds. The counters of each NRC give the number of
+    negative responses, of retries, of failures and the time spent waiting.
+    """
+
+    def __init__(self, rules=None, budget=30.0, seed=None):
+        self._rules = dict(DEFAULT_RETRY_RULES if rules is None else rules)
+        self._budget = budget
+        self._random = random.Random(seed)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @property
+    def counters(self):
+        with self._lock:
+            return dict([(nrc, dict(counter)) for nrc, counter in self._counters.items()])
+
+    def get_rule(self, request, nrc):
+        rule = self._rules.get((request[0], nrc))
+        if rule is None:
+            rule = self._rules.get((None, nrc))
+        if rule is not None and not rule.accept(request):
+            rule = None
+        return rule
+
+    def get_delay(self, request, nrc, retry, waited):
+        """
+        Returns the time to wait in seconds before the retry of the request, None to give up
+        """
+        rule = self.get_rule(request, nrc)
+        with self._lock:
+            counter = self._counters.setdefault(nrc, {'count': 0, 'retries': 0, 'failures': 0, 'wait': 0.0})
+            counter['count'] += 1
+            delay = None
+            if rule is not None and retry < rule.attempts:
+                delay = rule.get_delay(retry, self._random)
+                if self._budget is not None and waited + delay > self._budget:
+                    delay = None
+            if delay is None:
+                if rule is not None:
+                    counter['failures'] += 1
+                return None
+            counter['retries'] += 1
+            counter['wait'] += delay
+            return delay
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+# Shared by the channels so that the counters cover a whole run
+default_retry_policy = RetryPolicy()
+
+
+class HexData(object):
+    """
+    Bytes rendered in hexadecimal only when converted to a string, for the arguments of the loggers
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __str__(self):
+        return " ".join(['%02x' % (k) for k in bytearray(self._data)])
+
+
+class Tracer(object):
+    """
+    Subscriber of the exchanges of an ExtendedUDS, the methods are called with the data of the messages
+
+    request is called once by request, before its retries, and can raise an exception to cancel it.
+    The latencies are in ms. The suppressed TesterPresent requests of the keepalive aren't traced.
+    """
+
+    def request(self, channel, sid, data):
+        pass
+
+    def reply(self, channel, sid, data, latency):
+        pass
+
+    def pending(self, channel, sid, latency):
+        pass
+
+    def negative_response(self, channel, sid, nrc, latency):
+        pass
+
+    def error(self, channel, sid, exception):
+        pass
+
+
+class StepByStepTracer(Tracer):
+    """
+    Asks the user to confirm each request
+    """
+
+    def request(self, channel, sid, data):
+        print("Will send: %s" % (HexData(data)))
+        response = input("Are you sure to send this? ")
+        if response != 'YES':
+            raise Exception("Interrupted by the user")
+
 
 class NegativeResponseException(Exception):
     def __init__(self, reply):
@@ -46,10 +395,90 @@ class NegativeResponseException(Exception):
         return "Error %x for service %x" % (self.reply.getErrorCode(), self.reply.getRequestServiceID())
 
 
+class InvalidRecordException(Exception):
+    """
+    Reply of a multi-DID RDBI request which can't be split into data records
+    """
+    pass
+
+
 class ExtendedUDS(object):
-    def __init__(self, uds_channel, step_by_step=True):
+    def __init__(self, uds_channel, step_by_step=True, session_state=None, timing=None, retry_policy=None,
+                 lock=None):
+        self._tracers = []
         self.step_by_step = step_by_step
         self._uds_channel = uds_channel
+        self._retry_policy = retry_policy if retry_policy is not None else default_retry_policy
+        self._rdbi_batch_size = None
+        self._session_state = session_state if session_state is not None else SessionState()
+        self._timing = timing if timing is not None else Timing()
+        # The UDS channels of a physical channel share its lock (see pyds.pyds.ChannelPool)
+        self._lock = lock if lock is not None else threading.RLock()
+
+    @property
+    def tracers(self):
+        return tuple(self._tracers)
+
+    def add_tracer(self, tracer):
+        if tracer not in self._tracers:
+            # Replaced rather than modified: send iterates over the list without the lock
+            self._tracers = self._tracers + [tracer]
+
+    def remove_tracer(self, tracer):
+        self._tracers = [x for x in self._tracers if x is not tracer]
+
+    @property
+    def step_by_step(self):
+        return any([isinstance(x, StepByStepTracer) for x in self._tracers])
+
+    @step_by_step.setter
+    def step_by_step(self, value):
+        if value and not self.step_by_step:
+            self.add_tracer(StepByStepTracer())
+        elif not value:
+            self._tracers = [x for x in self._tracers if not isinstance(x, StepByStepTracer)]
+
+    @property
+    def lock(self):
+        """
+        Lock held during each exchange with the ECU, the one of the physical channel when it is shared
+        """
+        return self._lock
+
+    @property
+    def session_state(self):
+        return self._session_state
+
+    @session_state.setter
+    def session_state(self, value):
+        self._session_state = value
+
+    @property
+    def retry_policy(self):
+        return self._retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, value):
+        self._retry_policy = value
+
+    @property
+    def timing(self):
+        return self._timing
+
+    @timing.setter
+    def timing(self, value):
+        self._timing = value
+
+    @property
+    def rdbi_batch_size(self):
+        """
+        Maximum number of DIDs per RDBI request, None if no limit is known yet
+        """
+        return self._rdbi_batch_size
+
+    @rdbi_batch_size.setter
+    def rdbi_batch_size(self, value):
+        self._rdbi_batch_size = value
 
     @staticmethod
     def int16tobytes(number):
@@ -81,23 +510,64 @@ class ExtendedUDS(object):
         else:
             return reply
 
-    def send(self, sid, data, timeout=2000):
-        timeout_multiplier = 1
+    def send(self, sid, data, timeout=None, reply_length=None):
         fdata = bytearray([sid])
         fdata.extend(data)
+        return self.send_frame(fdata, timeout, reply_length)
+
+    def send_frame(self, fdata, timeout=None, reply_length=None):
+        """
+        Send the request fdata, a bytearray starting with the service ID, without copying it
+
+        reply_length: expected length of the reply with its SID, for the default timeouts (see Timing)
+        """
+        sid = fdata[0]
         message = uds.UDSMessage(fdata)
-        if self.step_by_step:
-            print("Will send: %s" % (" ".join(['%02x' % (k) for k in fdata])))
-            response = input("Are you sure to send this? ")
-            if response != 'YES':
-                raise Exception("Interrupted by the user")
-        logger.debug("Sending: %s" % (" ".join(['%02x' % (k) for k in fdata])))
+        for tracer in self._tracers:
+            tracer.request(self, sid, fdata)
+        # The data is only formatted if the message is logged
+        logger.debug("Sending: %s", HexData(fdata))
 
+        retry = 0
+        waited = 0.0
         while True:
-            reply = self.buildMessage(self._uds_channel.send(message, timeout * timeout_multiplier))
+            try:
+                with self._lock:
+                    return self._exchange(sid, message, fdata, timeout, reply_length)
+            except NegativeResponseException as e:
+                delay = self._retry_policy.get_delay(fdata, e.getReply().getErrorCode(), retry, waited)
+                if delay is None:
+                    raise
+                logger.debug("%s, retry in %.2fs" % (e, delay))
+                # Without the lock, the keepalive can run while waiting
+                time.sleep(delay)
+                retry += 1
+                waited += delay
+
+    def _exchange(self, sid, message, fdata, timeout, reply_length=None):
+        if timeout is None:
+            timeout = self._timing.get_timeout(reply_length)
+        tracers = self._tracers
+        while True:
+            start = time.time()
+            try:
+                reply = self.buildMessage(self._uds_channel.send(message, timeout))
+            except Exception as e:
+                for tracer in tracers:
+                    tracer.error(self, sid, e)
+                raise
+            latency = (time.time() - start) * 1000
+            if message is not None:
+                self._timing.record(latency, reply_length)
             message = None
-            logger.debug("Received: %s" % (" ".join(['%02x' % (k) for k in reply.getData()])))
+            logger.debug("Received: %s", HexData(reply.getData()))
             if isinstance(reply, uds.UDSNegativeResponseMessage):
+                if reply.getErrorCode() in SESSION_ERRORS:
+                    self._session_state.invalidate()
+                else:
+                    self._session_state.touch()
+                for tracer in tracers:
+                    tracer.negative_response(self, sid, reply.getErrorCode(), latency)
                 raise NegativeResponseException(reply)
             if reply.getServiceID() == (uds.UDS_SERVICES_ERR | uds.UDS_REPLY_MASK):
                 data = reply.getData()
@@ -105,13 +575,59 @@ class ExtendedUDS(object):
                 if srdid != sid or error != uds.UDS_RESPONSE_CODES_RCRRP:
                     raise Exception("Invalid reply %x for a request of type %x" % (reply.getServiceID(), sid))
                 logger.debug("Response delayed")
-                timeout_multiplier *= 2
+                for tracer in tracers:
+                    tracer.pending(self, sid, latency)
+                timeout = self._timing.get_pending_timeout(reply_length)
                 continue
             elif reply.getServiceID() != (sid | uds.UDS_REPLY_MASK):
                 raise Exception("Invalid reply %x for a request of type %x" % (reply.getServiceID(), sid))
+            self._update_session_state(fdata)
+            if sid == uds.UDS_SERVICES_DSC:
+                self._timing.set_parameters(reply.getData()[uds.UDS_DSC_PARAMETER_RECORD_OFFSET:])
+            for tracer in tracers:
+                tracer.reply(self, sid, reply.getData(), latency)
             return reply
 
-    def send_dsc(self, type, timeout=2000):
+    def _update_session_state(self, request):
+        sid = request[0]
+        type = request[1] & 0x7f if len(request) > 1 else None
+        if sid == uds.UDS_SERVICES_DSC:
+            self._session_state.set_session(type)
+        elif sid == uds.UDS_SERVICES_SA and type % 2 == 0:
+            self._session_state.set_level(type - 1)
+        elif sid == uds.UDS_SERVICES_ER:
+            self._session_state.reset()
+        else:
+            self._session_state.touch()
+
+    def send_tp(self, suppress=True, timeout=None):
+        """
+        TesterPresent
+
+        With suppress the ECU only replies on error: the request is considered delivered when no reply is
+        received within timeout. The errors reported before the timeout are those of the channel, and raised.
+        """
+        if not suppress:
+            self.send(uds.UDS_SERVICES_TP, bytearray([0x00]), timeout)
+            return
+        fdata = bytearray([uds.UDS_SERVICES_TP, 0x00 | SUPPRESS_POSITIVE_RESPONSE])
+        if timeout is None:
+            timeout = self._timing.timeout
+        with self._lock:
+            start = time.time()
+            try:
+                reply = self.buildMessage(self._uds_channel.send(uds.UDSMessage(fdata), timeout))
+            except Exception as e:
+                if (time.time() - start) * 1000 < timeout - TIMER_RESOLUTION:
+                    raise
+                logger.debug("No reply to TesterPresent: %s" % (e))
+                reply = None
+            if isinstance(reply, uds.UDSNegativeResponseMessage):
+                self._session_state.invalidate()
+                raise NegativeResponseException(reply)
+            self._session_state.touch()
+
+    def send_dsc(self, type, timeout=None):
         reply = self.send(uds.UDS_SERVICES_DSC, bytearray([type]), timeout)
         data = reply.getData()
         rtype = self.slice_data(data, uds, 'UDS_DSC_TYPE')[0]
@@ -119,7 +635,7 @@ class ExtendedUDS(object):
             raise Exception("Invalid dataIdentifier %x for a request of type %x" % (rtype, type))
         return data[uds.UDS_DSC_PARAMETER_RECORD_OFFSET:]
 
-    def send_sa(self, type, data, timeout=2000):
+    def send_sa(self, type, data, timeout=None):
         reply = self.send(uds.UDS_SERVICES_SA, bytearray([type]) + data, timeout)
         data = reply.getData()
         rtype = self.slice_data(data, uds, 'UDS_SA_TYPE')[0]
@@ -127,15 +643,124 @@ class ExtendedUDS(object):
             raise Exception("Invalid dataIdentifier %x for a request of type %x" % (rtype, type))
         return data[uds.UDS_SA_KEY_OFFSET:]
 
-    def send_rdbi(self, did, timeout=2000):
-        reply = self.send(uds.UDS_SERVICES_RDBI, self.int16tobytes(did), timeout)
+    def send_rdbi(self, did, timeout=None, copy=True, length=None):
+        """
+        length: size of the data record when it is known, for the default timeout
+        """
+        reply_length = 3 + length if length is not None else None
+        reply = self.send(uds.UDS_SERVICES_RDBI, self.int16tobytes(did), timeout, reply_length)
         data = reply.getData()
         rdid = self.bytestoint16(self.slice_data(data, uds, 'UDS_RDBI_DATA_IDENTIFIER'))
         if rdid != did:
             raise Exception("Invalid dataIdentifier %x for a request of type %x" % (rdid, did))
+        if not copy:
+            # View on the reply buffer, nothing is copied
+            return memoryview(data)[uds.UDS_RDBI_DATA_RECORD_OFFSET:]
         return data[uds.UDS_RDBI_DATA_RECORD_OFFSET:]
 
-    def send_rmba(self, addr_tuple, size_tuple, timeout=2000):
+    def _send_rdbi_batch(self, dids, lengths, timeout, copy):
+        reply_length = None
+        if all([lengths.get(did) is not None for did in dids]):
+            reply_length = 1 + sum([2 + lengths[did] for did in dids])
+        reply = self.send(uds.UDS_SERVICES_RDBI, bytearray().join([self.int16tobytes(did) for did in dids]), timeout,
+                          reply_length)
+        data = reply.getData()
+        if not copy:
+            data = memoryview(data)
+
+        # Unsupported DIDs are omitted from the reply, the others are in the order of the request
+        records = {}
+        offset = uds.UDS_RDBI_DATA_IDENTIFIER_OFFSET
+        pending = list(dids)
+        while offset < len(data):
+            rdid = self.bytestoint16(bytes(data[offset:offset + uds.UDS_RDBI_DATA_IDENTIFIER_LEN]))
+            if rdid not in pending:
+                raise InvalidRecordException("Invalid dataIdentifier %x for a request of type %s" %
+                                (rdid, ", ".join(["%x" % did for did in dids])))
+            del pending[:pending.index(rdid) + 1]
+            offset += uds.UDS_RDBI_DATA_IDENTIFIER_LEN
+            length = lengths.get(rdid)
+            if length is None:
+                length = len(data) - offset
+            if offset + length > len(data):
+                raise InvalidRecordException("Truncated dataRecord for dataIdentifier %x" % (rdid))
+            records[rdid] = data[offset:offset + length]
+            offset += length
+        return records
+
+    def _send_rdbi_split(self, dids, lengths, timeout, copy):
+        # Read the halves of a request rejected with requestOutOfRange, down to the unsupported DID
+        half = len(dids) // 2
+        records = {}
+        for part in (dids[:half], dids[half:]):
+            if len(part) == 1:
+                records[part[0]] = self.send_rdbi(part[0], timeout, copy, lengths.get(part[0]))
+                continue
+            try:
+                reply = self._send_rdbi_batch(part, lengths, timeout, copy)
+            except NegativeResponseException as e:
+                if e.getReply().getErrorCode() != RDBI_OUT_OF_RANGE:
+                    raise
+                records.update(self._send_rdbi_split(part, lengths, timeout, copy))
+                continue
+            records.update(reply)
+            for did in part:
+                if did not in reply:
+                    records[did] = self.send_rdbi(did, timeout, copy, lengths.get(did))
+        return records
+
+    def send_rdbi_multi(self, dids, lengths=None, timeout=None, copy=True):
+        """
+        Read several DIDs with as few RDBI requests as possible
+
+        lengths maps the DIDs to the size of their data record. A DID without a known length can only be
+        the last one of a request. When the ECU rejects a request as too long, the batch size is halved down
+        to one DID per request and kept in rdbi_batch_size for the next calls. A request rejected as out of
+        range is split to read its unsupported DID alone, without changing the batch size.
+        Returns a dict of the data records indexed by DID.
+        """
+        lengths = lengths if lengths is not None else {}
+        known = [did for did in dids if lengths.get(did) is not None]
+        unknown = [did for did in dids if lengths.get(did) is None]
+        records = {}
+        while known or unknown:
+            size = self._rdbi_batch_size
+            if size is None:
+                size = len(known) + 1
+            batch = known[:size]
+            if len(batch) < size and unknown:
+                batch.append(unknown[0])
+            if len(batch) == 1:
+                records[batch[0]] = self.send_rdbi(batch[0], timeout, copy, lengths.get(batch[0]))
+            else:
+                try:
+                    reply = self._send_rdbi_batch(batch, lengths, timeout, copy)
+                except NegativeResponseException as e:
+                    if e.getReply().getErrorCode() == RDBI_OUT_OF_RANGE:
+                        logger.debug("RDBI of %d DIDs out of range: %s" % (len(batch), e))
+                        reply = self._send_rdbi_split(batch, lengths, timeout, copy)
+                    elif e.getReply().getErrorCode() in RDBI_BATCH_ERRORS:
+                        logger.debug("RDBI of %d DIDs rejected: %s" % (len(batch), e))
+                        self._rdbi_batch_size = len(batch) // 2
+                        continue
+                    else:
+                        raise
+                except InvalidRecordException as e:
+                    # The timeouts and the transport errors are not related to the batch size
+                    logger.debug("Invalid RDBI reply for %d DIDs: %s" % (len(batch), e))
+                    self._rdbi_batch_size = len(batch) // 2
+                    continue
+                records.update(reply)
+
+                # Missing DIDs are read alone to get their negative response
+                for did in batch:
+                    if did not in reply:
+                        records[did] = self.send_rdbi(did, timeout, copy, lengths.get(did))
+            known = [did for did in known if did not in batch]
+            unknown = [did for did in unknown if did not in batch]
+        return records
+
+    def send_rmba(self, addr_tuple, size_tuple, timeout=None):
         addr, addr_s = addr_tuple
         size, size_s = size_tuple
         alfi = (0x0F & addr_s) << 0 | (0x0F & size_s) << 4
@@ -143,11 +768,11 @@ class ExtendedUDS(object):
         mem_size = self.int32tobytes(size)[-size_s:]
 
         ba = bytearray([alfi]) + mem_addr + mem_size
-        reply = self.send(uds.UDS_SERVICES_RMBA, ba, timeout)
+        reply = self.send(uds.UDS_SERVICES_RMBA, ba, timeout, 1 + size)
         data = reply.getData()
         return data[uds.UDS_RMBA_DATA_RECORD_OFFSET:]
 
-    def send_rdtci(self, type, data, timeout=2000):
+    def send_rdtci(self, type, data, timeout=None):
         reply = self.send(uds.UDS_SERVICES_RDTCI, bytearray([type, data]), timeout)
         data = reply.getData()
         rtype = self.slice_data(data, uds, 'UDS_RDTCI_TYPE')[0]
@@ -155,7 +780,7 @@ class ExtendedUDS(object):
             raise Exception("Invalid type %x for a request of type %x" % (rtype, type))
         return data[uds.UDS_RDTCI_RECORD_OFFSET:]
 
-    def send_wdbi(self, did, data, timeout=2000):
+    def send_wdbi(self, did, data, timeout=None):
         reply = self.send(uds.UDS_SERVICES_WDBI, self.int16tobytes(did) + data, timeout)
         data = reply.getData()
         rdid = self.bytestoint16(self.slice_data(data, uds, 'UDS_WDBI_DATA_IDENTIFIER'))
@@ -163,7 +788,7 @@ class ExtendedUDS(object):
             raise Exception("Invalid dataIdentifier %x for a request of type %x" % (rdid, did))
         return data[uds.UDS_RDBI_DATA_RECORD_OFFSET:]
 
-    def send_wmba(self, addr_tuple, size_tuple, data, timeout=2000):
+    def send_wmba(self, addr_tuple, size_tuple, data, timeout=None):
         addr, addr_s = addr_tuple
         size, size_s = size_tuple
         alfi = (0x0F & addr_s) << 0 | (0x0F & size_s) << 4
@@ -176,7 +801,7 @@ class ExtendedUDS(object):
         if ba != data[uds.UDS_WMBA_ADDRESS_AND_LENGTH_FORMAT_IDENTIFIER_OFFSET:]:
             raise Exception("Invalid reply")
 
-    def send_iocbi(self, did, parameter, state, timeout=2000):
+    def send_iocbi(self, did, parameter, state, timeout=None):
         reply = self.send(uds.UDS_SERVICES_IOCBI, self.int16tobytes(did) + bytearray([parameter]) + state, timeout)
         data = reply.getData()
         rdid = self.bytestoint16(self.slice_data(data, uds, 'UDS_IOCBI_DATA_IDENTIFIER'))
@@ -184,21 +809,31 @@ class ExtendedUDS(object):
             raise Exception("Invalid dataIdentifier %x for a request of type %x" % (rdid, did))
         return data[uds.UDS_IOCBI_STATE_OFFSET:]
 
-    def send_cdtcs(self, func, timeout=2000):
+    def send_rc(self, type, rid, data=bytearray(), timeout=None):
+        """
+        RoutineControl, returns the routineStatusRecord
+        """
+        reply = self.send(uds.UDS_SERVICES_RC, bytearray([type]) + self.int16tobytes(rid) + data, timeout)
+        data = reply.getData()
+        if data[1] != type or self.bytestoint16(data[2:4]) != rid:
+            raise Exception("Invalid reply for the routine %x" % (rid))
+        return data[4:]
+
+    def send_cdtcs(self, func, timeout=None):
         reply = self.send(uds.UDS_SERVICES_CDTCS, bytearray(func), timeout)
         data = reply.getData()
         rfunc = self.slice_data(data, uds, 'UDS_CDTCS_TYPE')[0]
         if rfunc != func:
             raise Exception("Invalid func %x for a request of type %x" % (rfunc, func))
 
-    def send_cc(self, func, type, timeout=2000):
+    def send_cc(self, func, type, timeout=None):
         reply = self.send(uds.UDS_SERVICES_CC, bytearray([func, type]), timeout)
         data = reply.getData()
         rfunc = self.slice_data(data, uds, 'UDS_CC_SUB_FUNCTION')[0]
         if rfunc != func:
             raise Exception("Invalid func %x for a request of type %x" % (rfunc, func))
 
-    def reset(self, resetType, timeout=2000):
+    def reset(self, resetType, timeout=None):
         type = bytearray([resetType])
         reply = self.send(uds.UDS_SERVICES_ER, type, timeout)
         reply_data = reply.getData()
@@ -206,7 +841,7 @@ class ExtendedUDS(object):
         if type != reply_type:
             raise Exception("Invalid type %x for a request of type %x" % (type[0], reply_type[0]))
 
-    def change_diagnostic_session(self, sessionType, timeout=2000):
+    def change_diagnostic_session(self, sessionType, timeout=None):
         type = bytearray([sessionType])
         reply = self.send(uds.UDS_SERVICES_DSC, type, timeout)
         reply_data = reply.getData()
@@ -214,7 +849,7 @@ class ExtendedUDS(object):
         if type != reply_type:
             raise Exception("Invalid type %x for a request of type %x" % (type[0], reply_type[0]))
 
-    def grant_security_access(self, algo, timeout=2000):
+    def grant_security_access(self, algo, timeout=None):
         type = bytearray([uds.UDS_SA_TYPES_SEED_2])
         seed_reply = self.send(uds.UDS_SERVICES_SA, type, timeout)
         seed_reply_data = seed_reply.getData()
@@ -230,7 +865,14 @@ class ExtendedUDS(object):
         if type != reply_type:
             raise Exception("Invalid type %d for a request of type %d" % (type[0], reply_type[0]))
 
-    def upload(self, addr_tuple, size_tuple, timeout=2000):
+    @staticmethod
+    def bytestoint(bytes):
+        value = 0
+        for b in bytearray(bytes):
+            value = (value << 8) | b
+        return value
+
+    def _send_transfer_request(self, sid, prefix, addr_tuple, size_tuple, timeout):
         addr, addr_s = addr_tuple
         size, size_s = size_tuple
         compression = 0
@@ -240,36 +882,226 @@ class ExtendedUDS(object):
         mem_addr = self.int32tobytes(addr)[-addr_s:]
         mem_size = self.int32tobytes(size)[-size_s:]
 
-        # Request for upload
         ba = bytearray([dfi, alfi]) + mem_addr + mem_size
-        upload_reply_data = self.send(uds.UDS_SERVICES_RU, ba, timeout)
-        lfi = self.slice_data(upload_reply_data, uds, 'UDS_RU_LENGTH_FORMAT_IDENTIFIER')[0]
-        max_number_block_length = upload_reply_data[uds.UDS_RU_MAX_NUMBER_OF_BLOCK_LENGTH_OFFSET:uds.UDS_RU_MAX_NUMBER_OF_BLOCK_LENGTH_OFFSET + lfi]
-
-        sbsc = 1
-        data = bytearray()
-        while size > len(data):
-            # Ask for data
-            ba = bytearray([sbsc])
-            td_reply = self.send(uds.UDS_SERVICES_TD, ba, timeout)
-            td_reply_data = td_reply.getData()
-
-            # Check the reply
-            rbsc = self.slice_data(td_reply_data, uds, 'UDS_TD_BLOCK_SEQUENCE_COUNTER')[0]
-            if rbsc != sbsc:
-                raise Exception("Invalid block sequence counter value %d for a request of value %d" % (rbsc, sbsc))
-            if len(td_reply_data) >= max_number_block_length:
-                raise Exception("Invalid data length")
-
-            # Append
-            packet_data = td_reply_data[uds.UDS_TD_TRANSFER_PARAMETER_RECORD_OFFSET:]
-            data.extend(packet_data)
-            print("Progression %.0f (%d of %d)" % ((len(data) * 100) / size, len(data), size),
-                  sep='\r', end='', flush=True)
-
-            # Increment
-            sbsc = (sbsc + 1) % 256
-
-        # End of transfer
-        self.send(uds.UDS_SERVICES_RTE, bytearray([]), timeout)
-        print("End of the transfer")
+        reply = self.send(sid, ba, timeout)
+        data = reply.getData()
+        lfi = self.slice_data(data, uds, prefix + '_LENGTH_FORMAT_IDENTIFIER')[0]
+        length = (lfi >> 4) & 0x0F
+        offset = getattr(uds, prefix + '_MAX_NUMBER_OF_BLOCK_LENGTH_OFFSET')
+        if length == 0 or len(data) < offset + length:
+            raise Exception("Invalid lengthFormatIdentifier %x" % (lfi))
+        return self.bytestoint(data[offset:offset + length])
+
+    def send_ru(self, addr_tuple, size_tuple, timeout=None):
+        """
+        RequestUpload, returns the maxNumberOfBlockLength of the ECU
+        """
+        return self._send_transfer_request(uds.UDS_SERVICES_RU, 'UDS_RU', addr_tuple, size_tuple, timeout)
+
+    def send_rd(self, addr_tuple, size_tuple, timeout=None):
+        """
+        RequestDownload, returns the maxNumberOfBlockLength of the ECU
+        """
+        return self._send_transfer_request(uds.UDS_SERVICES_RD, 'UDS_RD', addr_tuple, size_tuple, timeout)
+
+    def send_td(self, sbsc, data=bytearray(), timeout=None, reply_length=None):
+        """
+        TransferData, returns the transferResponseParameterRecord
+
+        reply_length: the maxNumberOfBlockLength of an upload, whose replies carry the blocks
+        """
+        # The block is copied once, into the frame
+        fdata = bytearray([uds.UDS_SERVICES_TD, sbsc])
+        fdata.extend(data)
+        reply = self.send_frame(fdata, timeout, reply_length)
+        data = reply.getData()
+        rbsc = self.slice_data(data, uds, 'UDS_TD_BLOCK_SEQUENCE_COUNTER')[0]
+        if rbsc != sbsc:
+            raise Exception("Invalid block sequence counter value %d for a request of value %d" % (rbsc, sbsc))
+        return data[uds.UDS_TD_TRANSFER_PARAMETER_RECORD_OFFSET:]
+
+    def send_rte(self, timeout=None):
+        reply = self.send(uds.UDS_SERVICES_RTE, bytearray([]), timeout)
+        return reply.getData()[1:]
+
+    def upload(self, addr_tuple, size_tuple, output=None, progress=None, checkpoint=None, timeout=None):
+        """
+        Upload size bytes from addr, each block being written in place in the output
+
+        output: None for a new bytearray, the path of a file or a writable buffer (see OutputBuffer)
+        progress: callable(done, size, rate) called at most twice a second
+        checkpoint: path of a file where the progress is saved, an interrupted upload of the same range
+        restarts from it: the last transfer is continued if the ECU still accepts it, otherwise the rest is
+        requested again. The file is removed at the end of the upload. The data received before the
+        interruption is only kept by a file or a buffer of the caller, so a checkpoint requires an output.
+        Returns the output, or the new bytearray.
+        """
+        addr, addr_s = addr_tuple
+        size, size_s = size_tuple
+        if checkpoint is not None and output is None:
+            raise ValueError("A checkpoint requires an output file or buffer")
+        buffer = pyds.transfer.OutputBuffer(output, size)
+        progress = pyds.transfer.Progress(progress, size)
+        if checkpoint is not None:
+            checkpoint = pyds.transfer.Checkpoint(checkpoint)
+        try:
+            done = 0
+            sbsc = None
+            max_number_block_length = None
+            state = checkpoint.load() if checkpoint is not None else None
+            if state is not None and state.get('address') == addr and state.get('size') == size:
+                done = state['done']
+                sbsc = state['sbsc']
+                max_number_block_length = state['max_number_block_length']
+                logger.info("Resume the upload at %d of %d" % (done, size))
+            resumed = sbsc is not None
+            progress.update(done, True)
+            last_save = time.time()
+            unsaved = 0
+
+            def save():
+                buffer.flush()
+                checkpoint.save(address=addr, size=size, done=done, sbsc=sbsc,
+                                max_number_block_length=max_number_block_length)
+
+            while done < size:
+                if sbsc is None:
+                    max_number_block_length = self.send_ru((addr + done, addr_s), (size - done, size_s), timeout)
+                    sbsc = 1
+                try:
+                    record = self.send_td(sbsc, bytearray(), timeout, max_number_block_length)
+                except NegativeResponseException as e:
+                    if not resumed:
+                        if checkpoint is not None:
+                            save()
+                        raise
+                    logger.info("Can't continue the previous transfer (%s), request the rest" % (e))
+                    resumed = False
+                    sbsc = None
+                    continue
+                except Exception:
+                    # The block may be lost: resuming repeats its request
+                    if checkpoint is not None:
+                        save()
+                    raise
+                resumed = False
+
+                # The block length includes the SID and the block sequence counter
+                if len(record) == 0 or len(record) + 2 > max_number_block_length or done + len(record) > size:
+                    raise Exception("Invalid data length %d" % (len(record)))
+                buffer.write(done, record)
+                done += len(record)
+                sbsc = (sbsc + 1) % 256
+                progress.update(done)
+
+                unsaved += 1
+                if checkpoint is not None and (unsaved >= 64 or time.time() - last_save >= 1.0):
+                    save()
+                    last_save = time.time()
+                    unsaved = 0
+
+            # End of transfer
+            if sbsc is not None:
+                self.send_rte(timeout)
+            buffer.flush()
+            progress.update(done, True)
+            if checkpoint is not None:
+                checkpoint.remove()
+            return buffer.data
+        finally:
+            buffer.close()
+
+    def download(self, addr_tuple, size_tuple, image, progress=None, verify=None, max_repeats=2, timeout=None):
+        """
+        Download size bytes of the image to addr
+
+        The TransferData blocks are cut from the image to the maxNumberOfBlockLength of the ECU.
+        image: the path of a file mapped in memory or a buffer
+        progress: callable(done, size, rate) called at most twice a second
+        verify: None, "read" to read the memory back with ReadMemoryByAddress after the transfer, or a
+        callable(channel, view) returning False if the ECU has not received the image (see checksum_routine)
+        max_repeats: repetitions of a block without reply, the ECU acknowledges the repetition of the last
+        block sequence counter without writing the block again
+        Returns the stats of the transfer, with the rate in bytes/s
+        """
+        addr, addr_s = addr_tuple
+        size, size_s = size_tuple
+        buffer = pyds.transfer.InputBuffer(image, size)
+        progress = pyds.transfer.Progress(progress, size)
+        stats = {'size': size, 'blocks': 0, 'repeats': 0, 'elapsed': 0.0, 'rate': 0.0, 'record': None}
+        start = time.time()
+        try:
+            view = buffer.view
+            progress.update(0, True)
+            max_number_block_length = self.send_rd(addr_tuple, size_tuple, timeout)
+            # The block length includes the SID and the block sequence counter
+            block_length = max_number_block_length - 2
+            if block_length <= 0:
+                raise Exception("Invalid maxNumberOfBlockLength %d" % (max_number_block_length))
+            done = 0
+            sbsc = 1
+            repeats = 0
+            while done < size:
+                length = min(block_length, size - done)
+                try:
+                    self.send_td(sbsc, view[done:done + length], timeout)
+                except NegativeResponseException:
+                    raise
+                except Exception as e:
+                    if repeats >= max_repeats:
+                        raise
+                    logger.debug("No reply for the block %d (%s), repeat it" % (sbsc, e))
+                    repeats += 1
+                    stats['repeats'] += 1
+                    continue
+                repeats = 0
+                done += length
+                sbsc = (sbsc + 1) % 256
+                stats['blocks'] += 1
+                progress.update(done)
+            stats['record'] = self.send_rte(timeout)
+            stats['elapsed'] = time.time() - start
+            stats['rate'] = size / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+            progress.update(done, True)
+
+            if verify == 'read':
+                valid = self._read_back(addr_tuple, size_tuple, view, timeout)
+            elif verify is not None:
+                valid = verify(self, view)
+            else:
+                valid = True
+            if not valid:
+                raise Exception("The verification of the %d bytes at %x has failed" % (size, addr))
+            return stats
+        finally:
+            buffer.close()
+
+    def _read_back(self, addr_tuple, size_tuple, view, timeout, block_length=0x100):
+        addr, addr_s = addr_tuple
+        size, size_s = size_tuple
+        offset = 0
+        while offset < size:
+            length = min(block_length, size - offset)
+            data = self.send_rmba((addr + offset, addr_s), (length, 2), timeout)
+            if data != view[offset:offset + length]:
+                logger.info("Memory differs at %x" % (addr + offset))
+                return False
+            offset += length
+        return True
+
+
+def checksum_routine(rid, checksum=None):
+    """
+    Returns a verification of download which gives the checksum of the image to the routine rid of the ECU
+
+    checksum: callable(view) returning the checksum bytes, the big-endian CRC-32 by default
+    The routine must reply a routineStatusRecord starting with 0 when the memory matches.
+    """
+    if checksum is None:
+        checksum = lambda view: struct.pack(">I", zlib.crc32(view) & 0xFFFFFFFF)
+
+    def verify(channel, view):
+        status = channel.send_rc(RC_START_ROUTINE, rid, bytearray(checksum(view)))
+        return len(status) > 0 and status[0] == 0
+
+    return verify
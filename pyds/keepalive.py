@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import logging
+import threading
+import time
+import weakref
+
+import uds
+
+logger = logging.getLogger(__name__)
+
+
+class Keepalive(object):
+    """
+    Keep the non default sessions of the channels open with suppressed TesterPresent requests
+
+    A channel gets a TesterPresent when it has been idle for interval ms. The requests take the lock of the
+    channel, which is the one of the physical channel for the pooled channels (see pyds.pyds.ChannelPool):
+    a channel is skipped while any channel of the same physical channel is busy, the session being kept
+    open by its own traffic or retried at the next tick.
+    """
+
+    def __init__(self, interval=2000, timeout=100):
+        self._interval = interval
+        self._timeout = timeout
+        self._channels = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._event = threading.Event()
+        self._stats = dict([(x, 0) for x in ['sent', 'errors', 'busy', 'sessions']])
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len([x for x in self._channels.values() if x])
+            return stats
+
+    def add(self, channel):
+        # Proxies are resolved to the channel itself
+        channel = getattr(channel, '__subject__', channel)
+        with self._lock:
+            self._channels.setdefault(channel, False)
+
+    def remove(self, channel):
+        channel = getattr(channel, '__subject__', channel)
+        with self._lock:
+            self._channels.pop(channel, None)
+
+    def tick(self):
+        """
+        Send the due TesterPresent requests
+        """
+        with self._lock:
+            channels = list(self._channels.keys())
+        for channel in channels:
+            state = channel.session_state
+            session = state.session
+            if session is None or session == uds.UDS_DSC_TYPES_DEFAULT_SESSION:
+                self._set_alive(channel, False)
+                continue
+            if (time.time() - state.last_activity) * 1000 < self._interval:
+                continue
+            if not channel.lock.acquire(False):
+                with self._lock:
+                    self._stats['busy'] += 1
+                continue
+            try:
+                channel.send_tp(True, self._timeout)
+                with self._lock:
+                    self._stats['sent'] += 1
+                self._set_alive(channel, True)
+            except Exception as e:
+                logger.warning("TesterPresent failed: %s" % (e))
+                with self._lock:
+                    self._stats['errors'] += 1
+                self._set_alive(channel, False)
+            finally:
+                channel.lock.release()
+
+    def _set_alive(self, channel, alive):
+        with self._lock:
+            if channel not in self._channels:
+                return
+            if alive and not self._channels[channel]:
+                self._stats['sessions'] += 1
+            self._channels[channel] = alive
+
+    def _run(self):
+        while not self._event.wait(self._interval / 4000.0):
+            self.tick()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._event.clear()
+        self._thread = threading.Thread(target=self._run, name="keepalive")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._event.set()
+        self._thread.join()
+        self._thread = None
@@ -31,12 +31,19 @@ except NameError:
 import logging
 import time
 import gc
+import threading
+import weakref
+
+from collections import OrderedDict
 
 import j2534
 import uds
 
 import pyds.secalgo
+import pyds.sectable
 import pyds.extuds
+import pyds.dump
+import pyds.keepalive
 import pyds.types
 
 try:
@@ -48,7 +55,7 @@ from enum import Enum
 from cmd2 import Cmd
 
 from pyds.structs import CanBus, SecurityType
-from pyds.data import Vehicles, Mazda3_2015, vehicles_data
+from pyds.data import Vehicles, Mazda3_2015, vehicles_data, rbcm_dids, ic_dids
 from pyds.actions import unlock_rbcm_features, unlock_ic_features
 
 logger = logging.getLogger(__name__)
@@ -67,26 +74,50 @@ class Modes(Enum):
         return self.name
 
 
-def get_uds_channel(device, bus, mode, speed, tester, ecu):
+def get_channel_protocol(bus, mode):
     if bus == CanBus.MS:
-        m = j2534.ISO15765_PS if mode == Modes.normal else j2534.ISO15765
-        channel = device.connect(m, j2534.CAN_ID_BOTH, speed)
-        if mode == Modes.normal:
-            channel.setJ1962Pins(0x030B)
-    else:
-        if mode != Modes.normal:
-            raise Exception("You can't use standard CAN bus with in the hack mode")
-        channel = device.connect(j2534.ISO15765, j2534.CAN_ID_BOTH, speed)
+        return j2534.ISO15765_PS if mode == Modes.normal else j2534.ISO15765
+    if mode != Modes.normal:
+        raise Exception("You can't use standard CAN bus with in the hack mode")
+    return j2534.ISO15765
+
+
+def connect_channel(device, bus, mode, speed):
+    channel = device.connect(get_channel_protocol(bus, mode), j2534.CAN_ID_BOTH, speed)
+    if bus == CanBus.MS and mode == Modes.normal:
+        channel.setJ1962Pins(0x030B)
+    return channel
+
+
+def get_uds_channel(device, bus, mode, speed, tester, ecu):
+    channel = connect_channel(device, bus, mode, speed)
     uds_j2534 = uds.UDS_J2534(channel, tester, ecu, j2534.ISO15765, j2534.ISO15765_FRAME_PAD)
     channel = pyds.extuds.ExtendedUDS(uds_j2534, False)
     return channel
 
 
+class ModuleStates(object):
+    """
+    States of the modules shared by their channels, indexed by (vehicle, module)
+    """
+
+    def __init__(self):
+        # RDBI batch sizes accepted by the modules
+        self.rdbi_batch_sizes = {}
+        # Session states of the modules
+        self.session_states = {}
+        # Timings of the modules
+        self.timings = {}
+
+
 class ModuleExtendedUDS(ObjectWrapper):
-    def __init__(self, ob, vehicle, module):
+    def __init__(self, ob, vehicle, module, states=None):
         super(ModuleExtendedUDS, self).__init__(ob)
         self._vehicle = vehicle
         self._module = module
+        self._states = states if states is not None else ModuleStates()
+        self.session_state = self._states.session_states.setdefault((vehicle, module), ob.session_state)
+        self.timing = self._states.timings.setdefault((vehicle, module), ob.timing)
 
     @property
     def vehicle(self):
@@ -96,6 +127,24 @@ class ModuleExtendedUDS(ObjectWrapper):
     def module(self):
         return self._module
 
+    def send_rdbi(self, did, timeout=None, copy=True, length=None):
+        if length is None:
+            schema = vehicles_data[self._vehicle].modules[self._module].dids.get(did)
+            length = schema.length if schema is not None else None
+        return self.__subject__.send_rdbi(did, timeout, copy, length)
+
+    def send_rdbi_multi(self, dids, lengths=None, timeout=None, copy=True):
+        if lengths is None:
+            md = vehicles_data[self._vehicle].modules[self._module]
+            lengths = dict([(did, schema.length) for did, schema in md.dids.items()])
+        key = (self._vehicle, self._module)
+        channel = self.__subject__
+        channel.rdbi_batch_size = self._states.rdbi_batch_sizes.get(key)
+        try:
+            return channel.send_rdbi_multi(dids, lengths, timeout, copy)
+        finally:
+            self._states.rdbi_batch_sizes[key] = channel.rdbi_batch_size
+
 
 def get_module_channel(device, mode, vehicle, module):
     vd = vehicles_data[vehicle]
@@ -107,9 +156,132 @@ def get_module_channel(device, mode, vehicle, module):
     return ModuleExtendedUDS(channel, vehicle, module)
 
 
-def change_session(channel, conf=None):
+class PooledUDS(ObjectWrapper):
+    """
+    Reference to a UDS channel of a ChannelPool, keeping its physical channel connected while alive
+    """
+
+
+class ChannelPool(object):
+    """
+    Reuse the J2534 channels across the modules
+
+    The physical channels are indexed by (bus, protocol, speed, mode) and keep the UDS channels of their last
+    max_filters (tester, ecu) pairs, the flow control filter of a pair being released with its UDS channel.
+    The UDS channels of a physical channel share its lock, so that their exchanges, the TesterPresent
+    requests included, never interleave.
+    The physical channels unused for idle_timeout seconds are disconnected, once the channels returned for
+    them are no longer referenced.
+    The module channels share the states of the pool (see ModuleStates).
+    """
+
+    def __init__(self, device, max_filters=1, idle_timeout=60.0, states=None):
+        self._device = device
+        self._states = states if states is not None else ModuleStates()
+        self._max_filters = max_filters
+        self._idle_timeout = idle_timeout
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._stats = dict([(x, 0) for x in ['hits', 'misses', 'filter_hits', 'filter_misses', 'evictions',
+                                             'disconnections']])
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def states(self):
+        return self._states
+
+    @property
+    def max_filters(self):
+        return self._max_filters
+
+    @max_filters.setter
+    def max_filters(self, value):
+        # The filters above the new limit are released by the next request of their channel
+        self._max_filters = value
+
+    def __len__(self):
+        return len(self._channels)
+
+    def get_uds_channel(self, bus, mode, speed, tester, ecu, wrapper=PooledUDS):
+        """
+        Get a UDS channel of the pool, wrapped by wrapper: the physical channel stays connected while one of the
+        wrappers returned for it is referenced
+        """
+        now = time.time()
+        with self._lock:
+            self._close_idle(now)
+            key = (bus, get_channel_protocol(bus, mode), speed, mode)
+            entry = self._channels.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                entry = [connect_channel(self._device, bus, mode, speed), OrderedDict(), now, threading.RLock(),
+                         weakref.WeakSet()]
+                self._channels[key] = entry
+            else:
+                self._stats['hits'] += 1
+            channel, filters, last_use, lock, users = entry
+            entry[2] = now
+
+            uds_channel = filters.pop((tester, ecu), None)
+            # Release the oldest filters before setting the new one
+            while len(filters) >= self._max_filters:
+                filters.popitem(last=False)
+                self._stats['evictions'] += 1
+            if uds_channel is None:
+                self._stats['filter_misses'] += 1
+                uds_j2534 = uds.UDS_J2534(channel, tester, ecu, j2534.ISO15765, j2534.ISO15765_FRAME_PAD)
+                uds_channel = pyds.extuds.ExtendedUDS(uds_j2534, False, lock=lock)
+            else:
+                self._stats['filter_hits'] += 1
+            filters[(tester, ecu)] = uds_channel
+            user = wrapper(uds_channel)
+            users.add(user)
+            return user
+
+    def get_module_channel(self, mode, vehicle, module):
+        vd = vehicles_data[vehicle]
+        md = vd.modules[module]
+        bus = md.bus
+        speed = vd.buses[bus]
+        addr = module.value
+        return self.get_uds_channel(bus, mode, speed, addr + 8, addr,
+                                    lambda channel: ModuleExtendedUDS(channel, vehicle, module, self._states))
+
+    def _disconnect(self, key):
+        channel, filters, last_use, lock, users = self._channels.pop(key)
+        filters.clear()
+        try:
+            channel.disconnect()
+        except Exception as e:
+            logger.warning("Can't disconnect the channel %s: %s" % (key, e))
+        else:
+            self._stats['disconnections'] += 1
+
+    def _close_idle(self, now):
+        if self._idle_timeout is None:
+            return
+        for key, (channel, filters, last_use, lock, users) in list(self._channels.items()):
+            if now - last_use > self._idle_timeout and len(users) == 0:
+                self._disconnect(key)
+
+    def close_idle(self):
+        with self._lock:
+            self._close_idle(time.time())
+
+    def close(self):
+        with self._lock:
+            for key in list(self._channels.keys()):
+                self._disconnect(key)
+
+
+def change_session(channel, conf=None, tables=None):
     vd = vehicles_data[channel.vehicle]
     md = vd.modules[channel.module]
+    state = channel.session_state
     if conf:
         security = md.security
         algo = security.algorithm
@@ -119,28 +291,48 @@ def change_session(channel, conf=None):
         key = conf.key
 
         # DSC
-        channel.send_dsc(session)
+        if state.session != session:
+            channel.send_dsc(session)
+        else:
+            logger.debug("Session %x already active" % (session))
 
         # SA
-        if level:
+        if level and state.level != level:
             seed = channel.send_sa(level, bytearray())
-            key = pyds.secalgo.get_security_algorithm(algo, key).compute(seed)
+            key = pyds.sectable.get_security_algorithm(algo, key, tables).compute(seed)
             channel.send_sa(level + 1, key)
-    else:
+        elif level:
+            logger.debug("Security level %x already unlocked" % (level))
+    elif state.session != uds.UDS_DSC_TYPES_DEFAULT_SESSION:
         channel.send_dsc(uds.UDS_DSC_TYPES_DEFAULT_SESSION)
     return channel
 
 
+def write_changes(channel, data):
+    for did, diddata in data.items():
+        changes = diddata.diff()
+        if not changes:
+            continue
+        for offset, old, new in changes:
+            logger.info("DID %04x byte %d: %s -> %s" % (did, offset, " ".join(['%02x' % (k) for k in old]),
+                                                        " ".join(['%02x' % (k) for k in new])))
+        channel.send_wdbi(did, diddata.to_bytearray(), 500)
+        diddata.clean()
+
+
 #
 # Actions
 #
 
 class PydsApp(Cmd):
 
-    def __init__(self, device, mode):
+    def __init__(self, device, mode, tables=None):
         Cmd.__init__(self)
         self._device = device
         self._mode = mode
+        self._tables = tables
+        self._pool = ChannelPool(device)
+        self._keepalive = pyds.keepalive.Keepalive()
 
     # Disable optparse from original code
     def cmdloop(self, intro=None):
@@ -160,8 +352,19 @@ class PydsApp(Cmd):
         # Run the postloop() no matter what
         self.postloop()
 
+    def postloop(self):
+        self._keepalive.stop()
+        self._pool.close()
+        pyds.sectable.close_tables()
+
     def get_module_channel(self, vehicle, module):
-        return get_module_channel(self._device, self._mode, vehicle, module)
+        channel = self._pool.get_module_channel(self._mode, vehicle, module)
+        self._keepalive.add(channel)
+        self._keepalive.start()
+        return channel
+
+    def change_session(self, channel, conf=None):
+        return change_session(channel, conf, self._tables)
 
     def do_listen(self, args, vehicle, bus):
         vd = vehicles_data[vehicle]
@@ -181,26 +384,53 @@ class PydsApp(Cmd):
             read = channel.readMsgs(vector, 2000)
             print('Read %d messages' % (read))
 
+    def do_pool(self, args):
+        stats = self._pool.stats
+        print("Channels: %d" % (len(self._pool)))
+        for name in sorted(stats.keys()):
+            print("%s: %d" % (name, stats[name]))
+
+    def do_keepalive(self, args):
+        stats = self._keepalive.stats
+        for name in sorted(stats.keys()):
+            print("%s: %d" % (name, stats[name]))
+
+    def do_timing(self, args):
+        timings = self._pool.states.timings
+        for (vehicle, module), timing in sorted(timings.items(), key=lambda x: x[0][1].name):
+            print("%s: P2 %dms, P2* %dms, timeout %dms" % (module.name, timing.p2, timing.p2_star, timing.timeout))
+            for bound, count in timing.histogram():
+                print("  <= %5dms: %d" % (bound, count))
+
+    def do_retries(self, args):
+        counters = pyds.extuds.default_retry_policy.counters
+        for nrc in sorted(counters.keys()):
+            counter = counters[nrc]
+            print("NRC %02x: %d responses, %d retries, %d failures, %.1fs waited" %
+                  (nrc, counter['count'], counter['retries'], counter['failures'], counter['wait']))
+
     def do_info(self, args):
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
 
-        rbcm_de00_data = channel.send_rdbi(0xde00, 2000)
+        data = channel.send_rdbi_multi([0xde00, 0xde01, 0xdd01])
+        rbcm_de00_data = data[0xde00]
         print("RBCM 0xDE00 data(As-Built Data): %s" % (" ".join(['%02x' % (k) for k in rbcm_de00_data])))
-        rbcm_de01_data = channel.send_rdbi(0xde01, 2000)
+        rbcm_de01_data = data[0xde01]
         print("RBCM 0xDE01 data(Configuration): %s" % (" ".join(['%02x' % (k) for k in rbcm_de01_data])))
-        rbcm_dd01_data = channel.send_rdbi(0xdd01, 2000)
+        rbcm_dd01_data = data[0xdd01]
         print("RBCM 0xDD01 data(Millage): %s" % (" ".join(['%02x' % (k) for k in rbcm_dd01_data])))
 
         del channel
 
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.IC)
-        ic_de00_data = channel.send_rdbi(0xde00, 2000)
+        data = channel.send_rdbi_multi([0xde00, 0xde01, 0xde02, 0xf106])
+        ic_de00_data = data[0xde00]
         print("IC 0xDE00 ?: %s" % (" ".join(['%02x' % (k) for k in ic_de00_data])))
-        ic_de01_data = channel.send_rdbi(0xde01, 2000)
+        ic_de01_data = data[0xde01]
         print("IC 0xDE01 ?: %s" % (" ".join(['%02x' % (k) for k in ic_de01_data])))
-        ic_de02_data = channel.send_rdbi(0xde02, 2000)
+        ic_de02_data = data[0xde02]
         print("IC 0xDE02 ?: %s" % (" ".join(['%02x' % (k) for k in ic_de02_data])))
-        ic_f106_data = channel.send_rdbi(0xf106, 2000)
+        ic_f106_data = data[0xf106]
         print("IC 0xF106 ?: %s" % (" ".join(['%02x' % (k) for k in ic_f106_data])))
 
         del channel
@@ -209,56 +439,55 @@ class PydsApp(Cmd):
             return x.decode('utf-8').rstrip('\0')
 
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.PCM)
-        pcm_f188_data = channel.send_rdbi(0xf188, 2000)
+        pcm_f188_data = channel.send_rdbi(0xf188)
         print("PCM 0xF188 ?: %s" % (to_string(pcm_f188_data)))
-        pcm_f190_data = channel.send_rdbi(0xf190, 2000)
+        pcm_f190_data = channel.send_rdbi(0xf190)
         print("PCM 0xF190 VIN: %s" % (to_string(pcm_f190_data)))
-        pcm_f111_data = channel.send_rdbi(0xf111, 2000)
+        pcm_f111_data = channel.send_rdbi(0xf111)
         print("PCM 0xF111 ?: %s" % (to_string(pcm_f111_data)))
-        pcm_f112_data = channel.send_rdbi(0xf113, 2000)
+        pcm_f112_data = channel.send_rdbi(0xf113)
         print("PCM 0xF112 ?: %s" % (to_string(pcm_f112_data)))
-        pcm_f113_data = channel.send_rdbi(0xf113, 2000)
+        pcm_f113_data = channel.send_rdbi(0xf113)
         print("PCM 0xF113 ?: %s" % (to_string(pcm_f113_data)))
-        pcm_de00_data = channel.send_rdbi(0xde00, 2000)
+        pcm_de00_data = channel.send_rdbi(0xde00)
         print("PCM 0xDE00 ?: %s" % (" ".join(['%02x' % (k) for k in pcm_de00_data])))
-        pcm_de01_data = channel.send_rdbi(0xde01, 2000)
+        pcm_de01_data = channel.send_rdbi(0xde01)
         print("PCM 0xDE01 ?: %s" % (" ".join(['%02x' % (k) for k in pcm_de01_data])))
 
+    def do_scan(self, args):
+        from pyds.scan import run_scan, IDENTIFICATION_DIDS
+
+        vehicle = Vehicles.Mazda3_2015
+        requests = [(module, did) for module in vehicles_data[vehicle].modules for did in IDENTIFICATION_DIDS]
+        start = time.time()
+        run_scan(self._pool, self._mode, vehicle, requests, print)
+        print("Scan done in %.1fs" % (time.time() - start))
+
     def do_unlock(self, args):
         def rbcm():
             channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
 
-            data = {
-                0xde00: pyds.types.Normal(channel.send_rdbi(0xde00, 2000)),
-                0xde01: pyds.types.MCP_BCE_2(channel.send_rdbi(0xde01, 2000))
-            }
+            data = channel.send_rdbi_multi([0xde00, 0xde01])
+            data = dict([(did, rbcm_dids[did].create(record)) for did, record in data.items()])
 
-            channel = change_session(channel, SecurityType.Config)
+            channel = self.change_session(channel, SecurityType.Config)
 
             modified_data = unlock_rbcm_features(data)
 
-            for did, diddata in modified_data.items():
-                byte_array = diddata.to_bytearray()
-                if data[did].to_bytearray() != byte_array:
-                    channel.send_wdbi(did, byte_array, 500)
+            write_changes(channel, modified_data)
 
             channel.reset(uds.UDS_ER_TYPES_HARD_RESET)
 
         def ic():
             channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.IC)
 
-            data = {
-                0xf106: pyds.types.Normal(channel.send_rdbi(0xf106, 2000)),
-            }
+            data = dict([(did, ic_dids[did].create(channel.send_rdbi(did))) for did in [0xf106]])
 
-            channel = change_session(channel, SecurityType.Config)
+            channel = self.change_session(channel, SecurityType.Config)
 
             modified_data = unlock_ic_features(data)
 
-            for did, diddata in modified_data.items():
-                byte_array = diddata.to_bytearray()
-                if data[did].to_bytearray() != byte_array:
-                    channel.send_wdbi(did, byte_array, 500)
+            write_changes(channel, modified_data)
 
             channel.reset(uds.UDS_ER_TYPES_HARD_RESET)
 
@@ -269,74 +498,40 @@ class PydsApp(Cmd):
 
     def do_scbs(self, args):
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.PSM)
-        channel = change_session(channel, SecurityType.SelfTest)
+        channel = self.change_session(channel, SecurityType.SelfTest)
 
         def to_string(x):
             return x.decode('utf-8').rstrip('\0')
 
-        pcm_f188_data = channel.send_rdbi(0xf188, 2000)
+        pcm_f188_data = channel.send_rdbi(0xf188)
         print("PSM 0xF188 ?: %s" % (to_string(pcm_f188_data)))
-        pcm_f190_data = channel.send_rdbi(0xf190, 2000)
+        pcm_f190_data = channel.send_rdbi(0xf190)
         print("PSM 0xF190 VIN: %s" % (to_string(pcm_f190_data)))
-        pcm_f111_data = channel.send_rdbi(0xf111, 2000)
+        pcm_f111_data = channel.send_rdbi(0xf111)
         print("PSM 0xF111 ?: %s" % (to_string(pcm_f111_data)))
-        pcm_f112_data = channel.send_rdbi(0xf113, 2000)
+        pcm_f112_data = channel.send_rdbi(0xf113)
         print("PSM 0xF112 ?: %s" % (to_string(pcm_f112_data)))
-        pcm_f113_data = channel.send_rdbi(0xf113, 2000)
+        pcm_f113_data = channel.send_rdbi(0xf113)
         print("PSM 0xF113 ?: %s" % (to_string(pcm_f113_data)))
 
-        data = {
-            0xda70: pyds.types.Normal(channel.send_rdbi(0xda70, 2000)),
-            0xda72: pyds.types.Normal(channel.send_rdbi(0xda72, 2000)),
-            0xda73: pyds.types.Normal(channel.send_rdbi(0xda73, 2000)),
-            0xda74: pyds.types.Normal(channel.send_rdbi(0xda74, 2000)),
-            0xda75: pyds.types.Normal(channel.send_rdbi(0xda75, 2000)),
-            0xda76: pyds.types.Normal(channel.send_rdbi(0xda76, 2000)),
-            0xda77: pyds.types.Normal(channel.send_rdbi(0xda77, 2000)),
-            0xda78: pyds.types.Normal(channel.send_rdbi(0xda78, 2000)),
-            0xda79: pyds.types.Normal(channel.send_rdbi(0xda79, 2000)),
-            0xda7d: pyds.types.Normal(channel.send_rdbi(0xda7d, 2000)),
-            0xda84: pyds.types.Normal(channel.send_rdbi(0xda84, 2000)),
-        }
+        dids = vehicles_data[channel.vehicle].modules[channel.module].dids
+        data = channel.send_rdbi_multi(list(dids.keys()))
+        data = dict([(did, dids[did].decode(record)) for did, record in data.items()])
 
-        print("Front Left Corner Sensor: %d" % (data[0xda76].get_value(0, 255)))
-        print("Front Right Corner Sensor: %d" % (data[0xda77].get_value(0, 255)))
-        print("Front Left Sensor: %d" % (data[0xda78].get_value(0, 255)))
-        print("Front Right Sensor: %d" % (data[0xda79].get_value(0, 255)))
-
-        print("Rear Left Corner Sensor: %d" % (data[0xda72].get_value(0, 255)))
-        print("Rear Right Corner Sensor: %d" % (data[0xda73].get_value(0, 255)))
-        print("Rear Left Sensor: %d" % (data[0xda74].get_value(0, 255)))
-        print("Rear Right Sensor: %d" % (data[0xda75].get_value(0, 255)))
-
-        print("Rear Buzzer Output status: %d" % (data[0xda84].get_value(0, 7)))
-        print("Front Buzzer Output status: %d" % (data[0xda84].get_value(3, 7)))
-        print("PSM Off Switch: %d" % (data[0xda84].get_value(7, 1)))
-
-        print("Rear SCBS Control is Prohibited by DTC: %d" % (data[0xda70].get_value(0, 1)))
-        print("Rear SCBS Control is Prohibited by Towbar Connection: %d" % (data[0xda70].get_value(2, 1)))
-        print("Rear SCBS Control is Prohibited by Trailer Connection: %d" % (data[0xda70].get_value(3, 1)))
-        print("Rear SCBS Control is Prohibited by Factory Mode: %d" % (data[0xda70].get_value(4, 1)))
-        print("Rear SCBS Control is Prohibited by SCBS Switch OFF: %d" % (data[0xda70].get_value(5, 1)))
-        print("Rear SCBS Control is Prohibited by PCM fault: %d" % (data[0xda70].get_value(6, 1)))
-        print("Rear SCBS Control is Prohibited by SCBS fault: %d" % (data[0xda70].get_value(7, 1)))
-        print("Rear SCBS Control is Prohibited by Battery Voltage: %d" % (data[0xda70].get_value(12, 1)))
-        print("Rear SCBS Control is Prohibited by Steering Angle: %d" % (data[0xda70].get_value(13, 1)))
-        print("Rear SCBS Control is Prohibited by Slope: %d" % (data[0xda70].get_value(14, 1)))
-        print("Rear SCBS Control is Prohibited by Ambient Air Temperature: %d" % (data[0xda70].get_value(15, 1)))
+        for did in [0xda76, 0xda77, 0xda78, 0xda79, 0xda72, 0xda73, 0xda74, 0xda75, 0xda84, 0xda70, 0xda7d]:
+            for field in dids[did].fields:
+                print("%s: %d" % (field.description, data[did][field.name]))
         #data[0xda70].get_value(14, 1)  # Rear SCBS Control is Prohibited Wheelspin !!
 
-        print("Reverse Lamp: %d" % (data[0xda7d].get_value(7, 1)))
-
     def do_test(self, args):
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
 
         data = {
-            0xde00: pyds.types.Normal(channel.send_rdbi(0xde00, 2000)),
-            0xde01: pyds.types.MCP_BCE_2(channel.send_rdbi(0xde01, 2000))
+            0xde00: pyds.types.Normal(channel.send_rdbi(0xde00)),
+            0xde01: pyds.types.MCP_BCE_2(channel.send_rdbi(0xde01))
         }
 
-        channel = change_session(channel, SecurityType.Config)
+        channel = self.change_session(channel, SecurityType.Config)
 
         # channel.send_wdbi(0xde00, bytearray([0x45, 0x50, 0x00, 0x06, 0xA1, 0xA5, 0x0C, 0x43, 0x00, 0x08, 0x00, 0x38, 0x92, 0x10]), 500)
 
@@ -344,7 +539,7 @@ class PydsApp(Cmd):
 
     def do_play(self, args):
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
-        channel = change_session(channel, SecurityType.IOControl)
+        channel = self.change_session(channel, SecurityType.IOControl)
 
         print("Will lock the doors")
         input("Press Enter to continue...")
@@ -362,7 +557,7 @@ class PydsApp(Cmd):
         channel.send_iocbi(0xda70, uds.UDS_IOCBI_PARAMETERS_SHORT_TERM_ADJUSTMENT, da70_mod_data)
         channel.send_iocbi(0xda70, uds.UDS_IOCBI_PARAMETERS_RETURN_CONTROL_TO_ECU, bytearray([]))
 
-        channel = change_session(channel, SecurityType.Config)
+        channel = self.change_session(channel, SecurityType.Config)
 
     def do_dump(self, args):
         address = 0xFFF88800
@@ -371,33 +566,27 @@ class PydsApp(Cmd):
 
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.PCM)
 
-        channel.reset(uds.UDS_ER_TYPES_HARD_RESET)
+        path = args.strip()
+        if not path:
+            channel.reset(uds.UDS_ER_TYPES_HARD_RESET)
+            return
 
-        """
-        channel = change_session(channel, SecurityType.IOControl)
-
-        caddr = address
-        rsize = size
-        retry = 0
-        max_retry = 4
-        with open("c:\\temp\\dump.bin", 'wb+') as file:
-            while rsize > 0:
-                try:
-                    data = channel.send_rmba((caddr, 4), (block_size, 2), 10000)
-                    print("Read %d bytes from %x" % (len(data), caddr))
-                    caddr += len(data)
-                    file.write(data)
-                    retry = 0
-                except:
-                    time.sleep(2.0)
-                    retry += 1
-                    if retry >= max_retry:
-                        raise
+        # Resumable dump with ReadMemoryByAddress
+        channel = self.change_session(channel, SecurityType.IOControl)
+
+        def progress(done, total, rate):
+            print("Read %d/%d bytes (%.1f KiB/s)" % (done, total, rate / 1024))
+
+        dump = pyds.dump.MemoryDump(channel, address, size, path, journal=path + ".journal", block_size=block_size,
+                                    progress=progress)
+        dump.run()
+        stats = dump.stats
+        print("%d bytes read, %d unreadable bytes, %d requests in %.1f s (%.1f KiB/s)" %
+              (stats['read'], stats['bad'], stats['requests'], stats['elapsed'], stats['rate'] / 1024))
 
-        """
         """
         channel = self.get_module_channel(Vehicles.Mazda3_2015, Mazda3_2015.PCM)
-        channel = change_session(channel, SecurityType.IOControl)
+        channel = self.change_session(channel, SecurityType.IOControl)
 
         # CDTCS Off
         channel.send_cdtcs(uds.UDS_CDTCS_ACTIONS_OFF)
@@ -406,13 +595,11 @@ class PydsApp(Cmd):
         channel.send_cc(uds.UDS_CC_TYPES_DISABLE_RX_AND_TX, 0x1)
 
         # DSC
-        channel = change_session(channel, SecurityType.Reprog)
+        channel = self.change_session(channel, SecurityType.Reprog)
 
-        data = channel.upload((address, 4), (size, 4))
-        with open("c:\\temp\\dump.bin", 'wb') as file:
-            file.write(data)
+        channel.upload((address, 4), (size, 4), "c:\\temp\\dump.bin", checkpoint="c:\\temp\\dump.json")
 
-        channel = change_session(channel, SecurityType.IOControl)
+        channel = self.change_session(channel, SecurityType.IOControl)
 
         # DSC
         channel.send_dsc(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
@@ -423,5 +610,5 @@ class PydsApp(Cmd):
         # Enable Rx and TX
         channel.send_cc(uds.UDS_CC_TYPES_ENABLE_RX_AND_TX, 0x1)
 
-        channel = change_session(channel)
+        channel = self.change_session(channel)
         """
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+#
+# Whole vehicle scan (Python 3.6+)
+#
+# The buses are read concurrently: each bus has its own executor and its modules are read one at a time, as
+# they share the lock of the physical channel. The results are yielded as soon as they arrive, so the
+# duration of a scan is close to the one of the slowest bus instead of the sum of all the modules.
+#
+
+import asyncio
+import logging
+
+from pyds.asyncuds import ChannelExecutors, get_module_channel
+from pyds.extuds import NegativeResponseException
+from pyds.data import vehicles_data
+
+logger = logging.getLogger(__name__)
+
+# Identification DIDs of ISO 14229
+IDENTIFICATION_DIDS = [0xf188, 0xf190, 0xf111, 0xf113]
+
+
+class ScanResult(object):
+    def __init__(self, module, did, data=None, error=None):
+        super(ScanResult, self).__init__()
+        self._module = module
+        self._did = did
+        self._data = data
+        self._error = error
+
+    @property
+    def module(self):
+        return self._module
+
+    @property
+    def did(self):
+        return self._did
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def error(self):
+        return self._error
+
+    def __str__(self):
+        if self._error is not None:
+            return "%s 0x%04X: %s" % (self._module.name, self._did, self._error)
+        return "%s 0x%04X: %s" % (self._module.name, self._did, " ".join(['%02x' % (k) for k in self._data]))
+
+
+async def scan(pool, mode, vehicle, requests, timeout=None, deadline=None):
+    """
+    Read (module, DID) requests over all the buses of the vehicle
+
+    The channels are borrowed from pool (see pyds.pyds.ChannelPool): a J2534 device only accepts one
+    channel per protocol, the ones already opened by the shell are reused.
+    Asynchronous generator of ScanResult in order of arrival. The DIDs of a module are read with
+    send_rdbi_multi, each DID is read alone if one of them is rejected. After any other error, a timeout
+    for instance, the module is skipped.
+    """
+    vd = vehicles_data[vehicle]
+    modules = {}
+    for module, did in requests:
+        modules.setdefault(module, []).append(did)
+    count = sum([len(dids) for dids in modules.values()])
+
+    queue = asyncio.Queue()
+    semaphores = dict([(bus, asyncio.Semaphore(1)) for bus in vd.buses])
+    executors = ChannelExecutors()
+
+    async def scan_module(module, dids):
+        async with semaphores[vd.modules[module].bus]:
+            try:
+                channel = await get_module_channel(executors, pool, mode, vehicle, module, deadline)
+            except Exception as e:
+                logger.debug("Can't open %s: %s" % (module.name, e))
+                for did in dids:
+                    queue.put_nowait(ScanResult(module, did, error=e))
+                return
+
+            try:
+                records = await channel.send_rdbi_multi(dids, timeout=timeout)
+            except NegativeResponseException as e:
+                logger.debug("Batched read of %s rejected: %s" % (module.name, e))
+                records = None
+            except Exception as e:
+                # An absent module would cost a timeout per DID
+                logger.debug("Batched read of %s failed, skipped: %s" % (module.name, e))
+                for did in dids:
+                    queue.put_nowait(ScanResult(module, did, error=e))
+                return
+            for did in dids:
+                if records is not None:
+                    queue.put_nowait(ScanResult(module, did, records[did]))
+                    continue
+                try:
+                    queue.put_nowait(ScanResult(module, did, await channel.send_rdbi(did, timeout)))
+                except Exception as e:
+                    queue.put_nowait(ScanResult(module, did, error=e))
+
+    tasks = [asyncio.ensure_future(scan_module(module, dids)) for module, dids in modules.items()]
+    try:
+        for i in range(count):
+            yield await queue.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        executors.shutdown(False)
+
+
+def run_scan(pool, mode, vehicle, requests, callback, timeout=None, deadline=None):
+    """
+    Blocking scan calling callback with each ScanResult
+    """
+
+    async def run():
+        async for result in scan(pool, mode, vehicle, requests, timeout, deadline):
+            callback(result)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
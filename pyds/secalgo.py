@@ -63,15 +63,68 @@ class FordCommon14229Security(object):
                 temp_buffer = temp_buffer | (self.v2 & (buff >> 1))
                 buff = temp_buffer & 0xffffff
 
+        return self._key(buff)
+
+    @staticmethod
+    def _key(buff):
         return bytearray([(buff >> 4 & 0xff), ((buff >> 20) & 0x0f) + ((buff >> 8) & 0xf0),
                           ((buff << 4) & 0xff) + ((buff >> 16) & 0x0f)])
 
 
-def get_security_algorithm(algo, *data):
-    if algo == Algorithm.Ford:
-        return FordCommon14229Security(*data)
-    else:
+def _ford_table(v1):
+    # v2 is the complement of v1, so one step of the register is
+    # buff = (buff >> 1) ^ (polynomial if (b ^ buff) & 1 else 0)
+    # which is a reflected CRC: 8 steps are done with one lookup
+    polynomial = 0x800000 ^ v1
+    table = []
+    for i in range(0, 256):
+        buff = i
+        for j in range(0, 8):
+            buff = (buff >> 1) ^ (polynomial if buff & 0x1 else 0)
+        table.append(buff)
+    return tuple(table)
+
+
+class FordCommon14229SecurityTable(FordCommon14229Security):
+    """
+    Same keys as FordCommon14229Security, computed one challenge byte at a time
+    """
+
+    table = _ford_table(FordCommon14229Security.v1)
+
+    def __init__(self, vehicle_seed):
+        super(FordCommon14229SecurityTable, self).__init__(vehicle_seed)
+        self.vehicle_bytes = bytearray(vehicle_seed[0:5])
+
+    def compute(self, session_seed):
+        assert len(session_seed) == 3
+
+        table = self.table
+        buff = self.initialValue
+        for b in bytearray(session_seed[0:3]):
+            buff = (buff >> 8) ^ table[(buff ^ b) & 0xff]
+        for b in self.vehicle_bytes:
+            buff = (buff >> 8) ^ table[(buff ^ b) & 0xff]
+
+        return self._key(buff)
+
+
+security_algorithms = {
+    Algorithm.Ford: {
+        'reference': FordCommon14229Security,
+        'table': FordCommon14229SecurityTable,
+    },
+}
+
+
+def get_security_algorithm(algo, *data, **kwargs):
+    engine = kwargs.get('engine', 'table')
+    if algo not in security_algorithms:
         raise Exception("Invalid SecurityAlgorithm %s" % (str(algo)))
+    engines = security_algorithms[algo]
+    if engine not in engines:
+        raise Exception("Invalid engine %s for SecurityAlgorithm %s" % (engine, str(algo)))
+    return engines[engine](*data)
 
 
 ####################
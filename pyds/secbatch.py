@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import multiprocessing
+
+import numpy
+
+from pyds.secalgo import FordCommon14229Security, FordCommon14229SecurityTable
+
+_table = numpy.array(FordCommon14229SecurityTable.table, dtype=numpy.uint32)
+
+
+def _compute(session_seeds, vehicle_seeds):
+    shape = session_seeds.shape[:-1]
+    buff = numpy.full(shape, FordCommon14229Security.initialValue, dtype=numpy.uint32)
+
+    # One challenge byte column of the whole batch at a time
+    columns = [session_seeds[..., i] for i in range(3)] + [vehicle_seeds[..., i] for i in range(5)]
+    for column in columns:
+        buff = (buff >> 8) ^ _table[(buff ^ column) & 0xff]
+
+    keys = numpy.empty(shape + (3,), dtype=numpy.uint8)
+    keys[..., 0] = (buff >> 4) & 0xff
+    keys[..., 1] = ((buff >> 20) & 0x0f) + ((buff >> 8) & 0xf0)
+    keys[..., 2] = ((buff << 4) & 0xff) + ((buff >> 16) & 0x0f)
+    return keys
+
+
+def _compute_chunk(args):
+    return _compute(*args)
+
+
+def compute_keys(session_seeds, vehicle_seeds, processes=1, chunk_size=1 << 20):
+    """
+    Computes the Ford keys of many session seeds at once
+
+    session_seeds is an array of shape (..., 3) and vehicle_seeds an array of
+    shape (..., 5) (the 6 bytes of SecurityData.key are accepted too), both
+    are broadcast against each other so one vehicle seed can be used for all
+    the session seeds, or seeds of shape (N, 1, 3) and vehicle seeds of shape
+    (M, 5) give all the N x M keys. Returns an uint8 array of shape (..., 3).
+
+    When processes is greater than 1, batches larger than chunk_size are split
+    along their first axis and computed by a pool of processes.
+    """
+    session_seeds = numpy.asarray(session_seeds, dtype=numpy.uint32)
+    vehicle_seeds = numpy.asarray(vehicle_seeds, dtype=numpy.uint32)
+    if session_seeds.shape[-1:] != (3,):
+        raise ValueError("The session seeds must be arrays of 3 bytes")
+    if vehicle_seeds.shape[-1:] not in [(5,), (6,)]:
+        raise ValueError("The vehicle seeds must be arrays of 5 bytes")
+    vehicle_seeds = vehicle_seeds[..., 0:5]
+
+    shape = numpy.broadcast(session_seeds[..., 0], vehicle_seeds[..., 0]).shape
+    session_seeds = numpy.broadcast_to(session_seeds, shape + (3,))
+    vehicle_seeds = numpy.broadcast_to(vehicle_seeds, shape + (5,))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    size = shape[0] if shape else 1
+    if processes <= 1 or size <= chunk_size:
+        return _compute(session_seeds, vehicle_seeds)
+
+    # Split along the first axis
+    chunks = [(session_seeds[i:i + chunk_size], vehicle_seeds[i:i + chunk_size]) for i in range(0, size, chunk_size)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_compute_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return numpy.concatenate(results)
+
+
+def seeds_from_int(values):
+    """
+    Converts 24-bit integers to session seeds, most significant byte first
+    """
+    values = numpy.asarray(values, dtype=numpy.uint32)
+    seeds = numpy.empty(values.shape + (3,), dtype=numpy.uint32)
+    seeds[..., 0] = (values >> 16) & 0xff
+    seeds[..., 1] = (values >> 8) & 0xff
+    seeds[..., 2] = values & 0xff
+    return seeds
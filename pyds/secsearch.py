@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import sys
+import re
+import argparse
+import time
+
+from pyds.secalgo import FordCommon14229Security, FordCommon14229SecurityTable
+
+#
+# The register of FordCommon14229Security is linear over GF(2), so for a
+# session seed s and a secret v:
+#
+#     buff(s, v) = buff(s, 0) ^ H(v)
+#
+# where H is a linear map from the 40 bits of the secret to the 24 bits of the
+# register, computed from a zero register. Each captured (seed, key) pair then
+# gives H(v) directly and recovering the secret is solving a linear system:
+# H has rank 24, so 2^16 secrets give exactly the same keys for every seed.
+#
+
+SECRET_BITS = 40
+
+
+def _run(data, buff):
+    table = FordCommon14229SecurityTable.table
+    for b in data:
+        buff = (buff >> 8) ^ table[(buff ^ b) & 0xff]
+    return buff
+
+
+def _unpack_key(key):
+    # Inverse of FordCommon14229Security._key
+    key = bytearray(key)
+    return (key[0] << 4) | ((key[2] >> 4) & 0x0f) | ((key[1] & 0xf0) << 8) | ((key[2] & 0x0f) << 16) | \
+           ((key[1] & 0x0f) << 20)
+
+
+def _secret_to_int(secret):
+    value = 0
+    for i, b in enumerate(bytearray(secret[0:5])):
+        value |= b << (i * 8)
+    return value
+
+
+def _int_to_secret(value):
+    return bytearray([(value >> (i * 8)) & 0xff for i in range(5)])
+
+
+def _h(value):
+    return _run(bytearray(3) + _int_to_secret(value), 0)
+
+
+def get_target(pairs):
+    """
+    Returns H(secret) shared by all the captured (session seed, key) pairs
+    """
+    targets = {}
+    for seed, key in pairs:
+        assert len(seed) == 3 and len(key) == 3
+        target = _unpack_key(key) ^ _run(bytearray(seed) + bytearray(5), FordCommon14229Security.initialValue)
+        targets.setdefault(target, []).append((seed, key))
+    if len(targets) != 1:
+        raise Exception("The captured pairs come from %d different secrets" % (len(targets)))
+    return list(targets.keys())[0]
+
+
+def solve(target):
+    """
+    Returns a secret v with H(v) = target and a basis of the kernel of H, as
+    integers where the bit 8 * i + j is the bit j of the byte i of the secret
+    """
+    # Row reduction of the columns of H, keeping track of the combinations
+    pivots = []
+    kernel = []
+    for j in range(SECRET_BITS):
+        column = _h(1 << j)
+        combination = 1 << j
+        for pivot_column, pivot_combination in pivots:
+            if column ^ pivot_column < column:
+                column ^= pivot_column
+                combination ^= pivot_combination
+        if column:
+            pivots.append((column, combination))
+            pivots.sort(reverse=True)
+        else:
+            kernel.append(combination)
+
+    # Express the target with the pivots
+    secret = 0
+    for pivot_column, pivot_combination in pivots:
+        if target ^ pivot_column < target:
+            target ^= pivot_column
+            secret ^= pivot_combination
+    if target:
+        raise Exception("No secret can give these keys")
+    return secret, kernel
+
+
+def _printable(value):
+    for i in range(5):
+        b = (value >> (i * 8)) & 0xff
+        if b < 0x20 or b > 0x7e:
+            return False
+    return True
+
+
+def search(pairs, printable_only=False):
+    """
+    Returns the candidate secrets of the captured pairs, printable ASCII first
+
+    Every candidate gives the same keys as the real secret.
+    """
+    secret, kernel = solve(get_target(pairs))
+
+    # Gray code walk of the solutions
+    printable = []
+    others = []
+    value = secret
+    for i in range(1 << len(kernel)):
+        if i:
+            bit = (i & -i).bit_length() - 1
+            value ^= kernel[bit]
+        if _printable(value):
+            printable.append(value)
+        elif not printable_only:
+            others.append(value)
+    return [_int_to_secret(x) for x in sorted(printable) + sorted(others)]
+
+
+####################
+####################
+####################
+
+def _parse_pair(text):
+    seed, key = text.split(':')
+    seed = bytearray.fromhex(re.sub(r'\s+', '', seed))
+    key = bytearray.fromhex(re.sub(r'\s+', '', key))
+    if len(seed) != 3 or len(key) != 3:
+        raise ValueError("Invalid pair %s, seed and key must be arrays of 3 bytes" % (text))
+    return seed, key
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description="Ford security secret recovery",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-f', '--file', help="file of SEED:KEY lines")
+    parser.add_argument('-a', '--all', action='store_true', help="print the non printable candidates too")
+    parser.add_argument('pairs', nargs='*', help="captured SEED:KEY pairs in hexadecimal")
+    args = parser.parse_args(argv[1:])
+
+    pairs = [_parse_pair(x) for x in args.pairs]
+    if args.file:
+        with open(args.file) as f:
+            pairs.extend([_parse_pair(line) for line in f if line.strip() and not line.startswith('#')])
+    if not pairs:
+        raise ValueError("No captured pair")
+
+    start = time.time()
+    candidates = search(pairs, not args.all)
+    elapsed = time.time() - start
+    print("%d candidates from %d pairs in %.2fs" % (len(candidates), len(pairs), elapsed))
+    for secret in candidates:
+        text = secret.decode('latin-1') if _printable(_secret_to_int(secret)) else ''
+        print("%s %s" % (" ".join(["%02X" % x for x in secret]), text))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import sys
+import os
+import argparse
+import binascii
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+
+import pyds.secalgo
+from pyds.structs import Algorithm
+
+logger = logging.getLogger(__name__)
+
+#
+# Table file: a 64 bytes header followed by the 3 bytes key of each of the
+# 2^24 session seeds, the seed read as a big endian integer being the index
+#
+
+TABLE_MAGIC = b'PYDSKEYS'
+TABLE_VERSION = 1
+TABLE_ENTRIES = 1 << 24
+TABLE_KEY_SIZE = 3
+TABLE_HEADER = struct.Struct('<8sHHII32s12x')
+TABLE_SIZE = TABLE_HEADER.size + TABLE_ENTRIES * TABLE_KEY_SIZE
+
+
+def _secret(vehicle_seed):
+    return bytearray(vehicle_seed[0:5])
+
+
+def secret_hash(vehicle_seed):
+    return hashlib.sha256(bytes(_secret(vehicle_seed))).digest()
+
+
+def get_table_path(directory, algo, vehicle_seed):
+    digest = binascii.hexlify(secret_hash(vehicle_seed)).decode('ascii')
+    return os.path.join(directory, "%s-%s.keys" % (algo.name.lower(), digest[0:16]))
+
+
+class SecurityTable(object):
+    """
+    Security algorithm answering from a memory-mapped precomputed table
+    """
+
+    def __init__(self, path, algo, vehicle_seed):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._check(algo, vehicle_seed)
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def _check(self, algo, vehicle_seed):
+        if len(self._mmap) != TABLE_SIZE:
+            raise Exception("Invalid table size %d" % (len(self._mmap)))
+        magic, version, algorithm, entries, key_size, digest = TABLE_HEADER.unpack(
+            self._mmap[0:TABLE_HEADER.size])
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise Exception("Invalid table header")
+        if algorithm != algo.value or entries != TABLE_ENTRIES or key_size != TABLE_KEY_SIZE:
+            raise Exception("Invalid table for SecurityAlgorithm %s" % (str(algo)))
+        if digest != secret_hash(vehicle_seed):
+            raise Exception("Invalid table secret")
+
+    def compute(self, session_seed):
+        assert len(session_seed) == 3
+
+        s = bytearray(session_seed)
+        offset = TABLE_HEADER.size + ((s[0] << 16) | (s[1] << 8) | s[2]) * TABLE_KEY_SIZE
+        return bytearray(self._mmap[offset:offset + TABLE_KEY_SIZE])
+
+    @property
+    def closed(self):
+        return self._mmap is None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+# Opened tables, indexed by path
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_security_algorithm(algo, vehicle_seed, directory=None):
+    """
+    Uses the table of the secret found in directory, the live computation otherwise
+
+    The tables stay open for the next calls, until close_tables().
+    """
+    if directory is not None:
+        path = get_table_path(directory, algo, vehicle_seed)
+        with _tables_lock:
+            table = _tables.get(path)
+            if table is not None and not table.closed:
+                return table
+            if os.path.exists(path):
+                try:
+                    table = SecurityTable(path, algo, vehicle_seed)
+                    _tables[path] = table
+                    return table
+                except Exception as e:
+                    logger.warning("Ignoring table %s: %s" % (path, e))
+    return pyds.secalgo.get_security_algorithm(algo, vehicle_seed)
+
+
+def close_tables():
+    with _tables_lock:
+        for table in _tables.values():
+            table.close()
+        _tables.clear()
+
+
+#
+# Generation
+#
+
+def _generate_chunk(args):
+    from pyds.secbatch import compute_keys, seeds_from_int
+    import numpy
+
+    path, vehicle_seed, start, count = args
+    keys = compute_keys(seeds_from_int(numpy.arange(start, start + count)), _secret(vehicle_seed))
+    with open(path, 'r+b') as f:
+        f.seek(TABLE_HEADER.size + start * TABLE_KEY_SIZE)
+        f.write(keys.tobytes())
+
+
+def generate_table(path, algo, vehicle_seed, processes=None, chunk_size=1 << 20):
+    if algo != Algorithm.Ford:
+        raise Exception("Invalid SecurityAlgorithm %s" % (str(algo)))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    # The header is written last, an interrupted generation leaves an invalid table
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.truncate(TABLE_SIZE)
+    chunks = [(tmp_path, list(vehicle_seed), start, min(chunk_size, TABLE_ENTRIES - start))
+              for start in range(0, TABLE_ENTRIES, chunk_size)]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            pool.map(_generate_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for chunk in chunks:
+            _generate_chunk(chunk)
+    with open(tmp_path, 'r+b') as f:
+        f.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, algo.value, TABLE_ENTRIES, TABLE_KEY_SIZE,
+                                  secret_hash(vehicle_seed)))
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def get_secrets(vehicles_data):
+    secrets = {}
+    for vehicle, vd in vehicles_data.items():
+        for module, md in vd.modules.items():
+            for conf in md.security.configurations.values():
+                if conf.level:
+                    secrets[(md.security.algorithm, bytes(_secret(conf.key)))] = (md.security.algorithm, conf.key)
+    return list(secrets.values())
+
+
+####################
+####################
+####################
+
+def main(argv):
+    from pyds.data import vehicles_data
+
+    parser = argparse.ArgumentParser(prog=argv[0], description="Security key tables generator")
+    parser.add_argument('-p', '--processes', type=int, help="number of processes")
+    parser.add_argument('directory', help="output directory")
+    args = parser.parse_args(argv[1:])
+
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+    for algo, vehicle_seed in get_secrets(vehicles_data):
+        path = get_table_path(args.directory, algo, vehicle_seed)
+        start = time.time()
+        generate_table(path, algo, vehicle_seed, args.processes)
+        print("%s generated in %.1fs" % (path, time.time() - start))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
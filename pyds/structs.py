@@ -93,10 +93,11 @@ class Vehicle(object):
 
 
 class Module(object):
-    def __init__(self, bus, security):
+    def __init__(self, bus, security, dids=None):
         super(Module, self).__init__()
         self._bus = bus
         self._security = security
+        self._dids = dids if dids is not None else {}
 
     @property
     def bus(self):
@@ -105,3 +106,32 @@ class Module(object):
     @property
     def security(self):
         return self._security
+
+    @property
+    def dids(self):
+        return self._dids
+
+
+class Field(object):
+    def __init__(self, name, offset, mask, description=None):
+        super(Field, self).__init__()
+        self._name = name
+        self._offset = offset
+        self._mask = mask
+        self._description = description if description is not None else name
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @property
+    def description(self):
+        return self._description
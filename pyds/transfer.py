@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function, division, absolute_import
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+#
+# Helpers of the memory transfers: output buffers, progress and checkpoints
+#
+
+import json
+import mmap
+import os
+import sys
+import time
+
+# Python 2 can't make a memoryview of a mmap, the map itself is used as the view, its slices being copies
+_MMAP_VIEW = sys.version_info >= (3,)
+
+
+def _map_view(data):
+    return memoryview(data) if _MMAP_VIEW or not isinstance(data, mmap.mmap) else data
+
+
+def _release_view(view):
+    if isinstance(view, memoryview) and hasattr(view, 'release'):
+        view.release()
+
+
+class OutputBuffer(object):
+    """
+    Preallocated destination of a transfer
+
+    output is None for a new bytearray, the path of a file mapped in memory (created or extended to size,
+    existing content is kept) or a writable buffer of at least size bytes.
+    """
+
+    def __init__(self, output, size):
+        self._file = None
+        self._mmap = None
+        if output is None:
+            self._data = bytearray(size)
+            self._view = memoryview(self._data)
+        elif isinstance(output, (str, type(u''))):
+            self._file = open(output, 'r+b' if os.path.exists(output) else 'w+b')
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < size:
+                self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+            self._data = output
+            self._view = _map_view(self._mmap)
+        else:
+            self._data = output
+            self._view = memoryview(output)
+            if self._view.readonly or len(self._view) < size:
+                raise ValueError("The output must be a writable buffer of %d bytes" % (size))
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def view(self):
+        return self._view
+
+    def write(self, offset, data):
+        if self._view is self._mmap:
+            # The slice assignment of a Python 2 mmap takes a string
+            data = memoryview(data).tobytes()
+        self._view[offset:offset + len(data)] = data
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        if self._mmap is not None:
+            _release_view(self._view)
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+
+class Progress(object):
+    """
+    Throttled progress callback(done, total, rate) where rate is in bytes/s
+    """
+
+    def __init__(self, callback, total, interval=0.5):
+        self._callback = callback
+        self._total = total
+        self._interval = interval
+        self._start = time.time()
+        self._last = None
+        self._base = None
+
+    def rate(self, done):
+        elapsed = time.time() - self._start
+        if self._base is None or elapsed <= 0:
+            return 0.0
+        return (done - self._base) / elapsed
+
+    def update(self, done, force=False):
+        if self._base is None:
+            # Resumed transfers don't count the bytes done before
+            self._base = done
+            self._start = time.time()
+        if self._callback is None:
+            return
+        now = time.time()
+        if not force and self._last is not None and now - self._last < self._interval:
+            return
+        self._last = now
+        self._callback(done, self._total, self.rate(done))
+
+
+class Checkpoint(object):
+    """
+    State of a transfer saved in a JSON file to resume it
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    @property
+    def path(self):
+        return self._path
+
+    def load(self):
+        try:
+            with open(self._path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, **values):
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(values, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, self._path)
+        else:
+            if os.path.exists(self._path):
+                os.remove(self._path)
+            os.rename(tmp_path, self._path)
+
+    def remove(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class Journal(object):
+    """
+    Append-only record of the transferred ranges of a memory area
+
+    The first line identifies the area, the next ones are "offset length status" with status "ok" or "bad".
+    The data of the ranges must be flushed before being appended.
+    """
+
+    def __init__(self, path, address, size):
+        self._path = path
+        self._address = address
+        self._size = size
+        self._header = "pyds %x %x\n" % (address, size)
+
+    @property
+    def path(self):
+        return self._path
+
+    def load(self):
+        """
+        Returns the recorded (offset, length, ok) ranges, none if the journal is for another area
+        """
+        entries = []
+        try:
+            with open(self._path, 'r') as f:
+                if f.readline() != self._header:
+                    return entries
+                for line in f:
+                    fields = line.split()
+                    # Skip a line truncated by an interruption
+                    if len(fields) != 3 or not line.endswith('\n'):
+                        break
+                    entries.append((int(fields[0], 16), int(fields[1], 16), fields[2] == 'ok'))
+        except (IOError, OSError):
+            pass
+        return entries
+
+    def reset(self):
+        with open(self._path, 'w') as f:
+            f.write(self._header)
+
+    def append(self, entries):
+        if not entries:
+            return
+        with open(self._path, 'a') as f:
+            f.write("".join(["%x %x %s\n" % (offset, length, 'ok' if ok else 'bad')
+                             for offset, length, ok in entries]))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def get_missing_ranges(entries, size):
+    """
+    Returns the (start, end) ranges of [0, size) not covered by the (offset, length, ok) entries
+    """
+    ranges = []
+    position = 0
+    for offset, length, ok in sorted(entries):
+        if offset > position:
+            ranges.append((position, offset))
+        position = max(position, offset + length)
+    if position < size:
+        ranges.append((position, size))
+    return ranges
+
+
+class InputBuffer(object):
+    """
+    Read-only view of size bytes of the source of a transfer
+
+    source is the path of a file mapped in memory or a buffer of at least size bytes.
+    """
+
+    def __init__(self, source, size):
+        self._file = None
+        self._mmap = None
+        if isinstance(source, (str, type(u''))):
+            self._file = open(source, 'rb')
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < size:
+                self._file.close()
+                raise ValueError("The source must contain %d bytes" % (size))
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size > 0 else None
+            self._base = _map_view(self._mmap) if self._mmap is not None else memoryview(bytearray())
+        else:
+            self._base = memoryview(source)
+            if len(self._base) < size:
+                raise ValueError("The source must be a buffer of %d bytes" % (size))
+        # The map already has the size
+        self._view = self._base[:size] if isinstance(self._base, memoryview) else self._base
+
+    @property
+    def view(self):
+        return self._view
+
+    def close(self):
+        _release_view(self._view)
+        _release_view(self._base)
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A block is still referenced by a traceback, the map is closed with it
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
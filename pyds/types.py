@@ -24,8 +24,159 @@ __version__ = "0.0.1"
 
 import math
 
+# Fix Python 2.x.
+try:
+    _int_from_bytes = int.from_bytes
+
+    def _int_to_bytes(value, length, byteorder):
+        return value.to_bytes(length, byteorder)
+except AttributeError:
+    import binascii
+
+    def _int_from_bytes(data, byteorder):
+        data = bytearray(data)
+        if byteorder == 'little':
+            data.reverse()
+        if not data:
+            return 0
+        return int(binascii.hexlify(data), 16)
+
+    def _int_to_bytes(value, length, byteorder):
+        data = bytearray(binascii.unhexlify('%0*x' % (length * 2, value)))
+        if byteorder == 'little':
+            data.reverse()
+        return data
+
+
+class BitField(object):
+    """
+    Bit addressable view of a DID payload
+
+    The payload is kept as a single bytearray and each field is extracted or
+    written back with shifts and masks on the few bytes it covers. Subclasses
+    define how a bit offset maps to a byte and a bit inside this byte, their
+    bit list helpers are kept as the reference implementation.
+
+    Read as a single integer of the given byte order, bit i of the payload is
+    the bit i of this integer, or the bit (size - 1 - i) when the fields are
+    stored most significant bit first.
+
+    The payload given at load time is kept as origin and shared with the
+    object until the first write, which makes a private copy. With copy=False
+    the origin is a memoryview of the given buffer and fields are read from it
+    directly. fork() shares the current payload the same way, and the bit
+    ranges written since load are recorded so changed() and diff() only have
+    to look at them.
+    """
+
+    _byteorder = None
+    _msb_first = False
+
+    def __init__(self, bytes, copy=True):
+        if copy:
+            self._data = bytearray(bytes)
+        else:
+            self._data = bytes if isinstance(bytes, memoryview) else memoryview(bytes)
+        self._origin = self._data
+        self._shared = True
+        self._dirty = set()
+
+    def _unshare(self):
+        self._data = bytearray(self._data)
+        self._shared = False
+
+    def _byte_range(self, offset, width):
+        raise NotImplementedError()
+
+    @staticmethod
+    def _width(mask):
+        if mask < 0 or mask & (mask + 1):
+            raise Exception("Invalid mask %x" % (mask))
+        return mask.bit_length()
+
+    def _field(self, offset, mask):
+        # Returns the width of the field and checks that it fits in the payload
+        if mask < 0 or mask & (mask + 1):
+            raise Exception("Invalid mask %x" % (mask))
+        width = mask.bit_length()
+        if offset < 0 or offset + width > len(self._data) << 3:
+            raise Exception("Invalid offset %d (width %d) for %d bits" % (offset, width, len(self._data) << 3))
+        return width
+
+    def to_bytearray(self):
+        return bytearray(self._data)
+
+    @property
+    def shared(self):
+        return self._shared
+
+    def fork(self):
+        # Both objects share the payload until one of them writes it
+        obj = self.__class__.__new__(self.__class__)
+        obj._data = self._data
+        obj._origin = self._origin
+        obj._shared = True
+        obj._dirty = set(self._dirty)
+        self._shared = True
+        return obj
+
+    def modified(self):
+        return sorted(self._dirty)
+
+    def diff(self):
+        # Merge the byte ranges covered by the written fields
+        ranges = []
+        for start, end in sorted([self._byte_range(offset, width) for offset, width in self._dirty]):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+        # Report the runs of bytes which differ from the origin
+        changes = []
+        for start, end in ranges:
+            # The origin may be a memoryview, whose items are str on Python 2
+            origin = bytearray(self._origin[start:end])
+            data = bytearray(self._data[start:end])
+            run = None
+            for i in range(end - start):
+                if data[i] != origin[i]:
+                    if run is None:
+                        run = i
+                elif run is not None:
+                    changes.append((start + run, origin[run:i], data[run:i]))
+                    run = None
+            if run is not None:
+                changes.append((start + run, origin[run:], data[run:]))
+        return changes
+
+    def changed(self):
+        return len(self.diff()) > 0
+
+    def clean(self):
+        # The current payload becomes the new origin
+        self._origin = self._data
+        self._shared = True
+        self._dirty = set()
+
+    def __copy__(self):
+        return self.__class__(self._data)
+
+    def __deepcopy__(self, memo):
+        return self.fork()
+
+    def __len__(self):
+        return len(self._data) * 8
+
+
+class MCP_BCE_2(BitField):
+    """
+    Bit i is the bit 7 - (i % 8) of the byte i / 8
+    """
+
+    _byteorder = 'big'
+    _msb_first = True
 
-class MCP_BCE_2(object):
     @staticmethod
     def _bytearraytobitarray(bytes):
         bits = []
@@ -85,26 +236,40 @@ class MCP_BCE_2(object):
         bit_l = int(bit_l)
         return MCP_BCE_2._bits_to_value(bits[offset:(offset + bit_l)])
 
-    def __init__(self, bytes):
-        self.bits = self._bytearraytobitarray(bytes)
-
-    def to_bytearray(self):
-        return self._bitarraytobytearray(self.bits)
+    def _byte_range(self, offset, width):
+        return offset >> 3, (offset + width + 7) >> 3
 
     def get_value(self, offset, mask):
-        return self._get_value(self.bits, offset, mask)
+        width = self._field(offset, mask)
+        start = offset >> 3
+        end = (offset + width + 7) >> 3
+        chunk = _int_from_bytes(self._data[start:end], 'big')
+        return (chunk >> ((end << 3) - offset - width)) & mask
 
     def set_value(self, offset, mask, value):
-        self._set_value(self.bits, offset, mask, value)
-
-    def __copy__(self):
-        return MCP_BCE_2(self.to_bytearray())
-
-    def __len__(self):
-        return len(self.bits)
+        width = self._field(offset, mask)
+        if self._shared:
+            self._unshare()
+        self._dirty.add((offset, width))
+        start = offset >> 3
+        end = (offset + width + 7) >> 3
+        shift = (end << 3) - offset - width
+        if end - start == 1:
+            self._data[start] = (self._data[start] & ~(mask << shift)) | ((value & mask) << shift)
+            return
+        chunk = _int_from_bytes(self._data[start:end], 'big')
+        chunk = (chunk & ~(mask << shift)) | ((value & mask) << shift)
+        self._data[start:end] = _int_to_bytes(chunk, end - start, 'big')
+
+
+class Read(BitField):
+    """
+    Bit i is the bit i % 8 of the byte i / 8, counted from the last byte
+    """
+
+    _byteorder = 'big'
+    _msb_first = False
 
-
-class Read(object):
     @staticmethod
     def _bytearraytobitarray(bytes):
         bits = []
@@ -166,26 +331,43 @@ class Read(object):
         bit_l = int(bit_l)
         return Read._bits_to_value(bits[offset:(offset + bit_l)])
 
-    def __init__(self, bytes):
-        self.bits = self._bytearraytobitarray(bytes)
-
-    def to_bytearray(self):
-        return self._bitarraytobytearray(self.bits)
+    def _byte_range(self, offset, width):
+        size = len(self._data)
+        return size - ((offset + width + 7) >> 3), size - (offset >> 3)
 
     def get_value(self, offset, mask):
-        return self._get_value(self.bits, offset, mask)
+        width = self._field(offset, mask)
+        size = len(self._data)
+        start = size - ((offset + width + 7) >> 3)
+        end = size - (offset >> 3)
+        chunk = _int_from_bytes(self._data[start:end], 'big')
+        return (chunk >> (offset & 0x7)) & mask
 
     def set_value(self, offset, mask, value):
-        self._set_value(self.bits, offset, mask, value)
-
-    def __copy__(self):
-        return Read(self.to_bytearray())
-
-    def __len__(self):
-        return len(self.bits)
+        width = self._field(offset, mask)
+        if self._shared:
+            self._unshare()
+        self._dirty.add((offset, width))
+        size = len(self._data)
+        start = size - ((offset + width + 7) >> 3)
+        end = size - (offset >> 3)
+        shift = offset & 0x7
+        if end - start == 1:
+            self._data[start] = (self._data[start] & ~(mask << shift)) | ((value & mask) << shift)
+            return
+        chunk = _int_from_bytes(self._data[start:end], 'big')
+        chunk = (chunk & ~(mask << shift)) | ((value & mask) << shift)
+        self._data[start:end] = _int_to_bytes(chunk, end - start, 'big')
+
+
+class Normal(BitField):
+    """
+    Bit i is the bit i % 8 of the byte i / 8
+    """
+
+    _byteorder = 'little'
+    _msb_first = False
 
-
-class Normal(object):
     @staticmethod
     def _bytearraytobitarray(bytes):
         bits = []
@@ -247,29 +429,130 @@ class Normal(object):
         bit_l = int(bit_l)
         return Read._bits_to_value(bits[offset:(offset + bit_l)])
 
-    def __init__(self, bytes):
-        self.bits = self._bytearraytobitarray(bytes)
-
-    def to_bytearray(self):
-        return self._bitarraytobytearray(self.bits)
+    def _byte_range(self, offset, width):
+        return offset >> 3, (offset + width + 7) >> 3
 
     def get_value(self, offset, mask):
-        return self._get_value(self.bits, offset, mask)
+        width = self._field(offset, mask)
+        start = offset >> 3
+        end = (offset + width + 7) >> 3
+        chunk = _int_from_bytes(self._data[start:end], 'little')
+        return (chunk >> (offset & 0x7)) & mask
 
     def set_value(self, offset, mask, value):
-        self._set_value(self.bits, offset, mask, value)
-
-    def __copy__(self):
-        return Normal(self.to_bytearray())
-
-    def __len__(self):
-        return len(self.bits)
-
-
-def get_object(type, data):
-    if type == 'MCP_BCE_2':
-        return MCP_BCE_2(data)
-    elif type == 'Read' or type == 'WriteOSC':
-        return Read(data)
-    else:
-        raise Exception("Invalid Type %d" % (type))
+        width = self._field(offset, mask)
+        if self._shared:
+            self._unshare()
+        self._dirty.add((offset, width))
+        start = offset >> 3
+        end = (offset + width + 7) >> 3
+        shift = offset & 0x7
+        if end - start == 1:
+            self._data[start] = (self._data[start] & ~(mask << shift)) | ((value & mask) << shift)
+            return
+        chunk = _int_from_bytes(self._data[start:end], 'little')
+        chunk = (chunk & ~(mask << shift)) | ((value & mask) << shift)
+        self._data[start:end] = _int_to_bytes(chunk, end - start, 'little')
+
+
+_types = {
+    'MCP_BCE_2': MCP_BCE_2,
+    'Read': Read,
+    'WriteOSC': Read,
+    'Normal': Normal,
+}
+
+
+def get_type(type):
+    if type not in _types:
+        raise Exception("Invalid Type %s" % (type))
+    return _types[type]
+
+
+def get_object(type, data, copy=True):
+    return get_type(type)(data, copy)
+
+
+class Schema(object):
+    """
+    Named fields of a DID payload
+
+    The fields are compiled once into (shift, mask) pairs so a whole payload is
+    decoded or encoded with a single integer conversion instead of one
+    get_value/set_value call per field.
+    """
+
+    def __init__(self, type, fields, length=None):
+        super(Schema, self).__init__()
+        self._type = type
+        self._cls = get_type(type)
+        self._fields = list(fields)
+        self._length = length
+
+        self._index = {}
+        self._compiled = []
+        self._bits = 0
+        for field in self._fields:
+            if field.name in self._index:
+                raise Exception("Duplicated field %s" % (field.name))
+            width = BitField._width(field.mask)
+            end = field.offset + width
+            # Most significant bit first fields are anchored on their end
+            shift = end if self._cls._msb_first else field.offset
+            self._index[field.name] = (field, shift)
+            self._compiled.append((field.name, shift, field.mask))
+            self._bits = max(self._bits, end)
+        if length is not None and self._bits > length * 8:
+            raise Exception("Fields don't fit in %d bytes" % (length))
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def length(self):
+        return self._length
+
+    def field(self, name):
+        if name not in self._index:
+            raise Exception("Invalid field %s" % (name))
+        return self._index[name][0]
+
+    def create(self, data, copy=True):
+        return self._cls(data, copy)
+
+    def _load(self, data):
+        if isinstance(data, BitField):
+            data = data._data
+        if len(data) * 8 < self._bits:
+            raise Exception("Invalid payload size %d for %d bits" % (len(data), self._bits))
+        return _int_from_bytes(data, self._cls._byteorder), len(data)
+
+    def decode(self, data):
+        value, length = self._load(data)
+        if self._cls._msb_first:
+            size = length * 8
+            return dict([(name, (value >> (size - shift)) & mask) for name, shift, mask in self._compiled])
+        return dict([(name, (value >> shift) & mask) for name, shift, mask in self._compiled])
+
+    def encode(self, data, values):
+        value, length = self._load(data)
+        msb_first = self._cls._msb_first
+        size = length * 8
+        for name, field_value in values.items():
+            if name not in self._index:
+                raise Exception("Invalid field %s" % (name))
+            field, shift = self._index[name]
+            if msb_first:
+                shift = size - shift
+            value = (value & ~(field.mask << shift)) | ((field_value & field.mask) << shift)
+        return bytearray(_int_to_bytes(value, length, self._cls._byteorder))
+
+    def update(self, obj, values):
+        for name, value in values.items():
+            field = self.field(name)
+            obj.set_value(field.offset, field.mask, value)
@@ -5,6 +5,6 @@ setlocal
 SET PYTHONPATH=%root_path%output\%PYTHON_SITE_PACKAGES%
 SET PATH=%root_path%output\bin;%PATH%
 pushd "%root_path%"
-python -m unittest tests.test_pydstypes tests.test_pyds tests.test_extuds
+python -m unittest tests.test_pydstypes tests.test_pyds tests.test_extuds tests.test_secalgo tests.test_secbatch tests.test_sectable tests.test_secsearch tests.test_asyncuds tests.test_scan tests.test_keepalive tests.test_transfer tests.test_dump tests.test_can_cap
 popd
 endlocal
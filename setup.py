@@ -19,4 +19,7 @@ setup(
         'console_scripts': ['pyds=pyds.__main__:main'],
     },
     install_requires=['mock', 'enum34', 'cmd2', proxy],
+    extras_require={
+        'batch': ['numpy'],
+    },
 )
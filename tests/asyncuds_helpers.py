@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+#
+# Coroutines of the asyncio tests, kept apart as Python 2 can't compile them
+#
+
+import asyncio
+
+
+async def read(channel, dids):
+    return [await channel.send_rdbi(did) for did in dids]
+
+
+async def read_all(hs, hs_dids, ms, ms_dids):
+    return await asyncio.gather(read(hs, hs_dids), read(ms, ms_dids))
+
+
+async def read_timeouts(test, channel, did, count):
+    futures = [asyncio.ensure_future(channel.send_rdbi(did)) for i in range(count)]
+    for future in futures:
+        with test.assertRaises(asyncio.TimeoutError):
+            await future
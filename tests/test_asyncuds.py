@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import sys
+import threading
+import unittest
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+import uds
+
+from pyds.extuds import ExtendedUDS
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from pyds.asyncuds import AsyncExtendedUDS, ChannelExecutors
+    from tests.asyncuds_helpers import read_all, read_timeouts
+else:
+    asyncio = None
+
+
+class UDS(object):
+    pass
+
+
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class AsyncExtendedUDS_Test(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executors = ChannelExecutors()
+
+    def tearDown(self):
+        self.executors.shutdown()
+        self.loop.close()
+
+    def test_send_rdbi(self):
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=[uds.UDSMessage(bytearray([0x62, 0xDE, 0x01, 0x00, 0x38]))])
+        channel = AsyncExtendedUDS(ExtendedUDS(uds_channel, False), self.executors.get('HS'))
+
+        data = self.loop.run_until_complete(channel.send_rdbi(0xde01, 2000))
+        self.assertEqual(data, bytearray([0x00, 0x38]))
+        (message, timeout), dummy = uds_channel.send.call_args
+        self.assertEqual(message.getData(), bytearray([0x22, 0xDE, 0x01]))
+
+    def test_concurrency(self):
+        # Both buses must be in their transport at the same time to cross the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        threads = {}
+
+        def transport(bus):
+            def send(message, timeout):
+                threads.setdefault(bus, set()).add(threading.current_thread())
+                barrier.wait()
+                return uds.UDSMessage(bytearray([0x62]) + message.getData()[1:] + bytearray([0x00]))
+
+            uds_channel = UDS()
+            uds_channel.send = send
+            return uds_channel
+
+        hs = AsyncExtendedUDS(ExtendedUDS(transport('HS'), False), self.executors.get('HS'))
+        ms = AsyncExtendedUDS(ExtendedUDS(transport('MS'), False), self.executors.get('MS'))
+
+        hs_data, ms_data = self.loop.run_until_complete(read_all(hs, [0xde00, 0xde01], ms, [0xf190, 0xf188]))
+        self.assertEqual(hs_data, [bytearray([0x00])] * 2)
+        self.assertEqual(ms_data, [bytearray([0x00])] * 2)
+        self.assertEqual(len(threads['HS']), 1)
+        self.assertEqual(len(threads['MS']), 1)
+        self.assertNotEqual(threads['HS'], threads['MS'])
+
+    def test_deadline(self):
+        event = threading.Event()
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=lambda message, timeout: event.wait(5) and
+                                uds.UDSMessage(bytearray([0x62, 0xDE, 0x01, 0x00])))
+        channel = AsyncExtendedUDS(ExtendedUDS(uds_channel, False), self.executors.get('HS'), 0.05)
+
+        self.loop.run_until_complete(read_timeouts(self, channel, 0xde01, 2))
+        event.set()
+
+        # The queued call has been dropped and the channel is still usable
+        data = self.loop.run_until_complete(channel.send_rdbi(0xde01))
+        self.assertEqual(data, bytearray([0x00]))
+        self.assertEqual(uds_channel.send.call_count, 2)
+
+    def test_step_by_step(self):
+        with self.assertRaises(Exception):
+            AsyncExtendedUDS(ExtendedUDS(UDS(), True))
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import gzip
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from calendar import timegm
+from datetime import datetime
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import can_cap
+except ImportError:
+    can_cap = None
+
+LOG = """\
+On 01/02/2016 at 12:34:56.100, PassThruWriteMsgs O: 1
+    ChannelID: 1
+    pMsg[0]:
+        ProtocolID: ISO15765
+        TxFlags: 0x00000040
+        Data [7]: 00 00 07 e0 22 de
+        01
+
+    pNumMsgs: 1
+
+
+On 01/02/2016 at 12:34:56.200, PassThruReadMsgs O: 2
+    ChannelID: 1
+    pMsg[0]:
+        ProtocolID: ISO15765
+        RxStatus: TX_MSG_TYPE
+        Data [7]: 00 00 07 e0 22 de 01
+
+    pMsg[1]:
+        ProtocolID: ISO15765
+        RxStatus: No Flags Set
+        Data [8]: 00 00 07 e8 62 de 01 00
+
+    pNumMsgs: 2
+
+
+On 01/02/2016 at 12:34:57.000, PassThruReadMsgs O: 1
+    ChannelID: 2
+    pMsg[0]:
+        ProtocolID: ISO15765
+        RxStatus: No Flags Set
+        Data [5]: 00 00 07 28 10
+
+"""
+
+CONNECT = """\
+On 01/02/2016 at 12:34:50.000, PassThruConnect O: 0
+    DeviceID: 1
+    ProtocolID: ISO15765
+    Flags: 0x00000000
+    BaudRate: 500000
+    pChannelID: 1
+
+
+"""
+
+TIMED = """\
+On %s, PassThruReadMsgs O: 1
+    ChannelID: %d
+    pMsg[0]:
+        ProtocolID: ISO15765
+        RxStatus: No Flags Set
+        Data [5]: 00 00 07 e8 %02x
+
+    pNumMsgs: 1
+
+
+"""
+
+
+@unittest.skipIf(can_cap is None, "can_cap is not available")
+class CanCap_Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse(self):
+        lines = io.BytesIO(LOG.replace('\n', '\r\n').encode('latin-1'))
+        messages = list(can_cap.parse_log(lines))
+        self.assertEqual([(x.action, x.channel, x.rxstatus) for x in messages], [
+            ('PassThruWriteMsgs', '1', None),
+            ('PassThruReadMsgs', '1', 'TX_MSG_TYPE'),
+            ('PassThruReadMsgs', '1', 'No Flags Set'),
+            ('PassThruReadMsgs', '2', 'No Flags Set'),
+        ])
+        self.assertEqual(messages[0].data.split(), ['00', '00', '07', 'e0', '22', 'de', '01'])
+        packets = list(can_cap.get_packets(messages))
+        self.assertEqual([packet[0] for packet in packets], ['1', '1', '2'])
+        self.assertEqual(packets[1][1:], (1451738096, 200000000, bytearray([0, 0, 7, 0xe8, 0x62, 0xde, 0x01, 0x00])))
+
+    def test_date(self):
+        parser = can_cap.DateParser()
+        for date in ['01/02/2016 at 12:34:56.100', '01/02/2016 at 23:59:59.999999', '01/03/2016 at 00:00:00.5',
+                     '12/31/2016 at 00:00:00.000']:
+            expected = can_cap.parse_can_date(date)
+            self.assertEqual(parser.parse(date), (timegm(expected.utctimetuple()), expected.microsecond * 1000))
+        self.assertEqual(parser.parse('01/03/2016 at 00:00:01.123456789'), (1451779201, 123456789))
+
+    @unittest.skipIf(not hasattr(can_cap, 'cap_packet'), "construct is not available")
+    def test_writer(self):
+        stream = io.BytesIO()
+        writer = can_cap.PcapWriter(stream, buffer_size=64)
+        frames = [(1451738096 + i, i * 1000, bytearray([0, 0, 7, i]) + bytearray(range(i % 9))) for i in range(20)]
+        for frame in frames:
+            writer.write(*frame)
+        writer.flush()
+
+        # Same bytes as the construct definitions
+        expected = can_cap.cap_header.build(dict(thiszone=0, sigfigs=0, snaplen=0xfffff))
+        for sec, usec, data in frames:
+            packet = can_cap.can_packet.build(dict(id=0x700 + data[3], dlc=len(data) - 4, data=bytes(data[4:])))
+            expected += can_cap.cap_packet.build(dict(time=datetime.utcfromtimestamp(sec).replace(microsecond=usec),
+                                                      inc_length=len(packet), orig_length=len(packet), data=packet))
+        self.assertEqual(stream.getvalue(), expected)
+
+        path = os.path.join(self.directory, 'test.pcap')
+        with open(path, 'wb') as f:
+            f.write(expected)
+        self.assertEqual(can_cap.validate_pcap(path), 20)
+
+    def check_pcap(self, path, count):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(struct.unpack("<IHHiIII", data[:24]), (0xa1b2c3d4, 2, 4, 0, 0, 0xfffff, 0xe3))
+        offset = 24
+        packets = 0
+        while offset < len(data):
+            sec, usec, inc_length, orig_length = struct.unpack("<IIII", data[offset:offset + 16])
+            offset += 16 + inc_length
+            packets += 1
+        self.assertEqual(offset, len(data))
+        self.assertEqual(packets, count)
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'log.txt')
+        with open(path, 'w') as f:
+            f.write(LOG)
+        with self.assertRaises(Exception):
+            can_cap.main(['can_cap', path])
+        validate = ['--validate'] if hasattr(can_cap, 'cap_packet') else []
+        can_cap.main(['can_cap', '-c', '1', path] + validate)
+        self.check_pcap(os.path.join(self.directory, 'log.pcap'), 2)
+
+    def test_compressed(self):
+        path = os.path.join(self.directory, 'log.txt.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(LOG.encode('latin-1'))
+        can_cap.main(['can_cap', '-c', '2', path])
+        self.check_pcap(os.path.join(self.directory, 'log.pcap'), 1)
+
+    @unittest.skipIf(lzma is None, "lzma is not available")
+    def test_xz(self):
+        path = os.path.join(self.directory, 'log.xz')
+        with lzma.open(path, 'wb') as f:
+            f.write(LOG.encode('latin-1'))
+        can_cap.main(['can_cap', '-c', '1', path])
+        self.check_pcap(os.path.join(self.directory, 'log.pcap'), 2)
+
+    def write_log(self, path, count):
+        with open(path, 'w') as f:
+            for i in range(count):
+                f.write(LOG.replace('56.', '%02d.' % (i % 60)).replace('07 e8', '07 %02x' % (i % 256)))
+                f.write('\n')
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_chunks(self):
+        path = os.path.join(self.directory, 'log.txt')
+        self.write_log(path, 100)
+        chunks = can_cap.find_chunks(path, 7)
+        self.assertEqual(len(chunks), 7)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(path))
+        with open(path, 'rb') as f:
+            for (start, end), (next_start, next_end) in zip(chunks[:-1], chunks[1:]):
+                self.assertEqual(end, next_start)
+                f.seek(next_start)
+                self.assertTrue(f.readline().startswith(b'On '))
+
+    def test_parallel(self):
+        path = os.path.join(self.directory, 'log.txt')
+        self.write_log(path, 500)
+        output = os.path.join(self.directory, 'log.pcap')
+        serial = {}
+        for channel in ('1', '2'):
+            can_cap.main(['can_cap', '-c', channel, path])
+            serial[channel] = self.read(output)
+            os.remove(output)
+            can_cap.main(['can_cap', '-c', channel, '-j', '3', path])
+            self.assertEqual(self.read(output), serial[channel])
+        self.check_pcap(output, 500)
+
+        can_cap.main(['can_cap', '-a', '-j', '3', path])
+        for channel in ('1', '2'):
+            self.assertEqual(self.read(os.path.join(self.directory, 'log.%s.pcap' % (channel))), serial[channel])
+        # The records of the chunks are removed
+        self.assertEqual(sorted(os.listdir(self.directory)), ['log.1.pcap', 'log.2.pcap', 'log.pcap', 'log.txt'])
+
+    def test_parallel_pcapng(self):
+        # The channels 2 and 3 start in other chunks, 3 being connected there
+        path = os.path.join(self.directory, 'log.txt')
+        start = 1451606400
+        with open(path, 'w') as f:
+            f.write(CONNECT)
+            for i in range(240):
+                if i == 80:
+                    f.write(CONNECT.replace('pChannelID: 1', 'pChannelID: 3').replace('500000', '250000'))
+                date = datetime.utcfromtimestamp(start + i * 0.25).strftime('%m/%d/%Y at %H:%M:%S.%f')[:-3]
+                channel = 1 if i < 80 else [3, 2][i % 2] if i < 160 else [2, 1, 3][i % 3]
+                f.write(TIMED % (date, channel, i % 256))
+        output = os.path.join(self.directory, 'log.pcapng')
+        for options in ([], ['-c', '3']):
+            can_cap.main(['can_cap', '-f', 'pcapng'] + options + [path])
+            serial = self.read(output)
+            os.remove(output)
+            for jobs in ('2', '4', '7'):
+                can_cap.main(['can_cap', '-f', 'pcapng', '-j', jobs] + options + [path])
+                self.assertEqual(self.read(output), serial)
+        blocks = self.read_pcapng(output)
+        self.assertEqual([type for type, body in blocks].count(6), 67)
+        self.assertIn(struct.pack("<HH", 8, 8) + struct.pack("<Q", 250000), blocks[1][1])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['log.pcapng', 'log.txt'])
+
+    def read_pcapng(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        blocks = []
+        offset = 0
+        while offset < len(data):
+            type, length = struct.unpack("<II", data[offset:offset + 8])
+            self.assertEqual(length % 4, 0)
+            self.assertEqual(struct.unpack("<I", data[offset + length - 4:offset + length])[0], length)
+            blocks.append((type, data[offset + 8:offset + length - 4]))
+            offset += length
+        return blocks
+
+    def test_pcapng(self):
+        path = os.path.join(self.directory, 'log.txt')
+        with open(path, 'w') as f:
+            f.write(CONNECT + LOG)
+        can_cap.main(['can_cap', '-f', 'pcapng', path])
+        blocks = self.read_pcapng(os.path.join(self.directory, 'log.pcapng'))
+        self.assertEqual(blocks[0][0], 0x0A0D0D0A)
+        self.assertEqual(struct.unpack("<IHH", blocks[0][1][:8]), (0x1A2B3C4D, 1, 0))
+
+        interfaces = []
+        packets = []
+        for type, body in blocks[1:]:
+            if type == 1:
+                linktype, reserved, snaplen = struct.unpack("<HHI", body[:8])
+                self.assertEqual(linktype, 0xe3)
+                options = {}
+                offset = 8
+                while True:
+                    code, length = struct.unpack("<HH", body[offset:offset + 4])
+                    if code == 0:
+                        break
+                    options[code] = body[offset + 4:offset + 4 + length]
+                    offset += 4 + length + (4 - length % 4) % 4
+                interfaces.append(options)
+            else:
+                self.assertEqual(type, 6)
+                interface, high, low, caplen, origlen = struct.unpack("<IIIII", body[:20])
+                self.assertEqual(caplen, origlen)
+                packets.append((interface, (high << 32) | low, body[20:20 + caplen]))
+
+        # An interface by channel, in the order of the log
+        self.assertEqual(len(interfaces), 2)
+        self.assertEqual(interfaces[0][2], b'channel 1')
+        self.assertEqual(interfaces[0][3], b'ISO15765')
+        self.assertEqual(struct.unpack("<Q", interfaces[0][8])[0], 500000)
+        self.assertEqual(interfaces[0][9], b'\x09')
+        self.assertEqual(interfaces[1][2], b'channel 2')
+        self.assertNotIn(8, interfaces[1])
+
+        self.assertEqual([x[0] for x in packets], [0, 0, 1])
+        self.assertEqual(packets[0][1], 1451738096100000000)
+        self.assertEqual(packets[1][2], bytearray([0, 0, 7, 0xe8, 4, 0, 0, 0, 0x62, 0xde, 0x01, 0x00]))
+        self.assertEqual(packets[2][2], bytearray([0, 0, 7, 0x28, 1, 0, 0, 0, 0x10]))
+
+    def write_timed_log(self, path, seconds):
+        start = 1451606400
+        with open(path, 'w') as f:
+            f.write(CONNECT)
+            for i in range(seconds * 4):
+                timestamp = start + i * 0.25
+                date = datetime.utcfromtimestamp(timestamp).strftime('%m/%d/%Y at %H:%M:%S.%f')[:-3]
+                f.write(TIMED % (date, 1 + i % 2, i % 256))
+        return start
+
+    def convert_window(self, path, channel, start, end):
+        with open(path, 'rb') as f:
+            packets = [packet for packet in can_cap.get_packets(can_cap.parse_log(f))
+                       if start <= packet[1] * 1000000000 + packet[2] <= end]
+        stream = io.BytesIO()
+        can_cap.write_pcap(stream, iter(packets), channel)
+        return stream.getvalue()
+
+    def test_index_log(self):
+        path = os.path.join(self.directory, 'log.txt')
+        begin = self.write_timed_log(path, 120)
+        can_cap.main(['can_cap', '--index', '--interval', '10', path])
+        index = can_cap.Index.load(path)
+        self.assertEqual(index.kind, 'log')
+        self.assertEqual(len(index.entries), 24)
+        self.assertEqual(index.connections['1'], ('ISO15765', 500000))
+
+        # The extract starts near the window
+        start = (begin + 30) * 1000000000
+        end = (begin + 60) * 1000000000
+        self.assertGreater(index.find(start, '1'), os.path.getsize(path) // 8)
+        output = os.path.join(self.directory, 'extract.pcap')
+        can_cap.main(['can_cap', '-c', '2', '--start', str(begin + 30), '--end', '01/01/2016 at 00:01:00.000',
+                      '-o', output, path])
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), self.convert_window(path, '2', start, end))
+        self.check_pcap(output, 60)
+
+        # The connection of the channel is kept in the pcapng files, the default output doesn't replace the
+        # conversion of the whole log
+        can_cap.main(['can_cap', '-f', 'pcapng', '--start', str(begin + 30), '--end', str(begin + 60), path])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'log.pcapng')))
+        blocks = self.read_pcapng(os.path.join(self.directory, 'log.extract.pcapng'))
+        self.assertEqual([type for type, body in blocks].count(6), 121)
+        self.assertIn(struct.pack("<HH", 8, 8) + struct.pack("<Q", 500000), blocks[1][1])
+
+        # An index out of date is built again
+        with open(path, 'a') as f:
+            f.write(CONNECT)
+        self.assertIsNone(can_cap.Index.load(path))
+        self.assertEqual(len(can_cap.get_index(path, 10).entries), 24)
+        self.assertIsNotNone(can_cap.Index.load(path))
+
+    def test_index_pcap(self):
+        path = os.path.join(self.directory, 'log.txt')
+        begin = self.write_timed_log(path, 60)
+        can_cap.main(['can_cap', '-c', '1', path])
+        pcap = os.path.join(self.directory, 'log.pcap')
+        index = can_cap.get_index(pcap, 5)
+        self.assertEqual(index.kind, 'pcap')
+        self.assertEqual(len(index.entries), 12)
+
+        start = (begin + 20) * 1000000000 + 500000000
+        end = (begin + 40) * 1000000000
+        output = os.path.join(self.directory, 'extract.pcap')
+        with open(output, 'wb') as ostream:
+            self.assertEqual(can_cap.extract_pcap(pcap, index, ostream, start, end), 40)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), self.convert_window(path, '1', start, end))
+
+        # A file rewritten with the same size and time is detected
+        stat = os.stat(pcap)
+        can_cap.main(['can_cap', '-c', '2', path])
+        os.utime(pcap, (stat.st_atime, stat.st_mtime))
+        self.assertEqual(os.path.getsize(pcap), stat.st_size)
+        self.assertIsNone(can_cap.Index.load(pcap))
+
+    def test_index_unsupported(self):
+        path = os.path.join(self.directory, 'log.txt')
+        self.write_timed_log(path, 10)
+        can_cap.main(['can_cap', '-f', 'pcapng', path])
+        pcapng = os.path.join(self.directory, 'log.pcapng')
+        with self.assertRaises(Exception):
+            can_cap.Index.build(pcapng)
+
+        # Nanosecond pcap
+        nsec = os.path.join(self.directory, 'nsec.pcap')
+        with open(nsec, 'wb') as f:
+            f.write(can_cap.pcap_header.pack(can_cap.PCAP_NSEC_MAGIC, 2, 4, 0, 0, can_cap.PCAP_SNAPLEN,
+                                             can_cap.LINKTYPE_CAN_SOCKETCAN))
+        with self.assertRaises(Exception):
+            can_cap.main(['can_cap', '--start', '0', nsec])
+        self.assertFalse(os.path.exists(can_cap.Index.get_path(nsec)))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import uds
+
+from pyds.dump import BlockSize, MemoryDump
+from pyds.extuds import ExtendedUDS
+
+
+class MemoryECU(object):
+    """
+    Simulated ECU serving ReadMemoryByAddress from a memory image
+    """
+
+    def __init__(self, image, base, max_block=0x300, holes=(), timeout_every=None, fail_after=None):
+        self.image = image
+        self.base = base
+        self.max_block = max_block
+        self.holes = holes
+        self.timeout_every = timeout_every
+        self.fail_after = fail_after
+        self.requests = []
+
+    def send(self, message, timeout):
+        data = message.getData()
+        self.requests.append(bytearray(data))
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise Exception("Timeout")
+            self.fail_after -= 1
+        if self.timeout_every is not None and len(self.requests) % self.timeout_every == 0:
+            raise Exception("Timeout")
+        sid = data[0]
+        if sid != uds.UDS_SERVICES_RMBA:
+            return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x11]))
+        addr_s = data[1] & 0x0F
+        size_s = (data[1] >> 4) & 0x0F
+        address = ExtendedUDS.bytestoint(data[2:2 + addr_s]) - self.base
+        size = ExtendedUDS.bytestoint(data[2 + addr_s:2 + addr_s + size_s])
+        if size > self.max_block:
+            return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x31]))
+        for start, end in self.holes:
+            if address < end and address + size > start:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x31]))
+        return uds.UDSMessage(bytearray([0x63]) + self.image[address:address + size])
+
+
+class BlockSize_Test(unittest.TestCase):
+    def test_converge(self):
+        block_size = BlockSize(0x100, 0x10, 0xFFE)
+        for i in range(32):
+            if block_size.size <= 0x300:
+                block_size.success(block_size.size)
+            else:
+                block_size.failure(block_size.size)
+        self.assertLessEqual(0x300 - block_size.good, 0x10)
+        self.assertLessEqual(block_size.size, 0x300)
+
+    def test_minimum(self):
+        block_size = BlockSize(0x100, 0x10, 0xFFE)
+        for i in range(16):
+            block_size.failure(block_size.size)
+        self.assertEqual(block_size.size, 0x10)
+
+    def test_refused_area(self):
+        block_size = BlockSize(0x100, 0x10, 0xFFE)
+        block_size.success(0x100)
+        block_size.failure(0x200)
+        self.assertEqual(block_size.size, 0x180)
+        # A size already accepted is only shrunk for the next block
+        block_size.success(0x180)
+        self.assertEqual(block_size.size, 0x1C0)
+        block_size.failure(0x100)
+        self.assertEqual(block_size.size, 0x80)
+        block_size.success(0x80)
+        self.assertEqual(block_size.size, 0x1C0)
+
+
+class MemoryDump_Test(unittest.TestCase):
+    base = 0xFFF88800
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rand = random.Random(0)
+        self.image = bytearray([rand.randint(0, 255) for i in range(0x10000 + 7)])
+        self.holes = [(0x4010, 0x4030)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, data):
+        expected = bytearray(self.image)
+        for start, end in self.holes:
+            expected[start:end] = bytearray(end - start)
+        self.assertEqual(bytearray(data), expected)
+
+    def test_dump(self):
+        ecu = MemoryECU(self.image, self.base, holes=self.holes, timeout_every=50)
+        progress = []
+        dump = MemoryDump(ExtendedUDS(ecu, False), self.base, len(self.image),
+                          progress=lambda done, size, rate: progress.append(done))
+        self.check(dump.run())
+        stats = dump.stats
+        self.assertEqual(stats['bad'], 0x20)
+        self.assertEqual(stats['read'], len(self.image) - 0x20)
+        self.assertGreater(stats['timeouts'], 0)
+        self.assertGreater(dump.block_size.good, 0x200)
+        self.assertLessEqual(dump.block_size.good, 0x300)
+        # Most of the image is read with large blocks
+        self.assertLess(stats['requests'], len(self.image) // 0x200)
+        self.assertEqual(progress[-1], len(self.image))
+
+    def test_resume(self):
+        path = os.path.join(self.directory, 'dump.bin')
+        journal = path + '.journal'
+
+        ecu = MemoryECU(self.image, self.base, holes=self.holes, fail_after=100)
+        with self.assertRaises(Exception):
+            MemoryDump(ExtendedUDS(ecu, False), self.base, len(self.image), path, journal).run()
+        self.assertTrue(os.path.exists(journal))
+
+        ecu = MemoryECU(self.image, self.base, holes=self.holes)
+        dump = MemoryDump(ExtendedUDS(ecu, False), self.base, len(self.image), path, journal)
+        self.assertEqual(dump.run(), path)
+        self.assertFalse(os.path.exists(journal))
+        # The ranges read before the interruption are not requested again
+        self.assertLess(dump.stats['read'], len(self.image) - 0x4000)
+        first = ExtendedUDS.bytestoint(ecu.requests[0][2:6]) - self.base
+        self.assertGreater(first, 0)
+        with open(path, 'rb') as f:
+            self.check(f.read())
+
+    def test_resume_without_output(self):
+        ecu = MemoryECU(self.image, self.base)
+        with self.assertRaises(ValueError):
+            MemoryDump(ExtendedUDS(ecu, False), self.base, len(self.image), journal=os.path.join(self.directory, 'j'))
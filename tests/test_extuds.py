@@ -26,10 +26,11 @@ __version__ = "0.0.1"
 import unittest
 
 try:
-    from unittest.mock import Mock
+    from unittest.mock import Mock, patch
 except ImportError:
-    from mock import Mock
-from pyds.extuds import ExtendedUDS, NegativeResponseException
+    from mock import Mock, patch
+from pyds.extuds import ExtendedUDS, NegativeResponseException, Timing, RetryPolicy, RetryRule, SA_DELAY, Tracer, \
+    HexData
 
 import uds
 
@@ -65,6 +66,351 @@ class ExtendedUDS_Test(unittest.TestCase):
         self.check_input(uds_channel, bytearray([0x22, 0xDE, 0x01]))
         self.assertEqual(de01Data, bytearray([0x00, 0x38, 0x10, 0xA0, 0x50]))
 
+    def test_send_rdbi_view(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # Check output
+        self.check_output(uds_channel, bytearray([0x62, 0xDE, 0x01, 0x00, 0x38, 0x10, 0xA0, 0x50]))
+
+        # Send
+        de01Data = ext_uds_channel.send_rdbi(0xde01, 2000, copy=False)
+
+        # Check input
+        self.check_input(uds_channel, bytearray([0x22, 0xDE, 0x01]))
+        self.assertIsInstance(de01Data, memoryview)
+        self.assertEqual(bytearray(de01Data), bytearray([0x00, 0x38, 0x10, 0xA0, 0x50]))
+
+    def test_send_rdbi_multi(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # Check output
+        self.check_output(uds_channel, bytearray([0x62, 0xDA, 0x70, 0x12, 0x34, 0xDA, 0x72, 0x56, 0xDD, 0x01,
+                                                  0x01, 0x02, 0x03]))
+
+        # Send
+        data = ext_uds_channel.send_rdbi_multi([0xdd01, 0xda70, 0xda72], {0xda70: 2, 0xda72: 1}, 2000)
+
+        # Check input, the DID of unknown length is the last one
+        self.check_input(uds_channel, bytearray([0x22, 0xDA, 0x70, 0xDA, 0x72, 0xDD, 0x01]))
+        self.assertEqual(data, {0xda70: bytearray([0x12, 0x34]), 0xda72: bytearray([0x56]),
+                                0xdd01: bytearray([0x01, 0x02, 0x03])})
+        self.assertIsNone(ext_uds_channel.rdbi_batch_size)
+
+    def test_send_rdbi_multi_fallback(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # The ECU only accepts one DID per request
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x13])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x13])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x70, 0x12, 0x34])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x72, 0x56])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x73, 0x78])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x74, 0x9A])),
+        ])
+        lengths = {0xda70: 2, 0xda72: 1, 0xda73: 1, 0xda74: 1}
+        data = ext_uds_channel.send_rdbi_multi([0xda70, 0xda72, 0xda73, 0xda74], lengths, 2000)
+        self.assertEqual(data, {0xda70: bytearray([0x12, 0x34]), 0xda72: bytearray([0x56]),
+                                0xda73: bytearray([0x78]), 0xda74: bytearray([0x9A])})
+        requests = [args[0].getData() for args, kwargs in uds_channel.send.call_args_list]
+        self.assertEqual(requests, [bytearray([0x22, 0xDA, 0x70, 0xDA, 0x72, 0xDA, 0x73, 0xDA, 0x74]),
+                                    bytearray([0x22, 0xDA, 0x70, 0xDA, 0x72]),
+                                    bytearray([0x22, 0xDA, 0x70]),
+                                    bytearray([0x22, 0xDA, 0x72]),
+                                    bytearray([0x22, 0xDA, 0x73]),
+                                    bytearray([0x22, 0xDA, 0x74])])
+        self.assertEqual(ext_uds_channel.rdbi_batch_size, 1)
+
+        # The batch size is kept
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x70, 0x12, 0x34])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x72, 0x56])),
+        ])
+        ext_uds_channel.send_rdbi_multi([0xda70, 0xda72], lengths, 2000)
+        requests = [args[0].getData() for args, kwargs in uds_channel.send.call_args_list]
+        self.assertEqual(requests, [bytearray([0x22, 0xDA, 0x70]), bytearray([0x22, 0xDA, 0x72])])
+
+    def test_send_rdbi_multi_missing(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # Unsupported DIDs are omitted from the reply and are read alone
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x72, 0x56])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x31])),
+        ])
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_rdbi_multi([0xda70, 0xda72], {0xda70: 2, 0xda72: 1}, 2000)
+        self.check_input(uds_channel, bytearray([0x22, 0xDA, 0x70]))
+
+    def test_send_rdbi_multi_out_of_range(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # The unsupported DID is isolated, the batch size is kept
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x31])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x70, 0x12, 0x34, 0xDA, 0x72, 0x56])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x31])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x73, 0x78])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x31])),
+        ])
+        lengths = {0xda70: 2, 0xda72: 1, 0xda73: 1, 0xda74: 1}
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_rdbi_multi([0xda70, 0xda72, 0xda73, 0xda74], lengths, 2000)
+        requests = [args[0].getData() for args, kwargs in uds_channel.send.call_args_list]
+        self.assertEqual(requests, [bytearray([0x22, 0xDA, 0x70, 0xDA, 0x72, 0xDA, 0x73, 0xDA, 0x74]),
+                                    bytearray([0x22, 0xDA, 0x70, 0xDA, 0x72]),
+                                    bytearray([0x22, 0xDA, 0x73, 0xDA, 0x74]),
+                                    bytearray([0x22, 0xDA, 0x73]),
+                                    bytearray([0x22, 0xDA, 0x74])])
+        self.assertIsNone(ext_uds_channel.rdbi_batch_size)
+
+    def test_send_rdbi_multi_timeout(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # A timeout doesn't change the batch size
+        uds_channel.send = Mock(side_effect=Exception("Timeout"))
+        with self.assertRaises(Exception):
+            ext_uds_channel.send_rdbi_multi([0xda70, 0xda72], {0xda70: 2, 0xda72: 1}, 2000)
+        self.assertIsNone(ext_uds_channel.rdbi_batch_size)
+
+        # A reply which can't be split does
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x70, 0x12])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x70, 0x12, 0x34])),
+            uds.UDSMessage(bytearray([0x62, 0xDA, 0x72, 0x56])),
+        ])
+        data = ext_uds_channel.send_rdbi_multi([0xda70, 0xda72], {0xda70: 2, 0xda72: 1}, 2000)
+        self.assertEqual(data, {0xda70: bytearray([0x12, 0x34]), 0xda72: bytearray([0x56])})
+        self.assertEqual(ext_uds_channel.rdbi_batch_size, 1)
+
+    def test_session_state(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+        state = ext_uds_channel.session_state
+        self.assertIsNone(state.session)
+
+        with patch('time.time', return_value=100.0):
+            self.check_output(uds_channel, bytearray([0x50, 0x03, 0x00, 0x32, 0x01, 0xF4]))
+            ext_uds_channel.send_dsc(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+            self.assertEqual(state.session, uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+            self.assertIsNone(state.level)
+
+            self.check_output(uds_channel, bytearray([0x67, 0x03, 0x11, 0x22, 0x33]))
+            ext_uds_channel.send_sa(uds.UDS_SA_TYPES_SEED_2, bytearray())
+            self.assertIsNone(state.level)
+            self.check_output(uds_channel, bytearray([0x67, 0x04]))
+            ext_uds_channel.send_sa(uds.UDS_SA_TYPES_KEY_2, bytearray([0x01, 0x02, 0x03]))
+            self.assertEqual(state.level, uds.UDS_SA_TYPES_SEED_2)
+
+        # Close to the S3 timeout the state is unknown, after it the ECU is back in the default session
+        with patch('time.time', return_value=104.8):
+            self.assertIsNone(state.session)
+            self.assertIsNone(state.level)
+        with patch('time.time', return_value=105.1):
+            self.assertEqual(state.session, uds.UDS_DSC_TYPES_DEFAULT_SESSION)
+            self.assertIsNone(state.level)
+
+    def test_session_state_error(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+        state = ext_uds_channel.session_state
+        state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+        state.set_level(uds.UDS_SA_TYPES_SEED_2)
+
+        # The ECU isn't in the expected state
+        self.check_output(uds_channel, bytearray([0x7F, 0x2E, 0x33]), uds.UDSNegativeResponseMessage)
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_wdbi(0xde01, bytearray([0x00]))
+        self.assertIsNone(state.session)
+        self.assertIsNone(state.level)
+
+    def test_timing(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+        timing = ext_uds_channel.timing
+
+        # Default P2
+        self.check_output(uds_channel, bytearray([0x50, 0x03, 0x00, 0x32, 0x01, 0xF4]))
+        ext_uds_channel.send_dsc(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+        (message, timeout), dummy = uds_channel.send.call_args
+        self.assertEqual(timeout, 300)
+
+        # P2 of 100ms and P2* of 2000ms from the DSC reply
+        self.check_output(uds_channel, bytearray([0x50, 0x03, 0x00, 0x64, 0x00, 0xC8]))
+        ext_uds_channel.send_dsc(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+        self.assertEqual(timing.p2, 100)
+        self.assertEqual(timing.p2_star, 2000)
+
+        # Response pending waits for P2*
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSMessage(bytearray([0x7F, 0x22, 0x78])),
+            uds.UDSMessage(bytearray([0x62, 0xDE, 0x01, 0x00])),
+        ])
+        ext_uds_channel.send_rdbi(0xde01)
+        timeouts = [args[1] for args, kwargs in uds_channel.send.call_args_list]
+        self.assertEqual(timeouts, [350, 2250])
+
+        # An explicit timeout is kept
+        self.check_output(uds_channel, bytearray([0x62, 0xDE, 0x01, 0x00]))
+        ext_uds_channel.send_rdbi(0xde01, 2000)
+        self.assertEqual(uds_channel.send.call_args[0][1], 2000)
+
+    def test_timing_latency(self):
+        timing = Timing()
+        for i in range(7):
+            timing.record(400)
+        self.assertEqual(timing.timeout, 300)
+        timing.record(400)
+        self.assertEqual(timing.timeout, 600)
+        self.assertEqual(timing.histogram(), [(512, 8)])
+
+        # Bounded by the pending timeout
+        for i in range(64):
+            timing.record(10000)
+        self.assertEqual(timing.timeout, 5250)
+
+    def test_timing_transport(self):
+        timing = Timing()
+        self.assertEqual(Timing.transport_time(None), 0)
+        self.assertEqual(Timing.transport_time(7), 0)
+        self.assertEqual(Timing.transport_time(8), 10)
+        self.assertEqual(Timing.transport_time(257), 360)
+        self.assertEqual(timing.get_timeout(257), 660)
+
+        # The transport isn't counted in the latency
+        for i in range(8):
+            timing.record(400, 257)
+        self.assertEqual(timing.timeout, 300)
+
+        # A long RMBA reply gets the time of its consecutive frames
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+        self.check_output(uds_channel, bytearray([0x63]) + bytearray(0x100))
+        ext_uds_channel.send_rmba((0x1000, 4), (0x100, 2))
+        self.assertEqual(uds_channel.send.call_args[0][1], 660)
+
+    @patch('time.sleep')
+    def test_retry(self, sleep):
+        # Prepare
+        uds_channel = UDS()
+        policy = RetryPolicy(seed=0)
+        ext_uds_channel = ExtendedUDS(uds_channel, False, retry_policy=policy)
+
+        # Busy then OK
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x21])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x21])),
+            uds.UDSMessage(bytearray([0x62, 0xDE, 0x01, 0x00])),
+        ])
+        self.assertEqual(ext_uds_channel.send_rdbi(0xde01), bytearray([0x00]))
+        self.assertEqual(uds_channel.send.call_count, 3)
+        delays = [args[0] for args, kwargs in sleep.call_args_list]
+        self.assertTrue(0.025 <= delays[0] <= 0.05)
+        self.assertTrue(0.05 <= delays[1] <= 0.1)
+
+        # The SA delay timer is waited on the seed request only
+        sleep.reset_mock()
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x27, 0x37])),
+            uds.UDSMessage(bytearray([0x67, 0x03, 0x11, 0x22, 0x33])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x27, 0x36])),
+        ])
+        ext_uds_channel.send_sa(uds.UDS_SA_TYPES_SEED_2, bytearray())
+        sleep.assert_called_once_with(SA_DELAY)
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_sa(uds.UDS_SA_TYPES_KEY_2, bytearray([0x01, 0x02, 0x03]))
+        self.assertEqual(uds_channel.send.call_count, 3)
+
+        # Not retried
+        self.check_output(uds_channel, bytearray([0x7F, 0x22, 0x31]), uds.UDSNegativeResponseMessage)
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_rdbi(0xde01)
+
+        counters = policy.counters
+        self.assertEqual(counters[0x21], {'count': 2, 'retries': 2, 'failures': 0, 'wait': sum(delays)})
+        self.assertEqual(counters[0x37], {'count': 1, 'retries': 1, 'failures': 0, 'wait': SA_DELAY})
+        self.assertEqual(counters[0x36], {'count': 1, 'retries': 0, 'failures': 0, 'wait': 0.0})
+        self.assertEqual(counters[0x31], {'count': 1, 'retries': 0, 'failures': 0, 'wait': 0.0})
+
+    @patch('time.sleep')
+    def test_retry_budget(self, sleep):
+        # Prepare
+        uds_channel = UDS()
+        policy = RetryPolicy({(None, 0x22): RetryRule(10, 1.0, factor=1.0, jitter=0)}, budget=2.5)
+        ext_uds_channel = ExtendedUDS(uds_channel, False, retry_policy=policy)
+
+        uds_channel.send = Mock(return_value=uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x22])))
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_rdbi(0xde01)
+        self.assertEqual(uds_channel.send.call_count, 3)
+        self.assertEqual(policy.counters[0x22], {'count': 3, 'retries': 2, 'failures': 1, 'wait': 2.0})
+
+    def test_tracer(self):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+        tracer = Mock(spec=Tracer)
+        ext_uds_channel.add_tracer(tracer)
+
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSMessage(bytearray([0x7F, 0x22, 0x78])),
+            uds.UDSMessage(bytearray([0x62, 0xDE, 0x01, 0x00])),
+            uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x31])),
+            Exception("Timeout"),
+        ])
+        ext_uds_channel.send_rdbi(0xde01)
+        tracer.request.assert_called_once_with(ext_uds_channel, 0x22, bytearray([0x22, 0xDE, 0x01]))
+        self.assertEqual(tracer.pending.call_args[0][:2], (ext_uds_channel, 0x22))
+        self.assertEqual(tracer.reply.call_args[0][:3], (ext_uds_channel, 0x22, bytearray([0x62, 0xDE, 0x01, 0x00])))
+        with self.assertRaises(NegativeResponseException):
+            ext_uds_channel.send_rdbi(0xde01)
+        self.assertEqual(tracer.negative_response.call_args[0][:3], (ext_uds_channel, 0x22, 0x31))
+        with self.assertRaises(Exception):
+            ext_uds_channel.send_rdbi(0xde01)
+        self.assertEqual(tracer.error.call_count, 1)
+
+        # A request can be cancelled
+        ext_uds_channel.remove_tracer(tracer)
+        self.assertEqual(ext_uds_channel.tracers, ())
+        ext_uds_channel.step_by_step = True
+        self.assertTrue(ext_uds_channel.step_by_step)
+        uds_channel.send = Mock()
+        with patch('pyds.extuds.input', return_value='NO', create=True):
+            with self.assertRaises(Exception):
+                ext_uds_channel.send_rdbi(0xde01)
+        self.assertFalse(uds_channel.send.called)
+        ext_uds_channel.step_by_step = False
+        self.assertEqual(ext_uds_channel.tracers, ())
+
+    @patch.object(HexData, '__str__')
+    def test_lazy_hex(self, hex_str):
+        # Prepare
+        uds_channel = UDS()
+        ext_uds_channel = ExtendedUDS(uds_channel, False)
+
+        # Nothing formatted without debug logging
+        self.check_output(uds_channel, bytearray([0x62, 0xDE, 0x01, 0x00]))
+        ext_uds_channel.send_rdbi(0xde01)
+        self.assertFalse(hex_str.called)
+
+    def test_hex_data(self):
+        self.assertEqual(str(HexData(bytearray([0x01, 0xab, 0x00]))), "01 ab 00")
+
     def test_initial_hs(self):
         # Prepare
         uds_channel = UDS()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import threading
+import unittest
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+import uds
+
+from pyds.extuds import ExtendedUDS
+from pyds.keepalive import Keepalive
+
+
+class UDS(object):
+    pass
+
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def timeout(self, message, timeout):
+        # No reply within the timeout
+        self.now += timeout / 1000.0
+        raise Exception("Timeout")
+
+
+class Keepalive_Test(unittest.TestCase):
+    def test_tick(self):
+        clock = Clock(100.0)
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=clock.timeout)
+        channel = ExtendedUDS(uds_channel, False)
+        default_channel = ExtendedUDS(uds_channel, False)
+        keepalive = Keepalive(interval=2000)
+        keepalive.add(channel)
+        keepalive.add(default_channel)
+
+        with patch('time.time', side_effect=clock.time):
+            channel.session_state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+            default_channel.session_state.reset()
+
+            # Recent activity
+            clock.now = 101.0
+            keepalive.tick()
+            self.assertEqual(uds_channel.send.call_count, 0)
+
+            clock.now = 102.5
+            keepalive.tick()
+            (message, timeout), dummy = uds_channel.send.call_args
+            self.assertEqual(message.getData(), bytearray([0x3E, 0x80]))
+            self.assertAlmostEqual(channel.session_state.last_activity, 102.6)
+
+            clock.now = 104.7
+            keepalive.tick()
+        self.assertEqual(uds_channel.send.call_count, 2)
+        self.assertEqual(keepalive.stats, {'sent': 2, 'errors': 0, 'busy': 0, 'sessions': 1, 'active': 1})
+
+        # Session expired
+        with patch('time.time', return_value=110.0):
+            keepalive.tick()
+        self.assertEqual(uds_channel.send.call_count, 2)
+        self.assertEqual(keepalive.stats['active'], 0)
+
+    def test_busy(self):
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=Exception("Timeout"))
+        channel = ExtendedUDS(uds_channel, False)
+        keepalive = Keepalive(interval=0)
+        keepalive.add(channel)
+        channel.session_state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+
+        # A request in progress in another thread
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with channel.lock:
+                locked.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait(5)
+        keepalive.tick()
+        release.set()
+        thread.join()
+        self.assertEqual(uds_channel.send.call_count, 0)
+        self.assertEqual(keepalive.stats['busy'], 1)
+
+    def test_shared_lock(self):
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=Exception("Timeout"))
+        lock = threading.RLock()
+        channel = ExtendedUDS(uds_channel, False, lock=lock)
+        other = ExtendedUDS(uds_channel, False, lock=lock)
+        keepalive = Keepalive(interval=0)
+        keepalive.add(channel)
+        channel.session_state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+
+        # A transfer in progress on another channel of the same physical channel
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with other.lock:
+                locked.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait(5)
+        keepalive.tick()
+        release.set()
+        thread.join()
+        self.assertEqual(uds_channel.send.call_count, 0)
+        self.assertEqual(keepalive.stats['busy'], 1)
+
+    def test_channel_error(self):
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=Exception("Channel in use"))
+        channel = ExtendedUDS(uds_channel, False)
+        keepalive = Keepalive(interval=0)
+        keepalive.add(channel)
+        with patch('time.time', return_value=100.0):
+            channel.session_state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+            keepalive.tick()
+        self.assertEqual(keepalive.stats['errors'], 1)
+        self.assertEqual(keepalive.stats['sent'], 0)
+
+    def test_error(self):
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=[uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x3E, 0x7F]))])
+        channel = ExtendedUDS(uds_channel, False)
+        keepalive = Keepalive(interval=0)
+        keepalive.add(channel)
+        channel.session_state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+        keepalive.tick()
+        self.assertEqual(keepalive.stats['errors'], 1)
+        self.assertIsNone(channel.session_state.session)
+
+    def test_thread(self):
+        event = threading.Event()
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=lambda message, timeout: event.set())
+        channel = ExtendedUDS(uds_channel, False)
+        channel.session_state.set_session(uds.UDS_DSC_TYPES_EXTENDED_DIAGNOSTIC_SESSION)
+        keepalive = Keepalive(interval=20)
+        keepalive.add(channel)
+        keepalive.start()
+        self.assertTrue(event.wait(5))
+        keepalive.stop()
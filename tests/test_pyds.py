@@ -24,8 +24,19 @@ __license__ = "GPL"
 __version__ = "0.0.1"
 
 import unittest
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
 from pyds.types import Normal, MCP_BCE_2
 from pyds.actions import unlock_rbcm_features, unlock_ic_features
+from pyds.pyds import ChannelPool, Modes, ModuleExtendedUDS, ModuleStates, change_session
+from pyds.extuds import ExtendedUDS
+from pyds.structs import SecurityType
+from pyds.data import Vehicles, Mazda3_2015
+
+import uds
 
 
 class Pyds_Test(unittest.TestCase):
@@ -42,6 +53,10 @@ class Pyds_Test(unittest.TestCase):
         ret = unlock_rbcm_features({0xde00: de00data_obj, 0xde01: de01data_obj})
         self.assertEqual(ret[0xde00].to_bytearray(), de00data_mod)
         self.assertEqual(ret[0xde01].to_bytearray(), de01data_mod)
+        self.assertEqual(ret[0xde00].diff(), [(1, bytearray([0x50]), bytearray([0xD0])),
+                                              (9, bytearray([0x08]), bytearray([0x20]))])
+        self.assertFalse(de00data_obj.changed())
+        self.assertEqual(de00data_obj.to_bytearray(), de00data)
 
     def test_enable_scbs_r(self):
         f106data = bytearray([0x19, 0x96, 0x00, 0x80, 0xff,
@@ -105,3 +120,115 @@ class Pyds_Test(unittest.TestCase):
 
         ret = unlock_ic_features({0xf106: f106data_obj})
         self.assertEqual(ret[0xf106].to_bytearray(), f106data_mod)
+
+
+class ChannelPool_Test(unittest.TestCase):
+    def test_pool(self):
+        device = Mock()
+        pool = ChannelPool(device, max_filters=2, idle_timeout=None)
+
+        rbcm = pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
+        psm = pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.PSM)
+        self.assertIs(pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM).__subject__,
+                      rbcm.__subject__)
+        self.assertEqual(device.connect.call_count, 1)
+        self.assertEqual(device.connect.return_value.setJ1962Pins.call_count, 1)
+
+        # Third address pair on the MS bus
+        pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.EATC)
+        new_psm = pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.PSM)
+        self.assertIsNot(new_psm.__subject__, psm.__subject__)
+        # The channels of a physical channel share its lock
+        self.assertIs(new_psm.lock, rbcm.lock)
+
+        # The module states belong to the pool
+        self.assertIs(new_psm.session_state, pool.states.session_states[(Vehicles.Mazda3_2015, Mazda3_2015.PSM)])
+        self.assertIs(new_psm.session_state, psm.session_state)
+
+        # HS bus
+        pcm = pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.PCM)
+        self.assertIsNot(pcm.lock, rbcm.lock)
+        self.assertEqual(device.connect.call_count, 2)
+        self.assertEqual(len(pool), 2)
+
+        self.assertEqual(pool.stats, {'hits': 4, 'misses': 2, 'filter_hits': 1, 'filter_misses': 5, 'evictions': 2,
+                                      'disconnections': 0})
+
+        # Lower limit
+        pool.max_filters = 1
+        eatc = pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.EATC)
+        self.assertEqual(pool.stats['evictions'], 3)
+        self.assertIs(pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.EATC).__subject__,
+                      eatc.__subject__)
+        pool.close()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(device.connect.return_value.disconnect.call_count, 2)
+        self.assertEqual(pool.stats['disconnections'], 2)
+
+    def test_idle(self):
+        device = Mock()
+        pool = ChannelPool(device, idle_timeout=10.0)
+        with patch('time.time', return_value=100.0):
+            pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
+        with patch('time.time', return_value=105.0):
+            pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
+        with patch('time.time', return_value=120.0):
+            pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
+        self.assertEqual(device.connect.call_count, 2)
+        self.assertEqual(device.connect.return_value.disconnect.call_count, 1)
+        self.assertEqual(pool.stats['disconnections'], 1)
+
+        # A referenced channel isn't disconnected
+        with patch('time.time', return_value=140.0):
+            rbcm = pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
+        with patch('time.time', return_value=160.0):
+            pool.close_idle()
+        self.assertEqual(len(pool), 1)
+        del rbcm
+        with patch('time.time', return_value=160.0):
+            pool.close_idle()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.stats['disconnections'], 3)
+
+        # A failed disconnection isn't counted
+        pool.get_module_channel(Modes.normal, Vehicles.Mazda3_2015, Mazda3_2015.RBCM)
+        device.connect.return_value.disconnect.side_effect = Exception("Channel in use")
+        pool.close()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.stats['disconnections'], 3)
+
+
+class UDS(object):
+    pass
+
+
+class ChangeSession_Test(unittest.TestCase):
+    def test_change_session(self):
+        uds_channel = UDS()
+        uds_channel.send = Mock(side_effect=[
+            uds.UDSMessage(bytearray([0x50, 0x03])),
+            uds.UDSMessage(bytearray([0x67, 0x03, 0x11, 0x22, 0x33])),
+            uds.UDSMessage(bytearray([0x67, 0x04])),
+            uds.UDSMessage(bytearray([0x50, 0x01])),
+        ])
+        states = ModuleStates()
+        channel = ModuleExtendedUDS(ExtendedUDS(uds_channel, False), Vehicles.Mazda3_2015, Mazda3_2015.RBCM, states)
+
+        change_session(channel, SecurityType.IOControl)
+        self.assertEqual(uds_channel.send.call_count, 3)
+
+        # Same session and level, also from another channel of the module
+        change_session(channel, SecurityType.Config)
+        other_channel = ModuleExtendedUDS(ExtendedUDS(uds_channel, False), Vehicles.Mazda3_2015, Mazda3_2015.RBCM,
+                                          states)
+        change_session(other_channel, SecurityType.Config)
+        self.assertEqual(uds_channel.send.call_count, 3)
+
+        # The states aren't shared with the channels of other owners
+        unrelated_channel = ModuleExtendedUDS(ExtendedUDS(uds_channel, False), Vehicles.Mazda3_2015,
+                                              Mazda3_2015.RBCM)
+        self.assertIsNone(unrelated_channel.session_state.session)
+
+        change_session(channel)
+        change_session(channel)
+        self.assertEqual(uds_channel.send.call_count, 4)
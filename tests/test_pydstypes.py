@@ -23,8 +23,10 @@ __author__ = "Yann Diorcet"
 __license__ = "GPL"
 __version__ = "0.0.1"
 
+import random
 import unittest
-from pyds.types import MCP_BCE_2, Read
+from pyds.types import MCP_BCE_2, Read, Normal, Schema
+from pyds.structs import Field
 
 
 class Read_Test(unittest.TestCase):
@@ -167,3 +169,121 @@ class MCP_BCE_2_Test(unittest.TestCase):
         self.assertEqual(bs.get_value(35, 3), 0x2)  # on
         bs.set_value(35, 3, 0x1)
         self.assertEqual(bs.to_bytearray(), mod)
+
+
+class BitField_Test(unittest.TestCase):
+    # Compare with the bit list implementation
+    def test_reference(self):
+        rand = random.Random(0)
+        for cls in (MCP_BCE_2, Read, Normal):
+            for i in range(200):
+                data = bytearray([rand.randint(0, 255) for x in range(rand.randint(1, 16))])
+                bs = cls(data)
+                bits = cls._bytearraytobitarray(data)
+                for j in range(4):
+                    mask = (1 << rand.randint(1, min(len(bits), 17))) - 1
+                    offset = rand.randint(0, len(bits) - mask.bit_length())
+                    self.assertEqual(bs.get_value(offset, mask), cls._get_value(bits, offset, mask))
+                    value = rand.randint(0, mask)
+                    bs.set_value(offset, mask, value)
+                    cls._set_value(bits, offset, mask, value)
+                    self.assertEqual(bs.to_bytearray(), cls._bitarraytobytearray(bits))
+
+    # Copy on write
+    def test_view(self):
+        reply = bytearray([0x62, 0xDE, 0x01, 0x00, 0x38, 0x10, 0xa0, 0x50])
+        bs = MCP_BCE_2(memoryview(reply)[3:], copy=False)
+        self.assertTrue(bs.shared)
+        self.assertEqual(bs.get_value(19, 3), 0x2)
+        reply[5] = 0x08
+        self.assertEqual(bs.get_value(19, 3), 0x1)
+        bs.set_value(19, 3, 0x2)
+        self.assertFalse(bs.shared)
+        self.assertEqual(reply, bytearray([0x62, 0xDE, 0x01, 0x00, 0x38, 0x08, 0xa0, 0x50]))
+        self.assertEqual(bs.to_bytearray(), bytearray([0x00, 0x38, 0x10, 0xa0, 0x50]))
+
+    def test_diff(self):
+        bs = Read(bytearray([0x00, 0xa7, 0x00, 0x00]))
+        self.assertFalse(bs.changed())
+        bs.set_value(8, 0xff, 0x00)
+        bs.set_value(24, 0xff, 0x00)
+        self.assertEqual(bs.modified(), [(8, 8), (24, 8)])
+        self.assertFalse(bs.changed())
+        bs.set_value(0, 0xffff, 0x1234)
+        self.assertEqual(bs.diff(), [(2, bytearray([0x00, 0x00]), bytearray([0x12, 0x34]))])
+        bs.set_value(28, 0xf, 0xf)
+        self.assertEqual(bs.diff(), [(0, bytearray([0x00]), bytearray([0xf0])),
+                                     (2, bytearray([0x00, 0x00]), bytearray([0x12, 0x34]))])
+        bs.clean()
+        self.assertEqual(bs.modified(), [])
+        self.assertFalse(bs.changed())
+
+    def test_diff_view(self):
+        reply = bytearray([0x62, 0xDE, 0x01, 0x00, 0x38, 0x10, 0xa0, 0x50])
+        bs = MCP_BCE_2(memoryview(reply)[3:], copy=False)
+        bs.set_value(19, 3, 0x2)
+        self.assertFalse(bs.changed())
+        bs.set_value(19, 3, 0x1)
+        bs.set_value(26, 7, 0x5)
+        self.assertEqual(bs.diff(), [(2, bytearray([0x10, 0xa0]), bytearray([0x08, 0xa8]))])
+
+    def test_fork(self):
+        bs = MCP_BCE_2(bytearray([0x00, 0x38, 0x10, 0xa0, 0x50]))
+        bs.set_value(0, 15, 0x1)
+        bs2 = bs.fork()
+        bs2.set_value(19, 3, 0x1)
+        bs.set_value(26, 7, 0x5)
+        self.assertEqual(bs.to_bytearray(), bytearray([0x10, 0x38, 0x10, 0xa8, 0x50]))
+        self.assertEqual(bs2.to_bytearray(), bytearray([0x10, 0x38, 0x08, 0xa0, 0x50]))
+        self.assertEqual(bs2.diff(), [(0, bytearray([0x00]), bytearray([0x10])),
+                                      (2, bytearray([0x10]), bytearray([0x08]))])
+
+    def test_invalid(self):
+        bs = Normal(bytearray([0x00, 0x00]))
+        self.assertEqual(len(bs), 16)
+        with self.assertRaises(Exception):
+            bs.get_value(0, 0x5)
+        with self.assertRaises(Exception):
+            bs.get_value(12, 0x1f)
+        with self.assertRaises(Exception):
+            bs.set_value(16, 0x1, 1)
+        self.assertEqual(bs.to_bytearray(), bytearray([0x00, 0x00]))
+
+
+class Schema_Test(unittest.TestCase):
+    def test_decode(self):
+        data = bytearray([0x00, 0x38, 0x10, 0xa0, 0x50])
+        schema = Schema('MCP_BCE_2', [
+            Field('auto_door_lock', 0, 15),
+            Field('interior_light_door_close', 8, 7),
+            Field('three_flashes_turn', 19, 3),
+            Field('head_light', 26, 7),
+            Field('coming_home_light', 32, 7),
+        ], 5)
+        bs = MCP_BCE_2(data)
+        values = schema.decode(data)
+        for field in schema.fields:
+            self.assertEqual(values[field.name], bs.get_value(field.offset, field.mask))
+        self.assertEqual(schema.decode(bs), values)
+
+    def test_encode(self):
+        rand = random.Random(0)
+        for type, cls in (('MCP_BCE_2', MCP_BCE_2), ('Read', Read), ('Normal', Normal)):
+            schema = Schema(type, [Field('a', 3, 0x1f), Field('b', 9, 0x1), Field('c', 12, 0xfff)], 4)
+            data = bytearray([rand.randint(0, 255) for x in range(4)])
+            values = {'a': 0x15, 'b': 0x1, 'c': 0xabc}
+            bs = cls(data)
+            schema.update(bs, values)
+            self.assertEqual(schema.encode(data, values), bs.to_bytearray())
+            self.assertEqual(schema.decode(bs), values)
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            Schema('Normal', [Field('a', 0, 1), Field('a', 1, 1)])
+        with self.assertRaises(Exception):
+            Schema('Normal', [Field('a', 7, 3)], 1)
+        schema = Schema('Normal', [Field('a', 7, 3)])
+        with self.assertRaises(Exception):
+            schema.decode(bytearray([0x00]))
+        with self.assertRaises(Exception):
+            schema.encode(bytearray([0x00, 0x00]), {'b': 1})
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import sys
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import uds
+
+from pyds.extuds import ExtendedUDS
+from pyds.data import Vehicles, Mazda3_2015, vehicles_data
+from pyds.structs import CanBus
+
+if sys.version_info >= (3, 6):
+    from pyds.pyds import ModuleExtendedUDS
+    from pyds.scan import run_scan
+else:
+    run_scan = None
+
+
+class UDS(object):
+    def __init__(self, bus, stats, absent=False):
+        self._bus = bus
+        self._stats = stats
+        self._absent = absent
+
+    def send(self, message, timeout):
+        data = message.getData()
+        with self._stats['lock']:
+            self._stats[self._bus] += 1
+            self._stats['max'][self._bus] = max(self._stats['max'][self._bus], self._stats[self._bus])
+            self._stats['max']['all'] = max(self._stats['max']['all'], self._stats[CanBus.HS] + self._stats[CanBus.MS])
+        time.sleep(0.02)
+        with self._stats['lock']:
+            self._stats[self._bus] -= 1
+
+        # Only one DID per request, 0xf111 is not supported, the EATC doesn't answer
+        if self._absent:
+            with self._stats['lock']:
+                self._stats['absent'] += 1
+            raise Exception("Timeout")
+        if len(data) > 3:
+            return uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x13]))
+        if data[1:3] == bytearray([0xF1, 0x11]):
+            return uds.UDSNegativeResponseMessage(bytearray([0x7F, 0x22, 0x31]))
+        return uds.UDSMessage(bytearray([0x62]) + data[1:3] + data[1:3])
+
+
+@unittest.skipIf(run_scan is None, "asynchronous generators are not available")
+class Scan_Test(unittest.TestCase):
+    def test_scan(self):
+        vehicle = Vehicles.Mazda3_2015
+        modules = vehicles_data[vehicle].modules
+        stats = {'lock': threading.Lock(), CanBus.HS: 0, CanBus.MS: 0, 'max': {CanBus.HS: 0, CanBus.MS: 0, 'all': 0},
+                 'absent': 0}
+
+        def get_module_channel(mode, vehicle, module):
+            uds_channel = UDS(modules[module].bus, stats, module == Mazda3_2015.EATC)
+            return ModuleExtendedUDS(ExtendedUDS(uds_channel, False), vehicle, module)
+
+        requests = [(module, did) for module in modules for did in [0xf188, 0xf190, 0xf111]]
+        results = []
+        pool = mock.Mock()
+        pool.get_module_channel = mock.Mock(side_effect=get_module_channel)
+        run_scan(pool, None, vehicle, requests, results.append)
+        # The channels come from the pool of the shell
+        self.assertEqual(pool.get_module_channel.call_count, len(modules))
+
+        self.assertEqual(sorted([(result.module.value, result.did) for result in results]),
+                         sorted([(module.value, did) for module, did in requests]))
+        for result in results:
+            if result.did == 0xf111 or result.module == Mazda3_2015.EATC:
+                self.assertIsNotNone(result.error)
+            else:
+                self.assertIsNone(result.error)
+                self.assertEqual(result.data, ExtendedUDS.int16tobytes(result.did))
+
+        # The buses overlap and the modules of a bus are read one at a time
+        self.assertEqual(stats['max'][CanBus.HS], 1)
+        self.assertEqual(stats['max'][CanBus.MS], 1)
+        self.assertEqual(stats['max']['all'], 2)
+
+        # The absent module is skipped after its batched read
+        self.assertEqual(stats['absent'], 1)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import random
+import unittest
+from pyds.structs import Algorithm
+from pyds.secalgo import FordCommon14229Security, FordCommon14229SecurityTable, get_security_algorithm
+
+
+class FordCommon14229Security_Test(unittest.TestCase):
+    def test_table(self):
+        rand = random.Random(0)
+        for i in range(2000):
+            vehicle_seed = [rand.randint(0, 255) for x in range(5)] + [0]
+            session_seed = bytearray([rand.randint(0, 255) for x in range(3)])
+            self.assertEqual(FordCommon14229SecurityTable(vehicle_seed).compute(session_seed),
+                             FordCommon14229Security(vehicle_seed).compute(session_seed))
+
+    def test_engines(self):
+        vehicle_seed = [75, 48, 50, 49, 54, 0]
+        session_seed = bytearray([0x12, 0x34, 0x56])
+        reference = get_security_algorithm(Algorithm.Ford, vehicle_seed, engine='reference')
+        table = get_security_algorithm(Algorithm.Ford, vehicle_seed)
+        self.assertIsInstance(reference, FordCommon14229Security)
+        self.assertIsInstance(table, FordCommon14229SecurityTable)
+        self.assertEqual(table.compute(session_seed), reference.compute(session_seed))
+        with self.assertRaises(Exception):
+            get_security_algorithm(Algorithm.Ford, vehicle_seed, engine='invalid')
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import random
+import unittest
+
+try:
+    import numpy
+    from pyds.secbatch import compute_keys, seeds_from_int
+except ImportError:
+    numpy = None
+
+from pyds.secalgo import FordCommon14229Security
+
+
+@unittest.skipIf(numpy is None, "NumPy is not available")
+class ComputeKeys_Test(unittest.TestCase):
+    def test_compute_keys(self):
+        rand = random.Random(0)
+        vehicle_seed = [75, 48, 50, 49, 54, 0]
+        session_seeds = [[rand.randint(0, 255) for x in range(3)] for i in range(500)]
+        keys = compute_keys(session_seeds, vehicle_seed)
+        self.assertEqual(keys.shape, (500, 3))
+        algo = FordCommon14229Security(vehicle_seed)
+        for session_seed, key in zip(session_seeds, keys):
+            self.assertEqual(bytearray(key.tobytes()), algo.compute(bytearray(session_seed)))
+
+    def test_vehicle_seeds(self):
+        rand = random.Random(1)
+        vehicle_seeds = [[rand.randint(0, 255) for x in range(5)] for i in range(4)]
+        session_seeds = seeds_from_int([0x000000, 0x123456, 0xffffff])
+        keys = compute_keys(session_seeds[:, numpy.newaxis, :], vehicle_seeds)
+        self.assertEqual(keys.shape, (3, 4, 3))
+        for i, session_seed in enumerate(session_seeds):
+            for j, vehicle_seed in enumerate(vehicle_seeds):
+                self.assertEqual(bytearray(keys[i, j].tobytes()),
+                                 FordCommon14229Security(vehicle_seed + [0]).compute(bytearray(list(session_seed))))
+
+    def test_processes(self):
+        session_seeds = seeds_from_int(numpy.arange(0, 1 << 24, 4099))
+        vehicle_seed = [78, 83, 89, 78, 83]
+        keys = compute_keys(session_seeds, vehicle_seed)
+        self.assertTrue((compute_keys(session_seeds, vehicle_seed, processes=2, chunk_size=1000) == keys).all())
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            compute_keys([[0, 0]], [0, 0, 0, 0, 0])
+        with self.assertRaises(ValueError):
+            compute_keys([[0, 0, 0]], [0, 0, 0])
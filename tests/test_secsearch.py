@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import random
+import unittest
+
+from pyds.secalgo import FordCommon14229Security
+from pyds.secsearch import search
+
+
+class SecuritySearch_Test(unittest.TestCase):
+    def _capture(self, secret, count, rand):
+        algo = FordCommon14229Security(secret + [0])
+        pairs = []
+        for i in range(count):
+            seed = bytearray([rand.randint(0, 255) for x in range(3)])
+            pairs.append((seed, algo.compute(seed)))
+        return pairs
+
+    def test_search(self):
+        rand = random.Random(0)
+        secret = [75, 48, 50, 49, 54]
+        pairs = self._capture(secret, 3, rand)
+        candidates = search(pairs)
+        self.assertEqual(len(candidates), 1 << 16)
+        self.assertIn(bytearray(secret), candidates)
+        self.assertIn(bytearray(secret), search(pairs, True))
+
+        # Every candidate gives the captured keys and the keys of unseen seeds
+        other_pairs = self._capture(secret, 10, rand)
+        for candidate in rand.sample(candidates, 20):
+            algo = FordCommon14229Security(list(candidate) + [0])
+            for seed, key in pairs + other_pairs:
+                self.assertEqual(algo.compute(seed), key)
+
+    def test_inconsistent(self):
+        rand = random.Random(1)
+        pairs = self._capture([75, 48, 50, 49, 54], 2, rand) + self._capture([1, 2, 3, 4, 5], 1, rand)
+        with self.assertRaises(Exception):
+            search(pairs)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pyds.structs import Algorithm
+from pyds.secalgo import FordCommon14229Security
+from pyds.sectable import SecurityTable, generate_table, get_table_path, get_security_algorithm, close_tables
+
+
+class SecurityTable_Test(unittest.TestCase):
+    vehicle_seed = [75, 48, 50, 49, 54, 0]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        close_tables()
+        shutil.rmtree(self.directory)
+
+    def test_fallback(self):
+        algo = get_security_algorithm(Algorithm.Ford, self.vehicle_seed, self.directory)
+        self.assertNotIsInstance(algo, SecurityTable)
+        algo = get_security_algorithm(Algorithm.Ford, self.vehicle_seed)
+        self.assertNotIsInstance(algo, SecurityTable)
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_table(self):
+        path = get_table_path(self.directory, Algorithm.Ford, self.vehicle_seed)
+        generate_table(path, Algorithm.Ford, self.vehicle_seed, processes=2)
+
+        algo = get_security_algorithm(Algorithm.Ford, self.vehicle_seed, self.directory)
+        self.assertIsInstance(algo, SecurityTable)
+        reference = FordCommon14229Security(self.vehicle_seed)
+        rand = random.Random(0)
+        for session_seed in [[0, 0, 0], [0xff, 0xff, 0xff]] + [[rand.randint(0, 255) for x in range(3)]
+                                                               for i in range(500)]:
+            self.assertEqual(algo.compute(bytearray(session_seed)), reference.compute(bytearray(session_seed)))
+
+        # The table is opened once
+        self.assertIs(get_security_algorithm(Algorithm.Ford, self.vehicle_seed, self.directory), algo)
+        close_tables()
+        self.assertTrue(algo.closed)
+        algo = get_security_algorithm(Algorithm.Ford, self.vehicle_seed, self.directory)
+        self.assertFalse(algo.closed)
+        algo.close()
+
+        # Another secret must not use this table
+        with self.assertRaises(Exception):
+            SecurityTable(path, Algorithm.Ford, [1, 2, 3, 4, 5, 0])
+        other_path = get_table_path(self.directory, Algorithm.Ford, [1, 2, 3, 4, 5, 0])
+        os.rename(path, other_path)
+        algo = get_security_algorithm(Algorithm.Ford, [1, 2, 3, 4, 5, 0], self.directory)
+        self.assertNotIsInstance(algo, SecurityTable)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2016 Yann Diorcet
+#
+# This file is part of PYDS.  PYDS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Fix Python 2.x.
+from __future__ import print_function
+
+__author__ = "Yann Diorcet"
+__license__ = "GPL"
+__version__ = "0.0.1"
+
+
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import uds
+
+from pyds.extuds import ExtendedUDS, checksum_routine
+
+
+class UploadECU(object):
+    """
+    Simulated ECU serving RequestUpload/TransferData from a memory image
+    """
+
+    def __init__(self, image, base, block_length=0x102, fail_after=None):
+        self.image = image
+        self.base = base
+        self.block_length = block_length
+        self.fail_after = fail_after
+        self.requests = []
+        self.address = None
+
+    def send(self, message, timeout):
+        data = message.getData()
+        self.requests.append(bytearray(data))
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise Exception("Timeout")
+            self.fail_after -= 1
+        sid = data[0]
+        if sid == uds.UDS_SERVICES_RU:
+            addr_s = data[2] & 0x0F
+            size_s = (data[2] >> 4) & 0x0F
+            self.address = ExtendedUDS.bytestoint(data[3:3 + addr_s]) - self.base
+            self.end = self.address + ExtendedUDS.bytestoint(data[3 + addr_s:3 + addr_s + size_s])
+            self.bsc = 1
+            self.last = None
+            return uds.UDSMessage(bytearray([0x75, 0x20]) + ExtendedUDS.int16tobytes(self.block_length))
+        if sid == uds.UDS_SERVICES_TD:
+            if self.address is None:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x24]))
+            if self.last is not None and data[1] == (self.bsc - 1) % 256:
+                # Repeated request
+                return uds.UDSMessage(bytearray([0x76, data[1]]) + self.last)
+            if data[1] != self.bsc:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x73]))
+            length = min(self.block_length - 2, self.end - self.address)
+            self.last = self.image[self.address:self.address + length]
+            self.address += length
+            self.bsc = (self.bsc + 1) % 256
+            return uds.UDSMessage(bytearray([0x76, data[1]]) + self.last)
+        if sid == uds.UDS_SERVICES_RTE:
+            self.address = None
+            return uds.UDSMessage(bytearray([0x77]))
+        return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x11]))
+
+
+class DownloadECU(object):
+    """
+    Simulated ECU serving RequestDownload/TransferData to a memory, with a checksum routine and ReadMemoryByAddress
+    """
+
+    def __init__(self, size, base, block_length=0x102, pending_every=None, lost_every=None, corrupt=False):
+        self.memory = bytearray(size)
+        self.base = base
+        self.block_length = block_length
+        self.pending_every = pending_every
+        self.lost_every = lost_every
+        self.corrupt = corrupt
+        self.requests = []
+        self.writes = 0
+        self.address = None
+        self.pending = None
+
+    def send(self, message, timeout):
+        if message is None:
+            reply, self.pending = self.pending, None
+            return reply
+        data = message.getData()
+        self.requests.append(bytearray(data))
+        reply = self.handle(data)
+        if self.pending_every is not None and len(self.requests) % self.pending_every == 0:
+            self.pending = reply
+            return uds.UDSMessage(bytearray([0x7F, data[0], uds.UDS_RESPONSE_CODES_RCRRP]))
+        if self.lost_every is not None and len(self.requests) % self.lost_every == 0:
+            raise Exception("Timeout")
+        return reply
+
+    def handle(self, data):
+        sid = data[0]
+        if sid == uds.UDS_SERVICES_RD:
+            addr_s = data[2] & 0x0F
+            size_s = (data[2] >> 4) & 0x0F
+            self.address = ExtendedUDS.bytestoint(data[3:3 + addr_s]) - self.base
+            self.end = self.address + ExtendedUDS.bytestoint(data[3 + addr_s:3 + addr_s + size_s])
+            self.bsc = 1
+            return uds.UDSMessage(bytearray([0x74, 0x20]) + ExtendedUDS.int16tobytes(self.block_length))
+        if sid == uds.UDS_SERVICES_TD:
+            if self.address is None:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x24]))
+            if data[1] == (self.bsc - 1) % 256:
+                # Repeated block
+                return uds.UDSMessage(bytearray([0x76, data[1]]))
+            if data[1] != self.bsc:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x73]))
+            record = data[2:]
+            if len(record) + 2 > self.block_length or self.address + len(record) > self.end:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x71]))
+            self.memory[self.address:self.address + len(record)] = record
+            if self.corrupt and self.writes == 10:
+                self.memory[self.address] ^= 0xFF
+            self.writes += 1
+            self.address += len(record)
+            self.bsc = (self.bsc + 1) % 256
+            return uds.UDSMessage(bytearray([0x76, data[1]]))
+        if sid == uds.UDS_SERVICES_RTE:
+            if self.address != self.end:
+                return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x24]))
+            self.address = None
+            return uds.UDSMessage(bytearray([0x77]))
+        if sid == uds.UDS_SERVICES_RMBA:
+            addr_s = data[1] & 0x0F
+            size_s = (data[1] >> 4) & 0x0F
+            address = ExtendedUDS.bytestoint(data[2:2 + addr_s]) - self.base
+            size = ExtendedUDS.bytestoint(data[2 + addr_s:2 + addr_s + size_s])
+            return uds.UDSMessage(bytearray([0x63]) + self.memory[address:address + size])
+        if sid == uds.UDS_SERVICES_RC and data[1:4] == bytearray([0x01, 0x02, 0x02]):
+            valid = struct.pack(">I", zlib.crc32(bytes(self.memory)) & 0xFFFFFFFF) == bytes(data[4:])
+            return uds.UDSMessage(bytearray([0x71, 0x01, 0x02, 0x02, 0x00 if valid else 0x01]))
+        return uds.UDSNegativeResponseMessage(bytearray([0x7F, sid, 0x11]))
+
+
+class Upload_Test(unittest.TestCase):
+    base = 0xFFF88800
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rand = random.Random(0)
+        # More than 256 blocks for the block sequence counter to wrap
+        self.image = bytearray([rand.randint(0, 255) for i in range(0x100 * 300 + 17)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_upload(self):
+        ecu = UploadECU(self.image, self.base)
+        channel = ExtendedUDS(ecu, False)
+        progress = []
+        data = channel.upload((self.base, 4), (len(self.image), 4),
+                              progress=lambda done, size, rate: progress.append(done))
+        self.assertEqual(data, self.image)
+        self.assertEqual(progress[0], 0)
+        self.assertEqual(progress[-1], len(self.image))
+        self.assertLess(len(progress), 10)
+        self.assertEqual(ecu.requests[1], bytearray([0x36, 0x01]))
+        self.assertEqual(ecu.requests[255], bytearray([0x36, 0xFF]))
+        self.assertEqual(ecu.requests[256], bytearray([0x36, 0x00]))
+        self.assertEqual(ecu.requests[-1], bytearray([0x37]))
+
+    def test_upload_file(self):
+        path = os.path.join(self.directory, 'dump.bin')
+        channel = ExtendedUDS(UploadECU(self.image, self.base), False)
+        self.assertEqual(channel.upload((self.base, 4), (len(self.image), 4), path), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.image)
+
+    def test_resume(self):
+        path = os.path.join(self.directory, 'dump.bin')
+        checkpoint = os.path.join(self.directory, 'dump.json')
+
+        # Interrupted transfer which the ECU can continue
+        ecu = UploadECU(self.image, self.base, fail_after=100)
+        channel = ExtendedUDS(ecu, False)
+        with self.assertRaises(Exception):
+            channel.upload((self.base, 4), (len(self.image), 4), path, checkpoint=checkpoint)
+        self.assertTrue(os.path.exists(checkpoint))
+        ecu.fail_after = None
+        ecu.requests = []
+        channel.upload((self.base, 4), (len(self.image), 4), path, checkpoint=checkpoint)
+        self.assertEqual(ecu.requests[0][0], uds.UDS_SERVICES_TD)
+        self.assertFalse(os.path.exists(checkpoint))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.image)
+
+    def test_resume_without_output(self):
+        channel = ExtendedUDS(UploadECU(self.image, self.base), False)
+        with self.assertRaises(ValueError):
+            channel.upload((self.base, 4), (len(self.image), 4), checkpoint=os.path.join(self.directory, 'dump.json'))
+
+    def test_resume_new_request(self):
+        path = os.path.join(self.directory, 'dump.bin')
+        checkpoint = os.path.join(self.directory, 'dump.json')
+
+        ecu = UploadECU(self.image, self.base, fail_after=150)
+        channel = ExtendedUDS(ecu, False)
+        with self.assertRaises(Exception):
+            channel.upload((self.base, 4), (len(self.image), 4), path, checkpoint=checkpoint)
+
+        # The ECU has lost the transfer, the rest is requested again
+        ecu = UploadECU(self.image, self.base)
+        channel = ExtendedUDS(ecu, False)
+        channel.upload((self.base, 4), (len(self.image), 4), path, checkpoint=checkpoint)
+        self.assertEqual(ecu.requests[0][0], uds.UDS_SERVICES_TD)
+        self.assertEqual(ecu.requests[1][0], uds.UDS_SERVICES_RU)
+        self.assertNotEqual(ExtendedUDS.bytestoint(ecu.requests[1][3:7]), self.base)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.image)
+
+
+class Download_Test(unittest.TestCase):
+    base = 0xFFF88800
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rand = random.Random(0)
+        # More than 256 blocks for the block sequence counter to wrap
+        self.image = bytearray([rand.randint(0, 255) for i in range(0x100 * 300 + 17)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_download(self):
+        path = os.path.join(self.directory, 'image.bin')
+        with open(path, 'wb') as f:
+            f.write(self.image)
+        ecu = DownloadECU(len(self.image), self.base, pending_every=97)
+        channel = ExtendedUDS(ecu, False)
+        progress = []
+        stats = channel.download((self.base, 4), (len(self.image), 4), path, verify='read',
+                                 progress=lambda done, size, rate: progress.append(done))
+        self.assertEqual(ecu.memory, self.image)
+        self.assertEqual(stats['blocks'], 301)
+        self.assertGreater(stats['rate'], 0)
+        self.assertEqual(progress[-1], len(self.image))
+        self.assertEqual(ecu.requests[0][0], uds.UDS_SERVICES_RD)
+        # Blocks cut to the maxNumberOfBlockLength
+        self.assertEqual(len(ecu.requests[1]), 0x102)
+        self.assertEqual(ecu.requests[1][:2], bytearray([0x36, 0x01]))
+        self.assertEqual(ecu.requests[255][:2], bytearray([0x36, 0xFF]))
+        self.assertEqual(ecu.requests[256][:2], bytearray([0x36, 0x00]))
+        self.assertEqual(len(ecu.requests[301]), 2 + 17)
+        self.assertEqual(ecu.requests[302], bytearray([0x37]))
+
+    def test_lost_reply(self):
+        ecu = DownloadECU(len(self.image), self.base, lost_every=50)
+        channel = ExtendedUDS(ecu, False)
+        stats = channel.download((self.base, 4), (len(self.image), 4), self.image,
+                                 verify=checksum_routine(0x0202))
+        self.assertEqual(ecu.memory, self.image)
+        self.assertEqual(stats['repeats'], 6)
+        self.assertEqual(ecu.writes, 301)
+
+    def test_verify(self):
+        channel = ExtendedUDS(DownloadECU(len(self.image), self.base, corrupt=True), False)
+        with self.assertRaises(Exception):
+            channel.download((self.base, 4), (len(self.image), 4), self.image, verify=checksum_routine(0x0202))
+        channel = ExtendedUDS(DownloadECU(len(self.image), self.base, corrupt=True), False)
+        with self.assertRaises(Exception):
+            channel.download((self.base, 4), (len(self.image), 4), self.image, verify='read')